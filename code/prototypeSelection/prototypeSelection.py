@@ -27,6 +27,13 @@ winner. Currently implemented are:
 For completeness, the exact but exponential algorithm is implemented, too.
   "prototype_selection_exhaustive"
 
+Besides a skbio distance matrix, each function accepts any object with `ids`
+and `data` attributes, in which `data` is a square matrix or the condensed
+form of it (upper triangle, as in `scipy.spatial.distance.squareform`), such
+as a memory-mapped float32 matrix on disk (e.g., `utils.distmat.DistMat`).
+Matrices are read in blocks of rows, therefore peak memory is proportional to
+the number of elements times the block size, rather than its square.
+
 [1] Gamez, J. Esteban, François Modave, and Olga Kosheleva.
     "Selecting the most representative sample is NP-hard:
      Need for expert (fuzzy) knowledge."
@@ -39,6 +46,90 @@ from itertools import combinations
 
 import numpy as np
 import scipy as sp
+from skbio.stats.distance import DissimilarityMatrixError, MissingIDError
+
+
+# number of cells to read at once
+_block_cells = 2 ** 22
+
+
+def _num_elements(data):
+    '''Get the number of elements of a square or condensed matrix.'''
+    if data.ndim == 2:
+        return data.shape[0]
+    return int(round((1 + np.sqrt(1 + 8 * data.shape[0])) / 2))
+
+
+def _get_rows(data, rows, cols=None):
+    '''Read cells of given rows and columns of a distance matrix.
+
+    Parameters
+    ----------
+    data: np.ndarray
+        Square distance matrix, or its condensed form. Can be memory-mapped.
+    rows: array_like of int
+        Row indices.
+    cols: array_like of int, optional
+        Column indices. Default: all columns.
+
+    Returns
+    -------
+    np.ndarray of float64 of shape (len(rows), len(cols))
+        Distances.
+    '''
+    rows = np.asarray(rows, dtype=np.int64)
+    if data.ndim == 2:
+        res = data[rows] if cols is None else data[np.ix_(rows, cols)]
+        return np.asarray(res, dtype=np.float64)
+    n = _num_elements(data)
+    cols = np.arange(n) if cols is None else np.asarray(cols, dtype=np.int64)
+    lo = np.minimum(rows[:, None], cols[None, :])
+    hi = np.maximum(rows[:, None], cols[None, :])
+    diag = lo == hi
+    pos = np.where(diag, 0, lo * n - lo * (lo + 1) // 2 + (hi - lo - 1))
+    res = np.asarray(data[pos], dtype=np.float64)
+    res[diag] = 0
+    return res
+
+
+def _iter_blocks(data, rows=None):
+    '''Read a distance matrix in blocks of rows.
+
+    Parameters
+    ----------
+    data: np.ndarray
+        Square distance matrix, or its condensed form. Can be memory-mapped.
+    rows: array_like of int, optional
+        Row indices. Default: all rows.
+
+    Yields
+    ------
+    int
+        Position of the first row of the block in rows.
+    np.ndarray of float64 of shape (block, n)
+        Distances from each row to all elements.
+    '''
+    n = _num_elements(data)
+    size = max(1, _block_cells // max(n, 1))
+    if rows is None:
+        for start in range(0, n, size):
+            if data.ndim == 2:
+                yield start, np.asarray(data[start:start + size],
+                                        dtype=np.float64)
+            else:
+                yield start, _get_rows(
+                    data, np.arange(start, min(start + size, n)))
+    else:
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, rows.shape[0], size):
+            yield start, _get_rows(data, rows[start:start + size])
+
+
+def _get_index(dm):
+    '''Get a function that finds the index of an element by its ID.'''
+    if hasattr(dm, 'index'):
+        return dm.index
+    return {x: i for i, x in enumerate(dm.ids)}.__getitem__
 
 
 def _validate_parameters(dm, num_prototypes, seedset=None):
@@ -72,7 +163,7 @@ def _validate_parameters(dm, num_prototypes, seedset=None):
     if num_prototypes < 2:
         raise ValueError("'num_prototypes' must be >= 2, since a single "
                          "prototype is useless.")
-    if num_prototypes >= dm.shape[0]:
+    if num_prototypes >= len(dm.ids):
         raise ValueError("'num_prototypes' must be smaller than the number of "
                          "elements in the distance matrix, otherwise no "
                          "reduction is necessary.")
@@ -104,12 +195,43 @@ def distance_sum(elements, dm):
     float:
         The sum of all pairwise distances of dm for IDs in elements.
 
+    Raises
+    ------
+    MissingIDError
+        If an element is not in the distance matrix.
+    DissimilarityMatrixError
+        If elements are duplicated or empty.
+
     Notes
     -----
+    The submatrix of elements is not copied, but read in blocks of rows.
+
     function signature with type annotation for future use with python >= 3.5
     def distance_sum(elements: Sequence[str], dm: DistanceMatrix) -> float:
     '''
-    return np.tril(dm.filter(elements).data).sum()
+    elements = list(elements)
+    if not elements:
+        raise DissimilarityMatrixError('Data must be at least 1x1 in size.')
+    if len(set(elements)) < len(elements):
+        seen, dups = set(), []
+        for x in elements:
+            if x in seen and x not in dups:
+                dups.append(x)
+            seen.add(x)
+        raise DissimilarityMatrixError(
+            'IDs must be unique. Found the following duplicate IDs: %s' %
+            ', '.join(repr(x) for x in dups))
+    index = _get_index(dm)
+    try:
+        idx = np.array([index(x) for x in elements], dtype=np.int64)
+    except KeyError as e:
+        raise MissingIDError(e.args[0])
+
+    # sum of lower triangle, one block of rows at a time
+    res = 0.0
+    for start, rows in _iter_blocks(dm.data, idx):
+        res += np.tril(rows[:, idx], start).sum()
+    return res
 
 
 def prototype_selection_exhaustive(dm, num_prototypes, seedset=None,
@@ -238,7 +360,7 @@ def prototype_selection_constructive_maxdist(dm, num_prototypes, seedset=None):
     _validate_parameters(dm, num_prototypes, seedset)
 
     # initially mark all elements as uncovered, i.e. as not being a prototype
-    uncovered = np.asarray([np.True_] * dm.shape[0])
+    uncovered = np.asarray([np.True_] * len(dm.ids))
     res_set, num_found_prototypes = [], 0
 
     if seedset is not None:
@@ -251,21 +373,33 @@ def prototype_selection_constructive_maxdist(dm, num_prototypes, seedset=None):
     else:
         # the first two prototypes are those elements that have the globally
         # maximal distance in the distance matrix. Mark those two elements as
-        # being covered, i.e. prototypes
-        res_set = list(np.unravel_index(dm.data.argmax(), dm.data.shape))
+        # being covered, i.e. prototypes. The matrix is scanned one block of
+        # rows at a time.
+        max_val = None
+        for start, rows in _iter_blocks(dm.data):
+            i, j = np.unravel_index(rows.argmax(), rows.shape)
+            if max_val is None or rows[i, j] > max_val:
+                max_val, res_set = rows[i, j], [start + i, j]
         uncovered[res_set] = np.False_
 
     # counts the number of already found prototypes
     num_found_prototypes = len(res_set)
 
+    # sums of distances from prototypes to each element, which are updated
+    # with the distances from each new prototype
+    dist_sums = np.zeros(len(dm.ids))
+    for _, rows in _iter_blocks(dm.data, res_set):
+        dist_sums += rows.sum(axis=0)
+
     # repeat until enough prototypes have been selected:
     # the new prototype is the element that has maximal distance sum to all
     # non-prototype elements in the distance matrix.
     while num_found_prototypes < num_prototypes:
-        max_elm_idx = (dm.data[res_set, :].sum(axis=0) * uncovered).argmax()
+        max_elm_idx = (dist_sums * uncovered).argmax()
         uncovered[max_elm_idx] = np.False_
         num_found_prototypes += 1
         res_set.append(max_elm_idx)
+        dist_sums += _get_rows(dm.data, [max_elm_idx])[0]
 
     # return the ids of the selected prototype elements
     return [dm.ids[idx] for idx, x in enumerate(uncovered) if not x]
@@ -310,13 +444,19 @@ def _protoclass(dm, epsilon, seedset=None):
         The Annals of Applied Statistics (2011): 2403-2424.
     '''
 
-    # is an element (column) covered by the epsilon ball of another element
-    # (row)
-    B = dm.data < epsilon
+    # whether an element (column) is covered by the epsilon ball of another
+    # element (row), i.e., B = dm.data < epsilon, is evaluated one block of
+    # rows at a time rather than stored. As B is symmetric, column i of B is
+    # read as row i.
+    def covers(rows):
+        for _, block in _iter_blocks(dm.data, rows):
+            yield block < epsilon
+
     # tracks which elements are covered by prototypes
-    covered = np.zeros(dm.shape[0], dtype=bool)
+    covered = np.zeros(len(dm.ids), dtype=bool)
     # score is the number of other elements that falls within the epsilon ball
-    scores = B.sum(axis=0)
+    scores = np.concatenate([x.sum(axis=1) for x in covers(
+        np.arange(len(dm.ids)))])
     # found prototypes
     prototypes = []
 
@@ -325,6 +465,7 @@ def _protoclass(dm, epsilon, seedset=None):
     seeds = []
     if seedset is not None:
         seeds = list(seedset)
+        index = _get_index(dm)
 
     while True:
         # candidate for a new prototype is the element whose epsilon ball
@@ -337,17 +478,18 @@ def _protoclass(dm, epsilon, seedset=None):
                 # elements of the seedsets have been consumed. The loop then
                 # defaults to the normal routine, i.e. uses the scores.argmax()
                 # element as the next prototype
-                idx_max = dm.ids.index(seeds[0])
+                idx_max = index(seeds[0])
                 seeds = seeds[1:]
             # candidate is new prototype, add it to the list
             prototypes.append(idx_max)
             # which elements have been just covered by the new prototype
-            justcovered = B[:, idx_max] & np.logical_not(covered)
+            justcovered = next(covers([idx_max]))[0] & np.logical_not(covered)
             # update the global list of ever covered elements
             covered += justcovered
             # update the scores, i.e. which epsilon balls cover how many
             # uncovered elements
-            scores -= B[justcovered, :].sum(axis=0)
+            for x in covers(np.flatnonzero(justcovered)):
+                scores -= x.sum(axis=0)
         else:
             # break if no epsilon balls cover other elements
             break
@@ -416,8 +558,10 @@ def prototype_selection_constructive_protoclass(dm, num_prototypes, steps=100,
     # this function is basically a search for a suitable epsilon and wraps
     # the protoclass function
 
-    # initiate epsilon with a more or less arbitrary value
-    epsilon = dm.data.mean()
+    # initiate epsilon with a more or less arbitrary value: the mean of all
+    # cells of the matrix
+    epsilon = sum(x.sum() for _, x in _iter_blocks(dm.data)) / len(
+        dm.ids) ** 2
     # define how much epsilon should be changes in an iteration
     stepSize = 0.2
 
@@ -513,24 +657,32 @@ def prototype_selection_constructive_pMedian(dm, num_prototypes, seedset=None):
 
     if seedset is not None:
         # pre-populate the prototype list with seeds
-        prototypes = [(dm.ids).index(x) for x in seedset]
+        index = _get_index(dm)
+        prototypes = [index(x) for x in seedset]
         seedset = set(seedset)
     else:
         # add the one element whose distance is smallest to all other elements
         # as the first prototype.
-        prototypes.append(np.argmin(dm.data.sum(axis=1)))
+        prototypes.append(np.argmin(np.concatenate([
+            x.sum(axis=1) for _, x in _iter_blocks(dm.data)])))
+
+    # the smallest distance from each element to previously found prototypes,
+    # which is updated with the distances from each new prototype
+    minDists = np.full(len(dm.ids), np.inf)
+    for _, rows in _iter_blocks(dm.data, prototypes):
+        minDists = np.minimum(minDists, rows.min(axis=0))
 
     # repeat adding prototypes until the desired number is found.
     while len(prototypes) < num_prototypes:
         # for each element, we compute the smallest distance sum to each
         # previously found prototype ...
-        minVals = []
-        for i in range(0, dm.shape[0]):
-            m = (dm.data[prototypes+[i], :].min(axis=0)).sum()
-            minVals.append(m)
+        minVals = np.concatenate([np.minimum(x, minDists).sum(axis=1)
+                                  for _, x in _iter_blocks(dm.data)])
         # ... and add the element which overall has the smallest distance sum
         # as the next prototype.
-        prototypes.append(np.asarray(minVals).argmin())
+        prototypes.append(minVals.argmin())
+        minDists = np.minimum(minDists, _get_rows(
+            dm.data, [prototypes[-1]])[0])
 
     return [dm.ids[idx] for idx in prototypes]
 
@@ -588,14 +740,16 @@ def prototype_selection_destructive_maxdist(dm, num_prototypes, seedset=None):
     numRemain = len(dm.ids)
 
     # distances from each element to all others
-    currDists = dm.data.sum(axis=1)
+    currDists = np.concatenate([
+        x.sum(axis=1) for _, x in _iter_blocks(dm.data)])
 
     # a dirty hack to ensure that all elements of the seedset will be selected
     # last and thus make it into the resulting set
     maxVal = currDists.max()
     if seedset is not None:
+        index = _get_index(dm)
         for e in seedset:
-            currDists[dm.index(e)] = maxVal*2
+            currDists[index(e)] = maxVal*2
 
     # the element to remove first is the one that has smallest distance to all
     # other. "Removing" works by tagging its distance-sum as infinity. Plus, we
@@ -607,7 +761,7 @@ def prototype_selection_destructive_maxdist(dm, num_prototypes, seedset=None):
     while (numRemain > num_prototypes):
         # substract the distance to the removed element for all remaining
         # elements
-        currDists -= dm.data[minElmIdx]
+        currDists -= _get_rows(dm.data, [minElmIdx])[0]
         # find the next element to be removed, again as the one that is
         # closest to all others
         minElmIdx = currDists.argmin()
@@ -7,7 +7,13 @@
 # ----------------------------------------------------------------------------
 
 from unittest import TestCase, main
+from unittest.mock import patch
+from types import SimpleNamespace
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 
+import numpy as np
 from skbio.stats.distance import DistanceMatrix
 from skbio.stats.distance._base import (DissimilarityMatrixError,
                                         MissingIDError)
@@ -21,7 +27,58 @@ from prototypeSelection import (
     prototype_selection_constructive_protoclass,
     prototype_selection_constructive_pMedian,
     _protoclass,
-    distance_sum)
+    distance_sum,
+    _get_rows)
+
+
+def _baseline_constructive_maxdist(dm, num_prototypes, seedset=None):
+    # original implementation on the entire matrix, for comparison
+    uncovered = np.asarray([np.True_] * dm.shape[0])
+    if seedset is not None:
+        seedset = set(seedset)
+        res_set = [i for i, x in enumerate(dm.ids) if x in seedset]
+    else:
+        res_set = list(np.unravel_index(dm.data.argmax(), dm.data.shape))
+    uncovered[res_set] = np.False_
+    while len(res_set) < num_prototypes:
+        max_elm_idx = (dm.data[res_set, :].sum(axis=0) * uncovered).argmax()
+        uncovered[max_elm_idx] = np.False_
+        res_set.append(max_elm_idx)
+    return [dm.ids[idx] for idx, x in enumerate(uncovered) if not x]
+
+
+def _baseline_pMedian(dm, num_prototypes, seedset=None):
+    # original implementation on the entire matrix, for comparison
+    if seedset is not None:
+        prototypes = [(dm.ids).index(x) for x in seedset]
+    else:
+        prototypes = [np.argmin(dm.data.sum(axis=1))]
+    while len(prototypes) < num_prototypes:
+        minVals = []
+        for i in range(0, dm.shape[0]):
+            m = (dm.data[prototypes+[i], :].min(axis=0)).sum()
+            minVals.append(m)
+        prototypes.append(np.asarray(minVals).argmin())
+    return [dm.ids[idx] for idx in prototypes]
+
+
+def _baseline_destructive_maxdist(dm, num_prototypes, seedset=None):
+    # original implementation on the entire matrix, for comparison
+    numRemain = len(dm.ids)
+    currDists = dm.data.sum(axis=1)
+    maxVal = currDists.max()
+    if seedset is not None:
+        for e in seedset:
+            currDists[dm.index(e)] = maxVal*2
+    minElmIdx = currDists.argmin()
+    currDists[minElmIdx], numRemain = np.inf, numRemain-1
+    while (numRemain > num_prototypes):
+        currDists -= dm.data[minElmIdx]
+        minElmIdx = currDists.argmin()
+        currDists[minElmIdx], numRemain = np.inf, numRemain-1
+    return [dm.ids[idx]
+            for idx, dist in enumerate(currDists)
+            if dist != np.inf]
 
 
 class prototypeSelection(TestCase):
@@ -644,6 +701,80 @@ class prototypeSelection(TestCase):
             res)
         self.assertAlmostEqual(26.7457727563, distance_sum(res, self.dm100))
 
+    def test_memmap_and_condensed(self):
+        # results on memory-mapped square and condensed matrices, read in
+        # blocks of a few rows, are identical to those on skbio matrices
+        tmpdir = mkdtemp()
+        for dm in (self.dm20, self.dm100):
+            fp = join(tmpdir, 'square.npy')
+            np.save(fp, dm.data)
+            square = SimpleNamespace(ids=dm.ids,
+                                     data=np.load(fp, mmap_mode='r'))
+            fp = join(tmpdir, 'condensed.npy')
+            np.save(fp, dm.condensed_form())
+            condensed = SimpleNamespace(ids=list(dm.ids),
+                                        data=np.load(fp, mmap_mode='r'))
+            seedset = list(dm.ids[:2])
+            for func, args in (
+                    (prototype_selection_constructive_maxdist, ()),
+                    (prototype_selection_constructive_maxdist, (seedset,)),
+                    (prototype_selection_destructive_maxdist, ()),
+                    (prototype_selection_destructive_maxdist, (seedset,)),
+                    (prototype_selection_constructive_pMedian, ()),
+                    (prototype_selection_constructive_pMedian, (seedset,)),
+                    (prototype_selection_constructive_protoclass, ())):
+                exp = func(dm, 5, *args)
+                for obj in (square, condensed):
+                    with patch('prototypeSelection._block_cells', 3 * len(
+                            dm.ids)):
+                        self.assertListEqual(list(func(obj, 5, *args)),
+                                             list(exp))
+            exp = list(_protoclass(dm, 0.4, seedset))
+            self.assertListEqual(list(_protoclass(condensed, 0.4, seedset)),
+                                 exp)
+            elements = list(dm.ids[::3])
+            exp = distance_sum(elements, dm)
+            for obj in (square, condensed):
+                with patch('prototypeSelection._block_cells', len(dm.ids)):
+                    self.assertAlmostEqual(distance_sum(elements, obj), exp)
+            with self.assertRaises(MissingIDError):
+                distance_sum(['X'], condensed)
+            rows, cols = [3, 0, 3], [1, 3, 0, 2]
+            obs = _get_rows(condensed.data, rows, cols)
+            self.assertListEqual(obs.tolist(),
+                                 dm.data[np.ix_(rows, cols)].tolist())
+            del square, condensed
+        rmtree(tmpdir)
+
+    def test_ties_against_baseline(self):
+        # selections, of which many depend on how ties are broken, are
+        # identical to those of the original implementations, for matrices
+        # of few distinct values, either exact (integers) or not (decimals)
+        rng = np.random.default_rng(42)
+        for n, values in ((30, [1, 2, 3]), (40, [0.1, 0.2, 0.3]),
+                          (60, [0.1, 0.7, 1.3, 2.9])):
+            data = rng.choice(values, size=(n, n))
+            data = np.triu(data, 1) + np.triu(data, 1).T
+            ids = ['e%d' % i for i in range(n)]
+            dm = DistanceMatrix(data, ids)
+            condensed = SimpleNamespace(ids=ids, data=dm.condensed_form())
+            seedset = ids[5:7]
+            for func, base in (
+                    (prototype_selection_constructive_maxdist,
+                     _baseline_constructive_maxdist),
+                    (prototype_selection_constructive_pMedian,
+                     _baseline_pMedian),
+                    (prototype_selection_destructive_maxdist,
+                     _baseline_destructive_maxdist)):
+                for k in (3, n // 3, n - 2):
+                    for args in ((), (seedset,)):
+                        exp = base(dm, k, *args)
+                        self.assertListEqual(list(func(dm, k, *args)), exp)
+                        with patch('prototypeSelection._block_cells',
+                                   3 * n):
+                            self.assertListEqual(
+                                list(func(condensed, k, *args)), exp)
+
 
 if __name__ == '__main__':
     main()
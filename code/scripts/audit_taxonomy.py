@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Check the monophyly of every taxon at every rank in a tree.
+
+Usage:
+    audit_taxonomy.py tree.nwk rank_names.tsv > output.tsv
+
+Notes:
+    The genome-to-ranks table is the output of `taxdump_to_ranks.py`, or
+    "ranks.tsv" in the taxonomy directory: a header line of "genome" followed
+    by ranks, and one genome per line followed by its taxa at these ranks.
+    "" and "0" are considered null assignments. Genomes absent from the tree
+    are ignored, and tips absent from the table are considered unclassified.
+
+    The following properties will be reported for each taxon:
+    - count: number of tips assigned to the taxon
+    - lca: name of the lowest common ancestor (LCA) of these tips
+    - clade: number of tips descending from the LCA
+    - cladistic: uni, mono or poly
+    - monophyly: strict, relaxed or rejected, in which relaxed means that the
+    taxon consists of some but not all child clades of the LCA, such that its
+    monophyly cannot be rejected if the LCA is a polytomy
+
+    All taxa are classified by one traversal of the tree per rank, rather than
+    one traversal per taxon.
+"""
+
+import sys
+from skbio import TreeNode
+from utils.arraytree import ArrayTree, LCAIndex, audit_taxa
+
+from io import StringIO
+import unittest
+from unittest.mock import patch, mock_open
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    with open(sys.argv[1], 'r') as f:
+        tree = TreeNode.read(f)
+    with open(sys.argv[2], 'r') as f:
+        ranks, lineages = read_ranks(f)
+    print('rank\ttaxon\tcount\tlca\tclade\tcladistic\tmonophyly')
+    for row in audit_ranks(tree, ranks, lineages):
+        print('\t'.join(map(str, row)))
+
+
+def read_ranks(f):
+    """Read a genome-to-ranks table.
+
+    Parameters
+    ----------
+    f : iterable of str
+        lines of the table
+
+    Returns
+    -------
+    list of str
+        ranks
+    dict of list of str or None
+        genome to taxa at ranks (None if null)
+    """
+    ranks, lineages = None, {}
+    for line in f:
+        x = line.rstrip('\r\n').split('\t')
+        if ranks is None:
+            ranks = x[1:]
+            continue
+        lineages[x[0]] = [None if y in ('', '0') else y for y in x[1:]]
+    return ranks or [], lineages
+
+
+def audit_ranks(tree, ranks, lineages):
+    """Classify all taxa at all ranks in a tree.
+
+    Parameters
+    ----------
+    tree : skbio.TreeNode
+        reference tree
+    ranks : list of str
+        ranks
+    lineages : dict of list of str or None
+        genome to taxa at ranks
+
+    Yields
+    ------
+    tuple of (str, str, int, str, int, str, str)
+        rank, taxon, count, LCA name, clade size, cladistic property and
+        monophyly, by rank then taxon
+
+    See Also
+    --------
+    utils.arraytree.audit_taxa
+    """
+    tree = ArrayTree.from_treenode(tree)
+    index = LCAIndex(tree)
+    tips = [lineages.get(tree.names[x]) for x in tree.tips.tolist()]
+    for i, rank in enumerate(ranks):
+        res = audit_taxa(tree, [x[i] if x else None for x in tips], index)
+        for j, taxon in enumerate(res['taxa']):
+            name = tree.names[res['lca'][j]]
+            yield (rank, taxon, int(res['n'][j]),
+                   '' if name is None else name, int(res['clade'][j]),
+                   res['cladistic'][j], res['monophyly'][j])
+
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.nwk = '(((a,b)n4,(c,d)n5,(e,f)n6)n2,(g,(h,i)n7)n3)n1;'
+        self.ranks = ('genome\tphylum\tgenus\n'
+                      'a\tP1\tG1\n'
+                      'b\tP1\tG1\n'
+                      'c\tP1\tG2\n'
+                      'd\tP1\t\n'
+                      'e\tP2\tG3\n'
+                      'f\tP2\tG3\n'
+                      'g\tP1\tG2\n'
+                      'h\tP3\tG4\n'
+                      'x\tP3\tG4\n')
+
+    def test_read_ranks(self):
+        ranks, lineages = read_ranks(StringIO(self.ranks))
+        self.assertListEqual(ranks, ['phylum', 'genus'])
+        self.assertListEqual(lineages['d'], ['P1', None])
+        self.assertEqual(len(lineages), 9)
+        self.assertTupleEqual(read_ranks(StringIO('')), ([], {}))
+
+    def test_audit_ranks(self):
+        tree = TreeNode.read([self.nwk])
+        ranks, lineages = read_ranks(StringIO(self.ranks))
+        obs = list(audit_ranks(tree, ranks, lineages))
+        exp = [('phylum', 'P1', 5, 'n1', 9, 'poly', 'rejected'),
+               ('phylum', 'P2', 2, 'n6', 2, 'mono', 'strict'),
+               ('phylum', 'P3', 1, 'h', 1, 'uni', 'strict'),
+               ('genus', 'G1', 2, 'n4', 2, 'mono', 'strict'),
+               ('genus', 'G2', 2, 'n1', 9, 'poly', 'rejected'),
+               ('genus', 'G3', 2, 'n6', 2, 'mono', 'strict'),
+               ('genus', 'G4', 1, 'h', 1, 'uni', 'strict')]
+        self.assertListEqual(obs, exp)
+
+        # polytomic LCA
+        lineages['d'] = ['P1', 'G1']
+        lineages['c'] = ['P1', 'G1']
+        obs = list(audit_ranks(tree, ranks, lineages))
+        self.assertTupleEqual(obs[3], (
+            'genus', 'G1', 4, 'n2', 6, 'poly', 'relaxed'))
+
+    def test_main(self):
+        exp = ('rank\ttaxon\tcount\tlca\tclade\tcladistic\tmonophyly\n'
+               'phylum\tP1\t5\tn1\t9\tpoly\trejected\n')
+        files = {'tree.nwk': self.nwk, 'ranks.tsv': self.ranks}
+
+        def open_(fp, mode='r'):
+            return mock_open(read_data=files[fp])()
+
+        with patch('sys.argv', ['', 'tree.nwk', 'ranks.tsv']):
+            with patch('builtins.open', open_):
+                with patch('sys.stdout', new=StringIO()) as m:
+                    main()
+                    self.assertTrue(m.getvalue().startswith(exp))
+                    self.assertEqual(len(m.getvalue().splitlines()), 8)
+
+
+if __name__ == '__main__':
+    main()
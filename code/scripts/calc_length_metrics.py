@@ -15,7 +15,6 @@ Notes:
 
 import sys
 import fileinput
-import statistics
 from skbio import TreeNode
 from utils.tree import calc_length_metrics
 
@@ -29,7 +28,7 @@ def main():
         sys.exit(__doc__)
     with fileinput.input() as f:
         tree = TreeNode.read(f)
-    calc_length_metrics(tree)
+    calc_length_metrics(tree, summary=True)
 
     # print result
     columns = ('name', 'length', 'height', 'red', 'dmin', 'dmax', 'dmean',
@@ -40,12 +39,9 @@ def main():
             print('%s\t%f\t%f\t1.0\t0.0\t0.0\t0.0\t0.0\tna' %
                   (node.name, node.length, node.height))
         else:
-            dmean, dmedian, dstdev = [
-                getattr(statistics, x)(node.depths) for x in (
-                    'mean', 'median', 'stdev')]
             print('%s\t%f\t%f\t%.5f\t%f\t%f\t%f\t%f\t%f' %
-                  (node.name, node.length, node.height, node.red,
-                   min(node.depths), max(node.depths), dmean, dmedian, dstdev))
+                  (node.name, node.length, node.height, node.red, node.dmin,
+                   node.dmax, node.dmean, node.dmedian, node.dstdev))
 
 
 class Tests(unittest.TestCase):
@@ -17,7 +17,6 @@ Notes:
 
 import sys
 import fileinput
-import statistics
 from skbio import TreeNode
 from utils.tree import calc_split_metrics
 
@@ -31,7 +30,7 @@ def main():
         sys.exit(__doc__)
     with fileinput.input() as f:
         tree = TreeNode.read(f)
-    calc_split_metrics(tree)
+    calc_split_metrics(tree, summary=True)
 
     # print result
     columns = ('name', 'n', 'splits', 'prelevel', 'lmin', 'lmax', 'lmean',
@@ -43,12 +42,9 @@ def main():
         if node.is_tip():
             out = '%s\t1\t1\t1\t1\tna' % out
         else:
-            lmean, lmedian, lstdev = [
-                getattr(statistics, x)(node.postlevels) for x in (
-                    'mean', 'median', 'stdev')]
-            out = ('%s\t%d\t%d\t%.3g\t%.1g\t%.3g'
-                   % (out, min(node.postlevels), max(node.postlevels),
-                      lmean, lmedian, lstdev))
+            out = ('%s\t%d\t%d\t%.3g\t%.1g\t%s'
+                   % (out, node.lmin, node.lmax, node.lmean, node.lmedian,
+                      'na' if node.lstdev is None else '%.3g' % node.lstdev))
         print(out)
 
 
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Compile a subject ID to genome ID translation table into an index file
+which can be memory-mapped by `ogu_from_maps.py`.
+
+Usage:
+    compile_idmap.py nucl2g.txt(.xz) nucl2g.idx
+
+Notes:
+    The input file is a tab-delimited table of subject ID and genome ID,
+    optionally compressed (.gz, .bz2, .xz or .lz).
+
+    The output file can be supplied to `ogu_from_maps.py` in place of the
+    original table (`-t nucl2g.idx`). It only needs to be compiled once, and
+    every job using it will start nearly instantly, sharing one copy of the
+    index in memory.
+"""
+
+import sys
+from os.path import splitext
+import gzip
+import bz2
+import lzma
+from utils.idmap import compile_idmap
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    with read(sys.argv[1]) as f:
+        compile_idmap((x.rstrip('\r\n').split('\t')[:2] for x in f
+                       if x.rstrip('\r\n')), sys.argv[2])
+
+
+zipdict = {'.gz': gzip, '.bz2': bz2, '.xz': lzma, '.lz': lzma}
+
+
+def read(fp, mode='rt'):
+    ext = splitext(fp)[1]
+    zipfunc = getattr(zipdict[ext], 'open') if ext in zipdict else open
+    return zipfunc(fp, mode)
+
+
+if __name__ == '__main__':
+    main()
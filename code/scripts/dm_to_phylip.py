@@ -4,13 +4,23 @@ then be parsed by ClearCut.
 
 Usage:
     dm_to_phylip.py input.dm > output.phy
+
+Notes:
+    The input can be a text distance matrix in the format of scikit-bio, or a
+    binary distance matrix (see `utils/distmat.py`), which is read one block
+    of rows at a time.
 """
 
-from sys import argv
+from sys import argv, stdout
 from os import popen
+from utils.distmat import is_distmat, DistMat, distmat_to_phylip
 
 
 def main():
+    if is_distmat(argv[1]):
+        distmat_to_phylip(DistMat(argv[1]), stdout)
+        return
+
     # get dimension of distance matrix
     n = int(popen('cat %s | wc -l' % argv[1]).read().rstrip()) - 1
     print(str(n))
@@ -9,6 +9,7 @@ import gzip
 import bz2
 import lzma
 import argparse
+from utils.fasta import read_fasta
 
 __author__ = 'Qiyun Zhu'
 __license__ = 'BSD-3-Clause'
@@ -116,38 +117,26 @@ def main():
     # output file
     fo = open(args.output, 'w')
 
-    # store or write a sequence when finishing reading
-    def finseq():
-        nonlocal seq, nseq, nchar
-        if seq:
-            if not todel:
-                if args.concat:
-                    seqs.append(seq)
-                else:
-                    fo.write('%s\n' % seq)
-                nseq += 1
-                nchar += len(seq)
-            seq = ''
-
     # parse input genome sequences
     for g, fname in sorted(gs.items(), key=lambda x: x[0]):
         if args.concat:
             fo.write('>%s\n' % g)
-        fi = read(join(args.input, fname))
         seqs = []
-        seq = ''
-        todel = False
-        for line in fi:
-            line = line.rstrip('\r\n')
-            if line.startswith('>'):
-                finseq()
-                todel = filtseq(line) if args.filt else False
-                if not args.concat and not todel:
+        with read(join(args.input, fname)) as fi:
+            for title, seq in read_fasta(fi):
+                line = '>%s' % title
+                if args.filt and filtseq(line):
+                    continue
+                if not args.concat:
                     fo.write('%s\n' % line.split()[0])
-            else:
-                seq += line
-        fi.close()
-        finseq()
+                if not seq:
+                    continue
+                if args.concat:
+                    seqs.append(seq)
+                else:
+                    fo.write('%s\n' % seq)
+                nseq += 1
+                nchar += len(seq)
         if args.concat:
             fo.write('%s\n' % gap.join(seqs))
     print('Parsed %d sequences (%d characters in total).'
@@ -2,23 +2,44 @@
 """Generate a matrix of pairwise Robinson-Foulds distances among all trees.
 
 Usage:
-    make_rfd_matrix.py trees_dir output
+    make_rfd_matrix.py trees_dir output [threads]
 
 Output:
     output.o.dm: matrix of number of overlapping taxa
     output.rf.dm: Robinson-Foulds distance matrix
+
+Notes:
+    The Robinson-Foulds distance of each pair of trees is calculated on their
+    overlapping taxa, in proportion (i.e., scikit-bio's `compare_rfd` with
+    `proportion=True` after shearing both trees to the overlapping taxa).
+
+    Each tree is read and encoded only once, and pairs of trees are compared
+    without shearing or copying trees, in parallel if multiple threads are
+    specified (default: 1).
 """
 
 from sys import argv
-from os import listdir
+from os import listdir, makedirs
 from os.path import join
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from skbio import TreeNode, DistanceMatrix
+from utils.arraytree import ArrayTree
+
+from io import StringIO
+import unittest
+from unittest.mock import patch
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
 
 ext = '.nwk'
 
 
 def main():
+    if len(argv) < 3:
+        raise SystemExit(__doc__)
+    threads = int(argv[3]) if len(argv) > 3 else 1
     names, trees = [], []
     for fname in sorted(listdir(argv[1])):
         if fname.endswith(ext):
@@ -26,14 +47,7 @@ def main():
             trees.append(TreeNode.read(join(argv[1], fname)))
     print('%d trees read.' % len(names))
 
-    n = len(trees)
-    dmo, dmrf = np.zeros(shape=[n, n]), np.zeros(shape=[n, n])
-    for i in range(n):
-        for j in range(i + 1, n):
-            o, rf = compare_rfd_intersect(trees[i], trees[j])
-            print('%s - %s: %d, %.3f' % (names[i], names[j], o, rf))
-            dmo[i, j], dmrf[i, j] = o, rf
-            dmo[j, i], dmrf[j, i] = o, rf
+    dmo, dmrf = rfd_matrix(trees, threads, names)
 
     # number of overlapping taxa matrix
     dmo = DistanceMatrix(dmo, names)
@@ -44,6 +58,206 @@ def main():
     dmrf.write('%s.rf.dm' % argv[2])
 
 
+def rfd_matrix(trees, threads=1, names=None, seed=None):
+    """Calculate pairwise Robinson-Foulds distances of the shared taxa of all
+    trees.
+
+    Parameters
+    ----------
+    trees : list of skbio.TreeNode
+        trees to compare
+    threads : int, optional
+        number of processes (default: 1)
+    names : list of str, optional
+        names of trees, to print the result of each pair as it is calculated
+    seed : int, optional
+        random seed for hashing taxa
+
+    Returns
+    -------
+    np.ndarray of shape (n, n)
+        numbers of shared taxa (0 on diagonal)
+    np.ndarray of shape (n, n)
+        Robinson-Foulds distances in proportion
+
+    Raises
+    ------
+    ValueError
+        if any tree has duplicated taxa
+
+    See Also
+    --------
+    encode_tree
+    compare_encoded
+    """
+    taxa = {}
+    encoded = [encode_tree(x, taxa) for x in trees]
+    hashes = np.random.default_rng(seed).integers(
+        0, 2 ** 64, size=(len(taxa), 2), dtype=np.uint64)
+
+    n = len(trees)
+    dmo, dmrf = np.zeros(shape=[n, n]), np.zeros(shape=[n, n])
+    if threads <= 1:
+        _init_worker(encoded, hashes)
+        rows = map(_compare_row, range(n))
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(threads, initializer=_init_worker,
+                                       initargs=(encoded, hashes))
+        rows = executor.map(_compare_row, range(n))
+    try:
+        for i, (os, rfs) in enumerate(rows):
+            for j, o, rf in zip(range(i + 1, n), os, rfs):
+                if names is not None:
+                    print('%s - %s: %d, %.3f' % (names[i], names[j], o, rf))
+                dmo[i, j], dmrf[i, j] = o, rf
+                dmo[j, i], dmrf[j, i] = o, rf
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return dmo, dmrf
+
+
+def encode_tree(tree, taxa):
+    """Encode a tree as taxa and clades for Robinson-Foulds distances.
+
+    Parameters
+    ----------
+    tree : skbio.TreeNode
+        tree to encode
+    taxa : dict of str : int
+        global taxon index, to which new taxa are added
+
+    Returns
+    -------
+    np.ndarray of int
+        indices of taxa of tips, in preorder
+    np.ndarray of int
+        start position of tips of each non-root internal node
+    np.ndarray of int
+        end position of tips of each non-root internal node
+
+    Raises
+    ------
+    ValueError
+        if tree has duplicated taxa
+
+    Notes
+    -----
+    Tips descending from a node are contiguous in preorder, therefore each
+    clade is represented by a range of tips, rather than a set of taxa.
+    """
+    atree = ArrayTree.from_treenode(tree)
+    names = [atree.names[x] for x in atree.tips.tolist()]
+    if len(set(names)) < len(names):
+        raise ValueError('Either tree has duplicated taxa.')
+    ids = np.array([taxa.setdefault(x, len(taxa)) for x in names],
+                   dtype=np.int64)
+    nodes = np.flatnonzero(atree.size > 1)
+    nodes = nodes[nodes > 0]
+    start = atree.tip_start[nodes]
+    return ids, start, start + atree.ntips[nodes]
+
+
+def compare_encoded(tree1, tree2, hashes):
+    """Calculate the Robinson-Foulds distance of the shared taxa of two
+    encoded trees.
+
+    Parameters
+    ----------
+    tree1 : tuple of np.ndarray
+        first tree to compare, see `encode_tree`
+    tree2 : tuple of np.ndarray
+        second tree to compare
+    hashes : np.ndarray of uint64 of shape (n_taxa, 2)
+        random 128-bit hash of each taxon
+
+    Returns
+    -------
+    int
+        number of shared taxa
+    float
+        Robinson-Foulds distance in proportion, or 0.0 if there is no shared
+        taxon or clade
+
+    Notes
+    -----
+    This is equivalent to intersecting taxon bitsets of clades with that of
+    the shared taxa and comparing the hashed sets of the resulting clades, but
+    is performed in linear time: the hash of a clade restricted to the shared
+    taxa is the difference between prefix sums of hashes of shared taxa at
+    the two ends of its range of tips (modulo 2^64).
+
+    A clade of a tree sheared to the shared taxa is counted if it has at
+    least two but not all shared taxa, as in scikit-bio's `compare_rfd`.
+    """
+    shared = np.zeros(hashes.shape[0], dtype=bool)
+    shared[tree1[0]] = True
+    mask = np.zeros(hashes.shape[0], dtype=bool)
+    mask[tree2[0]] = True
+    shared &= mask
+    n = int(np.count_nonzero(shared))
+    if n == 0:
+        return 0, 0.0
+    clades = [_restrict_clades(x, shared, n, hashes) for x in (tree1, tree2)]
+    total = clades[0].shape[0] + clades[1].shape[0]
+    if total == 0:
+        return n, 0.0
+    common = np.intersect1d(*clades, assume_unique=True).shape[0]
+    return n, (total - 2 * common) / total
+
+
+def _restrict_clades(tree, shared, n, hashes):
+    """Hash clades of a tree restricted to shared taxa.
+
+    Parameters
+    ----------
+    tree : tuple of np.ndarray
+        encoded tree, see `encode_tree`
+    shared : np.ndarray of bool
+        whether each taxon is shared
+    n : int
+        number of shared taxa
+    hashes : np.ndarray of uint64 of shape (n_taxa, 2)
+        random 128-bit hash of each taxon
+
+    Returns
+    -------
+    np.ndarray of void
+        unique 128-bit hashes of restricted clades
+    """
+    ids, start, end = tree
+    keep = shared[ids]
+    count = np.concatenate(([0], np.cumsum(keep)))
+    sums = np.zeros((ids.shape[0] + 1, 2), dtype=np.uint64)
+    np.cumsum(hashes[ids] * keep[:, None], axis=0, out=sums[1:])
+    size = count[end] - count[start]
+    valid = (size >= 2) & (size < n)
+    res = sums[end[valid]] - sums[start[valid]]
+    return np.unique(np.ascontiguousarray(res).view('V16').ravel())
+
+
+# encoded trees and taxon hashes shared by worker processes
+_trees = None
+_hashes = None
+
+
+def _init_worker(trees, hashes):
+    global _trees, _hashes
+    _trees = trees
+    _hashes = hashes
+
+
+def _compare_row(i):
+    """Compare one tree with all subsequent trees."""
+    os, rfs = [], []
+    for j in range(i + 1, len(_trees)):
+        o, rf = compare_encoded(_trees[i], _trees[j], _hashes)
+        os.append(o)
+        rfs.append(rf)
+    return os, rfs
+
+
 def intersect_trees(tree1, tree2):
     """Shrink two trees to contain only overlapping taxa.
 
@@ -90,6 +304,11 @@ def compare_rfd_intersect(tree1, tree2):
     float
         Robinson-Foulds distance in proportion, or 0.0 if there is no shared
         taxon
+
+    Notes
+    -----
+    This function shears and copies both trees. `compare_encoded` gives the
+    same result without doing so.
     """
     try:
         tree1_lap, tree2_lap = intersect_trees(tree1, tree2)
@@ -102,5 +321,69 @@ def compare_rfd_intersect(tree1, tree2):
     return o, rfd
 
 
+class Tests(unittest.TestCase):
+    def setUp(self):
+        # random trees of overlapping taxa, some with polytomies
+        rng = Random(42)
+        self.trees = []
+        for i in range(8):
+            nodes = [TreeNode(x) for x in rng.sample(
+                'abcdefghijklmnopqrst', rng.randint(4, 15))]
+            while len(nodes) > 1:
+                k = min(rng.randint(2, 3), len(nodes))
+                rng.shuffle(nodes)
+                nodes = nodes[k:] + [TreeNode(children=nodes[:k])]
+            self.trees.append(nodes[0])
+        self.trees.append(TreeNode.read(['((u,v),(w,x));']))
+
+    def test_compare_encoded(self):
+        taxa = {}
+        encoded = [encode_tree(x, taxa) for x in self.trees]
+        hashes = np.random.default_rng(0).integers(
+            0, 2 ** 64, size=(len(taxa), 2), dtype=np.uint64)
+        for i in range(len(self.trees)):
+            for j in range(len(self.trees)):
+                obs = compare_encoded(encoded[i], encoded[j], hashes)
+                try:
+                    exp = compare_rfd_intersect(self.trees[i], self.trees[j])
+                except ZeroDivisionError:
+                    exp = (obs[0], 0.0)
+                self.assertEqual(obs[0], exp[0])
+                self.assertAlmostEqual(obs[1], exp[1])
+
+        with self.assertRaisesRegex(ValueError, 'duplicated taxa'):
+            encode_tree(TreeNode.read(['((a,b),(a,c));']), taxa)
+
+    def test_rfd_matrix(self):
+        exp = rfd_matrix(self.trees)
+        self.assertEqual(exp[0].shape, (9, 9))
+        self.assertListEqual(exp[0].diagonal().tolist(), [0] * 9)
+        self.assertTrue(np.array_equal(exp[1], exp[1].T))
+        for i in range(8):
+            self.assertEqual(exp[0][i, 8], 0)
+        obs = rfd_matrix(self.trees, threads=2)
+        for x, y in zip(obs, exp):
+            self.assertTrue(np.array_equal(x, y))
+
+    def test_main(self):
+        tmpdir = mkdtemp()
+        indir = join(tmpdir, 'trees')
+        makedirs(indir)
+        for i, tree in enumerate(self.trees[:3]):
+            tree.write(join(indir, 'T%d.nwk' % i))
+        stem = join(tmpdir, 'out')
+        with patch('%s.argv' % __name__, ['', indir, stem, '2']):
+            with patch('sys.stdout', new=StringIO()) as m:
+                main()
+                self.assertIn('T0 - T1: ', m.getvalue())
+        dmo = DistanceMatrix.read('%s.o.dm' % stem)
+        dmrf = DistanceMatrix.read('%s.rf.dm' % stem)
+        self.assertTupleEqual(dmo.ids, ('T0', 'T1', 'T2'))
+        exp = rfd_matrix(self.trees[:3])
+        self.assertTrue(np.allclose(dmo.data, exp[0]))
+        self.assertTrue(np.allclose(dmrf.data, exp[1]))
+        rmtree(tmpdir)
+
+
 if __name__ == "__main__":
     main()
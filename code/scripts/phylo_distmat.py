@@ -3,18 +3,243 @@ lengths) from a tree.
 
 Usage:
     phylo_distmat.py input.nwk > output.dm
+    phylo_distmat.py input.nwk -o output.phy -f phylip
+    phylo_distmat.py input.nwk --npy output.npy --dtype float32
+    phylo_distmat.py input.nwk --binary output.bin
+
+Notes:
+    Distances are calculated from node heights and lowest common ancestors,
+    and are written one block of rows at a time, without holding the entire
+    matrix in memory.
+
+    With --npy, the matrix is written into a binary NumPy array file, which
+    can be memory-mapped (`np.load(fp, mmap_mode='r')`), and tip names are
+    written into a file of the same path with extension ".ids", one per line.
+    With --binary, the matrix is written in a binary format which can be
+    memory-mapped and read partially (see `utils/distmat.py`).
+
+    With either binary output, a text matrix is written only if an output
+    file (-o) is specified, from the same blocks of rows.
+
+    Text formats are "lsmat" (default), which has the same layout as that of
+    scikit-bio's `DistanceMatrix.write`, and "phylip", the lower triangle
+    which has the same layout as the output of `dm_to_phylip.py`. Because
+    branch lengths are summed in a different order, values may differ from
+    those of scikit-bio's `TreeNode.tip_tip_distances` in the last digits.
 """
 
 import sys
 import fileinput
+import argparse
+from os.path import splitext
+import numpy as np
 from skbio import TreeNode
+from utils.arraytree import DistanceIndex
+from utils.distmat import DistMatWriter
+
+from io import StringIO
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+from unittest.mock import patch
+from utils.distmat import DistMat
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('input', nargs='*',
+        help='input tree in Newick format (default: stdin)')
+    arg('-o', '--output',
+        help='output text matrix (default: stdout, unless --npy)')
+    arg('-f', '--format', choices=['lsmat', 'phylip'], default='lsmat',
+        help='format of text matrix (default: lsmat)')
+    arg('--npy',
+        help='output binary matrix (.npy)')
+    arg('--binary',
+        help='output binary matrix (see utils/distmat.py)')
+    arg('--dtype', choices=['float32', 'float64'], default='float64',
+        help='data type of binary matrix (default: float64)')
+    arg('--block', type=int,
+        help='number of rows per block (default: ~1 million cells)')
+    return parser.parse_args(argv)
 
 
-def main():
-    with fileinput.input() as f:
+def main(argv=None):
+    args = parse_args(argv)
+    with fileinput.input(args.input) as f:
         tree = TreeNode.read(f)
-    mat = tree.tip_tip_distances()
-    mat.write(sys.stdout)
+    index = DistanceIndex(tree)
+    if args.output:
+        with open(args.output, 'w') as f:
+            write_distmat(index, f, args.format, args.npy, args.dtype,
+                          args.block, args.binary)
+    else:
+        binary = args.npy or args.binary
+        write_distmat(index, None if binary else sys.stdout, args.format,
+                      args.npy, args.dtype, args.block, args.binary)
+
+
+def write_distmat(index, fh=None, fmt='lsmat', npy=None, dtype='float64',
+                  block=None, binary=None, delimiter='\t'):
+    """Write a tip-to-tip distance matrix.
+
+    Parameters
+    ----------
+    index : utils.arraytree.DistanceIndex
+        distance index of tree
+    fh : file handle, optional
+        output text file
+    fmt : {'lsmat', 'phylip'}, optional
+        format of text file
+    npy : str, optional
+        path to output binary matrix (.npy)
+    dtype : str or np.dtype, optional
+        data type of binary matrix
+    block : int, optional
+        number of rows per block
+    binary : str, optional
+        path to output binary matrix (see `utils.distmat.DistMatWriter`)
+    delimiter : str, optional
+        field delimiter of text file
+
+    Raises
+    ------
+    ValueError
+        if tip names are missing or duplicated
+
+    Notes
+    -----
+    Each block of rows is written to the text file and/or the binary file as
+    soon as it is calculated, therefore peak memory is one block. The .npy
+    matrix is memory-mapped and filled in place, and tip names are written
+    to the same path with extension ".ids".
+
+    Text values are formatted from double-precision distances regardless of
+    `dtype`.
+    """
+    names = [index.tree.names[x] for x in index.tree.tips.tolist()]
+    if None in names:
+        raise ValueError('Tree has unnamed tips.')
+    if len(set(names)) < len(names):
+        raise ValueError('Tree has duplicated tip names.')
+    n = len(names)
+
+    dm = None
+    if npy is not None:
+        dm = np.lib.format.open_memmap(npy, mode='w+', dtype=dtype,
+                                       shape=(n, n))
+        with open('%s.ids' % splitext(npy)[0], 'w') as f:
+            for name in names:
+                f.write('%s\n' % name)
+    writer = None if binary is None else DistMatWriter(
+        binary, names, dtype=dtype)
+
+    phylip = fmt == 'phylip'
+    if fh is not None:
+        fh.write('%d\n' % n if phylip else delimiter.join([''] + names) + '\n')
+    for start, data in index.tip_blocks(size=block):
+        if dm is not None:
+            dm[start:start + data.shape[0]] = data
+        if writer is not None:
+            writer.write(data)
+        if fh is None:
+            continue
+        for i, (name, row) in enumerate(zip(names[start:], data), start):
+            fh.write(delimiter.join([name] + np.asarray(
+                row[:i] if phylip else row, dtype=str).tolist()) + '\n')
+    if dm is not None:
+        dm.flush()
+        del dm
+    if writer is not None:
+        writer.close()
+
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.nwk = '((a:1,b:2.5)c:1,(d:3,e)f:2)g;'
+
+    def test_main(self):
+        tree = TreeNode.read([self.nwk])
+        exp = tree.tip_tip_distances()
+        tmpdir = mkdtemp()
+        fp = join(tmpdir, 'input.nwk')
+        with open(fp, 'w') as f:
+            f.write(self.nwk)
+
+        # text matrix to stdout
+        exp_txt = StringIO()
+        exp.write(exp_txt)
+        with patch('sys.stdout', new=StringIO()) as m:
+            main([fp, '--block', '3'])
+            self.assertEqual(m.getvalue(), exp_txt.getvalue())
+
+        # binary matrix only
+        npy = join(tmpdir, 'output.npy')
+        with patch('sys.stdout', new=StringIO()) as m:
+            main([fp, '--npy', npy, '--dtype', 'float32'])
+            self.assertEqual(m.getvalue(), '')
+        obs = np.load(npy, mmap_mode='r')
+        self.assertEqual(obs.dtype, np.float32)
+        np.testing.assert_allclose(obs, exp.data, rtol=1e-6)
+        del obs
+        with open(join(tmpdir, 'output.ids'), 'r') as f:
+            self.assertListEqual(f.read().splitlines(), list(exp.ids))
+
+        # binary and phylip matrices
+        phy = join(tmpdir, 'output.phy')
+        main([fp, '--npy', npy, '-o', phy, '-f', 'phylip', '--block', '2'])
+        np.testing.assert_array_equal(np.load(npy), exp.data)
+
+        # binary matrix in distmat format
+        out = join(tmpdir, 'output.bin')
+        with patch('sys.stdout', new=StringIO()) as m:
+            main([fp, '--binary', out])
+            self.assertEqual(m.getvalue(), '')
+        dm = DistMat(out)
+        self.assertListEqual(dm.ids, list(exp.ids))
+        np.testing.assert_array_equal(dm.data, exp.data)
+        del dm
+        with open(phy, 'r') as f:
+            obs = f.read().splitlines()
+        self.assertEqual(obs[0], '4')
+        self.assertEqual(obs[1], 'a')
+        self.assertEqual(obs[3], 'd\t7.0\t8.5')
+        lines = exp_txt.getvalue().splitlines()[1:]
+        self.assertListEqual(obs[1:], ['\t'.join(x.split('\t')[:i + 1])
+                                       for i, x in enumerate(lines)])
+        rmtree(tmpdir)
+
+    def test_write_distmat(self):
+        tree = TreeNode.read([self.nwk])
+        obs = StringIO()
+        write_distmat(DistanceIndex(tree), obs, block=1)
+        exp = StringIO()
+        tree.tip_tip_distances().write(exp)
+        self.assertEqual(obs.getvalue(), exp.getvalue())
+
+        # decimal branch lengths, with which values may differ in the last
+        # digits from scikit-bio's
+        nwk = ('(((a:0.13,b:0.27):0.41,(c:0.3,d:0.07):0.19):0.33,'
+               '((e:0.11,f:0.23):0.17,g:0.61):0.29,h:0.7);')
+        tree = TreeNode.read([nwk])
+        obs = StringIO()
+        write_distmat(DistanceIndex(tree), obs, block=3)
+        obs = obs.getvalue().splitlines()
+        exp = tree.tip_tip_distances()
+        self.assertEqual(obs[0], '\t' + '\t'.join(exp.ids))
+        for line, row, id_ in zip(obs[1:], exp.data, exp.ids):
+            line = line.split('\t')
+            self.assertEqual(line[0], id_)
+            np.testing.assert_allclose(
+                np.array(line[1:], dtype=float), row, rtol=1e-12)
+
+        tree = TreeNode.read(['((a:1,b:2)c:1,(a:3,e)f:2)g;'])
+        with self.assertRaisesRegex(ValueError, 'duplicated'):
+            write_distmat(DistanceIndex(tree), StringIO())
 
 
 if __name__ == '__main__':
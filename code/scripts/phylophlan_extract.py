@@ -11,6 +11,7 @@ Usage:
 
 import bz2
 import lzma
+from utils.fasta import read_fasta
 
 # nucleotide accession to genome ID dictionary
 with lzma.open('nucl2g.txt.xz', 'rt') as f:
@@ -25,26 +26,19 @@ used = {'p%s' % str(i).zfill(4): set() for i in range(400)}
 
 # read protein sequences and extract those that are marker genes
 with bz2.open('prodigal/prots/all.faa.bz2', 'rt') as fi:
-    fo = open('seqs/p0000.faa', 'w')
-    fo.close()
-    for line in fi:
-        line = line.rstrip('\r\n')
-        if line.startswith('>'):
-            if not fo.closed:
-                fo.close()
-            prot = line[1:].split()[0]
-            if prot in prot2p:
-                p = prot2p[prot]
-                # protein ID = nucleotide accession _underline_ number
-                nucl = '_'.join(prot.split('_')[:-1])
-                g = nucl2g[nucl]
-                if g in used[p]:
-                    raise ValueError('%s: %s already exists.' % (p, g))
-                used[p].add(g)
-                fo = open('seqs/%s.faa' % p, 'a')
-                # protein ID is replaced by genome ID
-                fo.write('>%s\n' % g)
-        elif not fo.closed:
-            fo.write('%s\n' % line)
-    if not fo.closed:
-        fo.close()
+    # create an empty placeholder for p0000
+    open('seqs/p0000.faa', 'w').close()
+    for title, seq in read_fasta(fi):
+        prot = title.split()[0]
+        if prot not in prot2p:
+            continue
+        p = prot2p[prot]
+        # protein ID = nucleotide accession _underline_ number
+        nucl = '_'.join(prot.split('_')[:-1])
+        g = nucl2g[nucl]
+        if g in used[p]:
+            raise ValueError('%s: %s already exists.' % (p, g))
+        used[p].add(g)
+        # protein ID is replaced by genome ID
+        with open('seqs/%s.faa' % p, 'a') as fo:
+            fo.write('>%s\n%s\n' % (g, seq))
@@ -6,6 +6,7 @@ Usage:
 """
 
 import sys
+from utils.fasta import read_fasta
 
 import unittest
 from os import remove
@@ -19,16 +20,8 @@ def main():
         sys.exit(__doc__)
 
     # read original sequences
-    seqs = {}
     with open(sys.argv[1], 'r') as f:
-        name = ''
-        for line in f:
-            line = line.rstrip('\r\n')
-            if line.startswith('>'):
-                name = line[1:]
-                seqs[name] = ''
-            else:
-                seqs[name] += line
+        seqs = dict(read_fasta(f))
 
     # generate a map of unique sequence to identical sequences
     seqs_rev = {}
@@ -16,8 +16,8 @@ Flags:
 """
 
 from sys import argv
-from statistics import median
 from skbio import TreeNode
+from utils.arraytree import ArrayTree, length_metrics
 
 
 # whether convert internal nodes into tips
@@ -39,16 +39,12 @@ print('Taxa in list: %d.' % len(taxa_in_list))
 taxa_to_keep = taxa_in_list.intersection(taxa_in_tree)
 print('Taxa to keep: %d.' % len(taxa_to_keep))
 
-# calculate depths for all nodes
+# calculate median depths for all nodes
 if exbrlen:
-    for node in tree.postorder():
-        if node.is_tip():
-            node.depths = [0.0]
-            node.mdepth = 0.0
-        else:
-            node.depths = [y + (x.length or 0) for x in node.children
-                           for y in x.depths]
-            node.mdepth = median(node.depths)
+    mdepths = length_metrics(ArrayTree.from_treenode(tree), median=True)[
+        'dmedian'].tolist()
+    for node, mdepth in zip(tree.preorder(), mdepths):
+        node.mdepth = mdepth
 
 # recursively remove tips that are not in the given list
 # the reason for not using scikit-bio's `shear` is because it calls `prune`
@@ -4,6 +4,10 @@ domains (Archaea and Bacteria).
 
 Usage:
     sample_ab_dists.py k phy.dm seq.dm archaea.txt result.tsv
+
+Notes:
+    Distance matrices can be text (scikit-bio format) or binary (see
+    `utils/distmat.py`). Only distances among sampled taxa are loaded.
 """
 
 from sys import argv
@@ -11,16 +15,14 @@ from random import seed, sample
 import numpy as np
 import pandas as pd
 from skbio.stats.distance import DistanceMatrix
+from utils.distmat import distmat_ids, load_distmat
 
 seed(42)
 
 k = int(argv[1])  # number of taxa to sample from each domain
 
-phydm = DistanceMatrix.read(argv[2])
-seqdm = DistanceMatrix.read(argv[3])
-
-ids = sorted(phydm.ids)
-if ids != sorted(seqdm.ids):
+ids = sorted(distmat_ids(argv[2]))
+if ids != sorted(distmat_ids(argv[3])):
     raise ValueError('IDs do not match.')
 
 with open(argv[4], 'r') as f:
@@ -31,8 +33,8 @@ b_sample = sample([x for x in ids if x not in archaea], k)
 
 ids = sorted(a_sample + b_sample)
 
-phydm = phydm.filter(ids)
-seqdm = seqdm.filter(ids)
+phydm = DistanceMatrix(load_distmat(argv[2], ids)[1], ids)
+seqdm = DistanceMatrix(load_distmat(argv[3], ids)[1], ids)
 
 groups = []
 for i, x in enumerate(ids):
@@ -8,30 +8,111 @@ Usage:
 Important note:
     For optimal result, the input tree should be ultrametric. Otherwise, the
     algorithm may favor closely related taxa with a shared long branch.
+
+Notes:
+    Prototypes are selected on the tree, without generating the distance
+    matrix: sums of distances are calculated in linear time, and distances
+    from each removed taxon are read from the tree in linear time (see
+    `destructive_maxdist_tree`).
 """
 
 from sys import argv
 import numpy as np
 from skbio import TreeNode
+from utils.arraytree import ArrayTree, tip_distance_sums, tip_distances
+
+import unittest
 
 
 def main():
     tree = TreeNode.read(argv[1])
-    print('Tree has %d taxa.' % tree.count(tips=True))
+    atree = ArrayTree.from_treenode(tree)
+    print('Tree has %d taxa.' % atree.tips.shape[0])
 
-    print('Calculating tip-to-tip distances...')
-    dm = tree.tip_tip_distances()
-    print('Sum of distances: %d.' % np.tril(dm.data).sum())
+    print('Calculating sums of tip-to-tip distances...')
+    print('Sum of distances: %d.' % sum_distances(atree))
 
     print('Performing prototype selection...')
-    prototypes = prototype_selection_destructive_maxdist(dm, int(argv[2]))
+    prototypes = destructive_maxdist_tree(atree, int(argv[2]))
     print('Downsampled to %d taxa.' % len(prototypes))
-    print('Sum of distances: %d.' % np.tril(dm.filter(prototypes).data).sum())
+    names = set(prototypes)
+    print('Sum of distances: %d.' % sum_distances(atree, [
+        atree.names[x] in names for x in atree.tips.tolist()]))
 
     out = tree.shear(prototypes)
     out.write(argv[3])
 
 
+def sum_distances(tree, tips=None):
+    """Sum pairwise distances among tips.
+
+    Parameters
+    ----------
+    tree : utils.arraytree.ArrayTree
+        tree
+    tips : array_like of bool, optional
+        whether each tip (by rank) is included (default: all tips)
+
+    Returns
+    -------
+    float
+        sum of distances of all pairs of tips
+    """
+    sums = tip_distance_sums(tree, tips)
+    if tips is not None:
+        sums = sums[np.asarray(tips, dtype=bool)]
+    return sums.sum() / 2
+
+
+def destructive_maxdist_tree(tree, num_prototypes, seedset=None):
+    """Prototype selection function (minified), on a tree.
+
+    Parameters
+    ----------
+    tree : utils.arraytree.ArrayTree or skbio.TreeNode
+        tree of which tips are elements
+    num_prototypes : int
+        number of prototypes to select
+    seedset : iterable of str, optional
+        tips that are pre-selected as prototypes
+
+    Returns
+    -------
+    list of str
+        names of selected tips
+
+    Notes
+    -----
+    Equivalent to `prototype_selection_destructive_maxdist` on the tip-to-tip
+    distance matrix of the tree, which removes the element with the minimum
+    sum of distances to remaining elements one at a time. Initial sums are
+    calculated by `tip_distance_sums`, and the distances from each removed
+    tip are calculated by `tip_distances`, both in linear time and memory.
+    The selected prototypes are identical except for ties broken differently
+    due to floating-point rounding.
+    """
+    if not isinstance(tree, ArrayTree):
+        tree = ArrayTree.from_treenode(tree)
+    ids = [tree.names[x] for x in tree.tips.tolist()]
+    heights = tree.heights()
+    currDists = tip_distance_sums(tree, heights=heights)
+    numRemain = len(ids)
+    maxVal = currDists.max()
+    if seedset is not None:
+        index = {x: i for i, x in enumerate(ids)}
+        for e in seedset:
+            currDists[index[e]] = maxVal * 2
+    minElmIdx = currDists.argmin()
+    currDists[minElmIdx], numRemain = np.inf, numRemain - 1
+    while (numRemain > num_prototypes):
+        currDists -= tip_distances(tree, minElmIdx, heights)
+        minElmIdx = currDists.argmin()
+        currDists[minElmIdx], numRemain = np.inf, numRemain - 1
+    return [ids[idx]
+            for idx, dist in enumerate(currDists)
+            if dist != np.inf]
+
+
 def prototype_selection_destructive_maxdist(dm, num_prototypes, seedset=None):
     """Prototype selection function (minified)."""
     numRemain = len(dm.ids)
@@ -41,14 +122,58 @@ def prototype_selection_destructive_maxdist(dm, num_prototypes, seedset=None):
         for e in seedset:
             currDists[dm.index(e)] = maxVal * 2
     minElmIdx = currDists.argmin()
-    currDists[minElmIdx], numRemain = np.infty, numRemain - 1
+    currDists[minElmIdx], numRemain = np.inf, numRemain - 1
     while (numRemain > num_prototypes):
         currDists -= dm.data[minElmIdx]
         minElmIdx = currDists.argmin()
-        currDists[minElmIdx], numRemain = np.infty, numRemain - 1
+        currDists[minElmIdx], numRemain = np.inf, numRemain - 1
     return [dm.ids[idx]
             for idx, dist in enumerate(currDists)
-            if dist != np.infty]
+            if dist != np.inf]
+
+
+class Tests(unittest.TestCase):
+    def test_prototype_selection_destructive_maxdist(self):
+        tree = TreeNode.read(['(((a:1,b:1):2,(c:1,d:1):1):1,'
+                              '((e:1,f:2):1,(g:3,h:1):2):1);'])
+        dm = tree.tip_tip_distances()
+        obs = prototype_selection_destructive_maxdist(dm, 3)
+        self.assertListEqual(obs, ['b', 'f', 'g'])
+        obs = prototype_selection_destructive_maxdist(dm, 3, ['c'])
+        self.assertListEqual(obs, ['c', 'f', 'g'])
+        for k in range(1, 8):
+            obs = prototype_selection_destructive_maxdist(dm, k)
+            self.assertEqual(len(obs), k)
+
+    def test_sum_distances(self):
+        tree = TreeNode.read(['(((a:1,b:1):2,(c:1,d:1):1):1,'
+                              '((e:1,f:2):1,(g:3,h:1):2):1);'])
+        dm = tree.tip_tip_distances()
+        atree = ArrayTree.from_treenode(tree)
+        self.assertAlmostEqual(sum_distances(atree), np.tril(dm.data).sum())
+        mask = [x in 'acf' for x in 'abcdefgh']
+        self.assertAlmostEqual(sum_distances(atree, mask), 20)
+
+    def test_destructive_maxdist_tree(self):
+        # random trees with integer branch lengths, such that sums are exact
+        # and ties are broken identically
+        rng = np.random.default_rng(42)
+        for n in (5, 20, 60):
+            nodes = [TreeNode('t%d' % i, length=int(rng.integers(1, 5)))
+                     for i in range(n)]
+            while len(nodes) > 1:
+                i = int(rng.integers(len(nodes) - 1))
+                nodes[i:i + 2] = [TreeNode(children=nodes[i:i + 2],
+                                           length=int(rng.integers(0, 5)))]
+            tree = nodes[0]
+            dm = tree.tip_tip_distances()
+            for k in range(1, n, max(1, n // 7)):
+                exp = prototype_selection_destructive_maxdist(dm, k)
+                self.assertListEqual(destructive_maxdist_tree(tree, k), exp)
+                exp = prototype_selection_destructive_maxdist(
+                    dm, k, ['t1', 't3'])
+                obs = destructive_maxdist_tree(tree, k, ['t1', 't3'])
+                self.assertListEqual(obs, exp)
 
 
 if __name__ == "__main__":
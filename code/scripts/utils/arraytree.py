@@ -0,0 +1 @@
+../../utils/arraytree.py
\ No newline at end of file
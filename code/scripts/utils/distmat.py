@@ -0,0 +1 @@
+../../utils/distmat.py
\ No newline at end of file
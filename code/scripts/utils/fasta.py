@@ -0,0 +1 @@
+../../utils/fasta.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../utils/idmap.py
\ No newline at end of file
@@ -0,0 +1,1339 @@
+#!/usr/bin/env python3
+
+from heapq import heappush, heappop
+import numpy as np
+from skbio import TreeNode
+from skbio.tree import MissingNodeError
+
+
+class ArrayTree(object):
+    """Compact tree backed by NumPy arrays.
+
+    Parameters
+    ----------
+    parent : array_like of int
+        index of the parent of each node (-1 for root), in which nodes are in
+        preorder, i.e., root is the first node, and each subtree occupies a
+        contiguous range of indices
+    length : array_like of float, optional
+        branch length of each node (NaN for none)
+    names : list of str, optional
+        name of each node (None for none)
+
+    Attributes
+    ----------
+    parent : np.ndarray of int
+        index of parent of each node (-1 for root)
+    length : np.ndarray of float
+        branch length of each node (NaN for none)
+    names : list of str
+        name of each node (None for none)
+    child_ptr : np.ndarray of int
+        start (and end, in the next cell) of children of each node in
+        `children`, i.e., children of node i are
+        ``children[child_ptr[i]:child_ptr[i + 1]]``
+    children : np.ndarray of int
+        children of all nodes, grouped by parent, in original order
+    depth : np.ndarray of int
+        number of branches from root to each node
+    size : np.ndarray of int
+        number of nodes in the subtree of each node (including itself), i.e.,
+        the subtree of node i is ``range(i, i + size[i])``
+    ntips : np.ndarray of int
+        number of tips descending from each node (1 for tips)
+    tip_start : np.ndarray of int
+        rank of the first tip descending from each node among all tips, i.e.,
+        tips descending from node i are
+        ``tips[tip_start[i]:tip_start[i] + ntips[i]]``
+    tips : np.ndarray of int
+        indices of tips in preorder
+    postorder : np.ndarray of int
+        indices of nodes in postorder
+    levels : list of np.ndarray of int
+        indices of nodes at each depth, in preorder
+
+    Notes
+    -----
+    Nodes are identified by their indices in preorder, and all properties are
+    stored in arrays indexed by them. Because each subtree is a contiguous
+    range of nodes, and tips descending from each node are a contiguous range
+    of tips, per-node quantities can be computed with array operations on
+    whole levels of nodes (bottom-up or top-down), or with prefix sums over
+    ranges, rather than by visiting node objects one at a time.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> tree = ArrayTree.from_treenode(TreeNode.read(['((a,b)c,d)e;']))
+    >>> tree.names
+    ['e', 'c', 'a', 'b', 'd']
+    >>> tree.parent.tolist()
+    [-1, 0, 1, 1, 0]
+    >>> tree.ntips.tolist()
+    [3, 2, 1, 1, 1]
+    >>> print(tree.to_treenode())
+    ((a,b)c,d)e;
+    <BLANKLINE>
+    """
+
+    def __init__(self, parent, length=None, names=None):
+        parent = np.array(parent, dtype=np.int64)
+        n = parent.shape[0]
+        if n == 0 or parent[0] != -1:
+            raise ValueError('Root must be the first node.')
+        idx = np.arange(n)
+        if ((parent[1:] < 0) | (parent[1:] >= idx[1:])).any():
+            raise ValueError('Nodes are not in preorder.')
+        self.parent = parent
+        self.length = np.full(n, np.nan) if length is None else np.array(
+            length, dtype=np.float64)
+        self.names = [None] * n if names is None else list(names)
+        if self.length.shape != (n,) or len(self.names) != n:
+            raise ValueError('Numbers of nodes do not match.')
+
+        # children in compressed sparse row format
+        self.child_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(parent[1:], minlength=n), out=self.child_ptr[1:])
+        self.children = np.argsort(parent[1:], kind='stable') + 1
+
+        # depths, by pointer jumping
+        depth = (parent >= 0).astype(np.int64)
+        jump = parent.copy()
+        mask = jump >= 0
+        while mask.any():
+            up = jump[mask]
+            depth[mask] += depth[up]
+            jump[mask] = jump[up]
+            mask = jump >= 0
+        self.depth = depth
+        order = np.argsort(depth, kind='stable')
+        self.levels = np.split(order, np.cumsum(np.bincount(depth))[:-1])
+
+        # subtree sizes, and check that subtrees are contiguous
+        size = np.ones(n, dtype=np.int64)
+        for level in reversed(self.levels[1:]):
+            np.add.at(size, parent[level], size[level])
+        self.size = size
+        kids = self.children
+        first = np.ones(n - 1, dtype=bool)
+        first[1:] = parent[kids[1:]] != parent[kids[:-1]]
+        prev = np.roll(kids, 1)
+        exp = np.where(first, parent[kids] + 1, prev + size[prev])
+        if (kids != exp).any():
+            raise ValueError('Nodes are not in preorder.')
+
+        # tips and postorder
+        is_tip = self.child_ptr[1:] == self.child_ptr[:-1]
+        tip_cum = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(is_tip, out=tip_cum[1:])
+        self.tip_start = tip_cum[:-1]
+        self.ntips = tip_cum[idx + size] - self.tip_start
+        self.tips = np.flatnonzero(is_tip)
+        self.postorder = np.lexsort((-depth, idx + size))
+        self._index = None
+
+    def __len__(self):
+        return self.parent.shape[0]
+
+    @classmethod
+    def from_treenode(cls, tree):
+        """Convert a TreeNode object into an ArrayTree.
+
+        Parameters
+        ----------
+        tree : skbio.TreeNode
+            tree to convert (which may be a subtree)
+
+        Returns
+        -------
+        ArrayTree
+            converted tree
+        """
+        nodes = list(tree.preorder(include_self=True))
+        index = {id(x): i for i, x in enumerate(nodes)}
+        parent = [-1] + [index[id(x.parent)] for x in nodes[1:]]
+        length = [np.nan if x.length is None else x.length for x in nodes]
+        return cls(parent, length, [x.name for x in nodes])
+
+    def to_treenode(self):
+        """Convert the tree into a TreeNode object.
+
+        Returns
+        -------
+        skbio.TreeNode
+            converted tree
+        """
+        nodes = [TreeNode(name=x, length=None if y != y else y)
+                 for x, y in zip(self.names, self.length.tolist())]
+        for node, p in zip(nodes[1:], self.parent[1:].tolist()):
+            node.parent = nodes[p]
+            nodes[p].children.append(node)
+        return nodes[0]
+
+    def is_tip(self, i):
+        """Check if a node is a tip.
+
+        Parameters
+        ----------
+        i : int
+            node index
+
+        Returns
+        -------
+        bool
+            whether node is a tip
+        """
+        return self.child_ptr[i] == self.child_ptr[i + 1]
+
+    def get_children(self, i):
+        """Get children of a node.
+
+        Parameters
+        ----------
+        i : int
+            node index
+
+        Returns
+        -------
+        np.ndarray of int
+            indices of child nodes
+        """
+        return self.children[self.child_ptr[i]:self.child_ptr[i + 1]]
+
+    def taxa(self, i):
+        """Get names of tips descending from a node.
+
+        Parameters
+        ----------
+        i : int
+            node index
+
+        Returns
+        -------
+        list of str
+            names of descendants in preorder
+
+        Notes
+        -----
+        This is equivalent to the `taxa` attribute assigned by `assign_taxa`.
+        """
+        start = self.tip_start[i]
+        return [self.names[x] for x in self.tips[
+            start:start + self.ntips[i]].tolist()]
+
+    def find(self, name):
+        """Find a node by name.
+
+        Parameters
+        ----------
+        name : str
+            node name
+
+        Returns
+        -------
+        int
+            index of node
+
+        Raises
+        ------
+        skbio.tree.MissingNodeError
+            if node is not found
+
+        Notes
+        -----
+        Like `skbio.TreeNode.find`, tips take precedence over internal nodes,
+        and the first node in postorder is returned if names are duplicated.
+        """
+        if self._index is None:
+            index = {}
+            for i in reversed(self.postorder.tolist()):
+                index[self.names[i]] = i
+            for i in reversed(self.tips.tolist()):
+                index[self.names[i]] = i
+            self._index = index
+        try:
+            return self._index[name]
+        except KeyError:
+            raise MissingNodeError('Node %s is not in self' % name)
+
+    def reduce_up(self, values, ufunc, add=None):
+        """Reduce values from children to parents, level by level.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            initial values of nodes, to be updated in place
+        ufunc : np.ufunc
+            binary function to reduce values of children into their parent
+            (e.g., np.add, np.minimum)
+        add : np.ndarray or scalar, optional
+            values to add to each child's value before it is reduced into
+            its parent (e.g., branch lengths)
+
+        Notes
+        -----
+        Levels are processed from the deepest to the shallowest, such that a
+        node's value is final when it is reduced into its parent.
+        """
+        for level in reversed(self.levels[1:]):
+            x = values[level]
+            if add is not None:
+                x = x + (add[level] if np.ndim(add) else add)
+            ufunc.at(values, self.parent[level], x)
+
+    def heights(self):
+        """Calculate heights (sums of branch lengths from root) of nodes.
+
+        Returns
+        -------
+        np.ndarray of float
+            height of each node (0 for root)
+
+        Notes
+        -----
+        Missing branch lengths are considered as zero.
+        """
+        length = np.nan_to_num(self.length)
+        res = np.zeros(len(self))
+        for level in self.levels[1:]:
+            res[level] = res[self.parent[level]] + length[level]
+        return res
+
+
+class LCAIndex(object):
+    """Index of a tree for lowest common ancestor (LCA) queries.
+
+    Parameters
+    ----------
+    tree : ArrayTree or skbio.TreeNode
+        tree to index
+
+    Attributes
+    ----------
+    tree : ArrayTree
+        indexed tree
+    nodes : list of skbio.TreeNode or None
+        nodes in preorder, if the index was built from a TreeNode object
+    tip_index : dict of str : int
+        name to rank of each tip among all tips (in preorder)
+    table : np.ndarray of int of shape (log2(n) + 1, n)
+        sparse table, in which cell (k, i) is the index of the shallowest node
+        among nodes i to i + 2^k - 1
+
+    Notes
+    -----
+    This is a variant of the Euler tour-based reduction of LCA to range
+    minimum query (RMQ), using preorder instead of the Euler tour, which halves
+    the size of the index. For nodes u < v in preorder, the nodes between u
+    (exclusive) and v (inclusive) are all within the subtree of LCA(u, v), and
+    the shallowest of them is a child of LCA(u, v). A sparse table of such
+    nodes over ranges of every power-of-two length answers each query in
+    constant time, after O(n log n) preprocessing.
+
+    Because tips descending from any node are contiguous in preorder, the LCA
+    of a group of tips is the LCA of the first and the last of them. Hence the
+    LCA of k tips is found in O(k) time, and many groups can be queried at
+    once with array operations.
+
+    Tips are referred to by their ranks among all tips (i.e., positions in
+    `tree.tips`), which are identical to those in `TaxonRange` assigned by
+    `assign_taxa` in `tree.py`. Queries return node indices in preorder.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> index = LCAIndex(TreeNode.read(['((a,b)c,(d,(e,f)g)h)i;']))
+    >>> index.nodes[index.lca(index.ranks(['e', 'd']))].name
+    'h'
+    >>> groups = [index.ranks(x) for x in ('ab', 'ef', 'af', 'f')]
+    >>> [index.nodes[x].name for x in index.lca_groups(groups)]
+    ['c', 'g', 'i', 'f']
+    """
+    def __init__(self, tree):
+        if isinstance(tree, ArrayTree):
+            self.nodes = None
+        else:
+            self.nodes = list(tree.preorder(include_self=True))
+            tree = ArrayTree.from_treenode(tree)
+        self.tree = tree
+        self.tip_index = {}
+        for i, x in enumerate(tree.tips.tolist()):
+            self.tip_index.setdefault(tree.names[x], i)
+
+        # build sparse table of shallowest nodes
+        n, depth = len(tree), tree.depth
+        table = [np.arange(n)]
+        k = 1
+        while k * 2 <= n:
+            prev = table[-1]
+            a, b = prev[:n - k], prev[k:]
+            row = prev.copy()
+            row[:n - k] = np.where(depth[b] < depth[a], b, a)
+            table.append(row)
+            k *= 2
+        self.table = np.vstack(table)
+
+    def ranks(self, names):
+        """Get ranks of tips by their names.
+
+        Parameters
+        ----------
+        names : iterable of str
+            names of tips
+
+        Returns
+        -------
+        np.ndarray of int
+            ranks of tips among all tips
+
+        Raises
+        ------
+        skbio.tree.MissingNodeError
+            if a tip is not found
+        """
+        index = self.tip_index
+        try:
+            return np.array([index[x] for x in names], dtype=np.int64)
+        except KeyError as e:
+            raise MissingNodeError('Node %s is not in self' % e.args[0])
+
+    def lca_pairs(self, u, v):
+        """Find LCAs of pairs of nodes.
+
+        Parameters
+        ----------
+        u, v : int or array_like of int
+            node indices
+
+        Returns
+        -------
+        int or np.ndarray of int
+            indices of LCAs
+        """
+        u, v = np.asarray(u), np.asarray(v)
+        lo, hi = np.minimum(u, v), np.maximum(u, v)
+        diff = hi > lo
+
+        # shallowest node in range (lo, hi] via two overlapping ranges
+        start = np.where(diff, lo + 1, lo)
+        k = np.log2(np.maximum(hi - start + 1, 1)).astype(np.int64)
+        a = self.table[k, start]
+        b = self.table[k, hi - (1 << k) + 1]
+        depth = self.tree.depth
+        low = np.where(depth[b] < depth[a], b, a)
+        res = np.where(diff, self.tree.parent[low], lo)
+        return res if res.ndim else int(res)
+
+    def lca(self, tips):
+        """Find the LCA of a group of tips.
+
+        Parameters
+        ----------
+        tips : array_like of int
+            ranks of tips (must not be empty)
+
+        Returns
+        -------
+        int
+            index of LCA
+        """
+        tips = np.asarray(tips)
+        return self.lca_pairs(self.tree.tips[tips.min()],
+                              self.tree.tips[tips.max()])
+
+    def lca_groups(self, tips, offsets=None):
+        """Find LCAs of multiple groups of tips.
+
+        Parameters
+        ----------
+        tips : array_like of int, or list of array_like of int
+            ranks of tips of all groups, concatenated, or one array per group
+        offsets : array_like of int, optional
+            start position of each group in `tips`, if concatenated
+
+        Returns
+        -------
+        np.ndarray of int
+            index of LCA of each group
+
+        Notes
+        -----
+        Groups must not be empty.
+        """
+        if offsets is None:
+            tips = [np.asarray(x, dtype=np.int64) for x in tips]
+            if not tips:
+                return np.zeros(0, dtype=np.int64)
+            offsets = np.cumsum([0] + [x.shape[0] for x in tips[:-1]])
+            tips = np.concatenate(tips)
+        tips, offsets = np.asarray(tips), np.asarray(offsets)
+        if offsets.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.lca_pairs(
+            self.tree.tips[np.minimum.reduceat(tips, offsets)],
+            self.tree.tips[np.maximum.reduceat(tips, offsets)])
+
+
+class DistanceIndex(object):
+    """Index of a tree for queries of distances between nodes.
+
+    Parameters
+    ----------
+    tree : ArrayTree or skbio.TreeNode
+        tree to index
+
+    Attributes
+    ----------
+    tree : ArrayTree
+        indexed tree
+    nodes : list of skbio.TreeNode or None
+        nodes in preorder, if the index was built from a TreeNode object
+    lca_index : LCAIndex
+        LCA index of the tree
+    heights : np.ndarray of float
+        height (sum of branch lengths from root) of each node
+
+    Notes
+    -----
+    The distance (sum of branch lengths) between nodes u and v is h(u) + h(v)
+    - 2 h(LCA(u, v)), where h is the height. With heights and an LCA index
+    built in O(n log n) time, each query takes constant time, and distances
+    among tips can be calculated one block of rows at a time, instead of as a
+    whole n-by-n matrix (e.g., skbio's `tip_tip_distances`).
+
+    Missing branch lengths are considered as zero. Tips are referred to by
+    their ranks among all tips, as in `LCAIndex`, whose order is the same as
+    that of the distance matrix generated by `tip_tip_distances`.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> tree = TreeNode.read(['((a:1,b:2)c:1,(d:3,e:1)f:2)g;'])
+    >>> index = DistanceIndex(tree)
+    >>> index.tip_distance(*index.lca_index.ranks('ae'))
+    5.0
+    >>> for start, block in index.tip_blocks(size=2):
+    ...     print(start, block.tolist())
+    0 [[0.0, 3.0, 7.0, 5.0], [3.0, 0.0, 8.0, 6.0]]
+    2 [[7.0, 8.0, 0.0, 4.0], [5.0, 6.0, 4.0, 0.0]]
+    """
+    def __init__(self, tree):
+        self.lca_index = LCAIndex(tree)
+        self.tree = self.lca_index.tree
+        self.nodes = self.lca_index.nodes
+        self.heights = self.tree.heights()
+
+    def distance(self, u, v):
+        """Calculate distances between pairs of nodes.
+
+        Parameters
+        ----------
+        u, v : int or array_like of int
+            node indices (broadcastable)
+
+        Returns
+        -------
+        float or np.ndarray of float
+            distances
+        """
+        u, v = np.asarray(u), np.asarray(v)
+        h = self.heights
+        res = h[u] + h[v] - 2 * h[self.lca_index.lca_pairs(u, v)]
+        return res if res.ndim else float(res)
+
+    def tip_distance(self, a, b):
+        """Calculate distances between pairs of tips.
+
+        Parameters
+        ----------
+        a, b : int or array_like of int
+            ranks of tips (broadcastable)
+
+        Returns
+        -------
+        float or np.ndarray of float
+            distances
+        """
+        tips = self.tree.tips
+        return self.distance(tips[np.asarray(a)], tips[np.asarray(b)])
+
+    def tip_blocks(self, tips=None, size=None):
+        """Calculate a tip-to-tip distance matrix by blocks of rows.
+
+        Parameters
+        ----------
+        tips : array_like of int, optional
+            ranks of tips to include (default: all tips)
+        size : int, optional
+            number of rows per block (default: about one million cells per
+            block)
+
+        Yields
+        ------
+        int
+            index of first row of block
+        np.ndarray of float of shape (size, n_tips)
+            block of distance matrix
+        """
+        tips = self.tree.tips if tips is None else self.tree.tips[
+            np.asarray(tips, dtype=np.int64)]
+        n = tips.shape[0]
+        if size is None:
+            size = max(1, 2 ** 20 // max(n, 1))
+        for start in range(0, n, size):
+            rows = tips[start:start + size]
+            yield start, self.distance(rows[:, None], tips[None, :])
+
+
+class SplitIndex(object):
+    """Index of clades of a tree by hashes of their descending tips.
+
+    Parameters
+    ----------
+    tree : ArrayTree or skbio.TreeNode
+        tree to index
+    hashes : dict of str : bytes, optional
+        random hash of each tip name, to be shared by trees to compare; new
+        names are added to it
+    seed : int, optional
+        random seed for drawing hashes of new names
+
+    Attributes
+    ----------
+    tree : ArrayTree
+        indexed tree
+    nodes : list of skbio.TreeNode or None
+        nodes in preorder, if the index was built from a TreeNode object
+    hashes : dict of str : bytes
+        random hash of each tip name
+    tip_index : dict of str : int
+        name to rank of each tip among all tips (in preorder), excluding
+        unnamed and duplicated tips
+    keys : list of bytes
+        hash of the clade of each node
+    ntaxa : np.ndarray of int
+        number of indexed tips descending from each node
+    clades : dict of bytes : int
+        hash to index of the lowest node of each clade
+
+    Raises
+    ------
+    ValueError
+        if two different clades have the same hash
+
+    Notes
+    -----
+    Each tip name is given a random 128-bit hash (as two 64-bit integers),
+    and the hash of a clade is the sums of the two integers of its tips, each
+    modulo 2^64, which are calculated for all nodes by one postorder pass.
+    Therefore, the clades of two trees are identified and matched in linear
+    time, instead of building and comparing sets or strings of tip names.
+
+    Hashes are verified, such that the results are exact. Within a tree,
+    nodes of the same hash must have the same indexed tips (e.g., form a
+    chain of single-child nodes). Across trees, see `match`.
+
+    Unnamed tips, and tips of which the names are duplicated, cannot be
+    identified across trees. They are not indexed: a clade consists of the
+    other tips, and nodes without such tips are not indexed either.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> index1 = SplitIndex(TreeNode.read(['((a,b)x,(c,d)y)z;']))
+    >>> index2 = SplitIndex(TreeNode.read(['(((a,b)u,c)v,d)w;']),
+    ...                     index1.hashes)
+    >>> [(index1.nodes[i].name, index2.nodes[j].name)
+    ...  for i, j in index1.match(index2)]
+    [('z', 'w'), ('x', 'u'), ('a', 'a'), ('b', 'b'), ('c', 'c'), ('d', 'd')]
+    """
+    def __init__(self, tree, hashes=None, seed=None):
+        if isinstance(tree, ArrayTree):
+            self.nodes = None
+        else:
+            self.nodes = list(tree.preorder(include_self=True))
+            tree = ArrayTree.from_treenode(tree)
+        self.tree = tree
+        self.tip_index, dups = {}, set()
+        for i, x in enumerate(tree.tips.tolist()):
+            name = tree.names[x]
+            if name is not None and self.tip_index.setdefault(name, i) != i:
+                dups.add(name)
+        for name in dups:
+            del self.tip_index[name]
+        names = list(self.tip_index)
+        tips = tree.tips[list(self.tip_index.values())]
+
+        # draw hashes of new names
+        self.hashes = {} if hashes is None else hashes
+        new = [x for x in names if x not in self.hashes]
+        if new:
+            draws = np.random.default_rng(seed).bytes(16 * len(new))
+            for i, name in enumerate(new):
+                self.hashes[name] = draws[i * 16:(i + 1) * 16]
+
+        # sum hashes from tips to root (unsigned integers wrap around)
+        vals = np.zeros((len(tree), 2), dtype=np.uint64)
+        if names:
+            vals[tips] = np.frombuffer(b''.join(
+                self.hashes[x] for x in names), dtype=np.uint64).reshape(-1, 2)
+        tree.reduce_up(vals, np.add)
+        self.keys = vals.view('V16').ravel().tolist()
+        self.ntaxa = np.zeros(len(tree), dtype=np.int64)
+        self.ntaxa[tips] = 1
+        tree.reduce_up(self.ntaxa, np.add)
+
+        # index lowest nodes, in which nodes of the same hash must have the
+        # same indexed tips, i.e., the lower one is within the range of the
+        # upper one and has the same number of indexed tips
+        self.clades = {}
+        start, ntips = tree.tip_start.tolist(), tree.ntips.tolist()
+        ntaxa = self.ntaxa.tolist()
+        for i in reversed(range(len(tree))):
+            if not ntaxa[i]:
+                continue
+            j = self.clades.setdefault(self.keys[i], i)
+            if ntaxa[j] != ntaxa[i] or start[j] < start[i] or (
+                    start[j] + ntips[j] > start[i] + ntips[i]):
+                raise ValueError('Different clades have the same hash.')
+
+    def match(self, other):
+        """Match clades with another tree.
+
+        Parameters
+        ----------
+        other : SplitIndex
+            index of another tree, built with the same tip hashes
+
+        Returns
+        -------
+        list of tuple of (int, int)
+            indices of the lowest nodes of matching clades in the two trees,
+            in preorder of the current tree
+
+        Notes
+        -----
+        Each candidate pair of the same hash is verified in constant time by
+        checking that its clade in the current tree has the same number of
+        indexed tips as the other clade, and that all of them are within the
+        range of tips of the other clade. The smallest and largest ranks of
+        tips in the other tree of all clades are calculated by one postorder
+        pass.
+        """
+        tree, otree = self.tree, other.tree
+        tips = tree.tips[list(self.tip_index.values())]
+        ranks = np.array([other.tip_index.get(x, -1) for x in
+                          self.tip_index], dtype=np.int64)
+        lo = np.full(len(tree), len(otree))
+        lo[tips] = np.where(ranks < 0, -1, ranks)
+        tree.reduce_up(lo, np.minimum)
+        hi = np.full(len(tree), -1)
+        hi[tips] = ranks
+        tree.reduce_up(hi, np.maximum)
+
+        res = []
+        ntaxa, ontaxa, ostart, ontips = (x.tolist() for x in (
+            self.ntaxa, other.ntaxa, otree.tip_start, otree.ntips))
+        lo, hi = lo.tolist(), hi.tolist()
+        for i in sorted(self.clades.values()):
+            j = other.clades.get(self.keys[i])
+            if j is None:
+                continue
+            if ntaxa[i] == ontaxa[j] and lo[i] >= ostart[j] and (
+                    hi[i] < ostart[j] + ontips[j]):
+                res.append((i, j))
+        return res
+
+
+def audit_taxa(tree, labels, index=None):
+    """Classify the cladistic property and monophyly of all taxa at once.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        reference tree
+    labels : sequence of str or None
+        taxon of each tip (in order of `tree.tips`), or None or empty string
+        if the tip is not classified
+    index : LCAIndex, optional
+        LCA index of the tree, if already built
+
+    Returns
+    -------
+    dict
+        - taxa : list of str, taxa, sorted
+        - n : np.ndarray of int, number of tips of each taxon
+        - lca : np.ndarray of int, LCA of each taxon
+        - clade : np.ndarray of int, number of tips descending from LCA
+        - cladistic : list of str, 'uni', 'mono' or 'poly', as defined in
+          `cladistic` in `tree.py`
+        - monophyly : list of str, 'strict', 'relaxed' or 'rejected', as
+          defined in `check_monophyly` in `tree.py`
+
+    Notes
+    -----
+    Instead of testing one taxon at a time, which walks the tree for each
+    taxon, all taxa are classified by one postorder pass and array operations
+    over all nodes, in O(n log n) time in total.
+
+    A node is "pure" if all tips descending from it have the same label,
+    which is found by reducing the minimum and maximum label codes from
+    children to parents. A taxon is strictly monophyletic if its LCA has no
+    more tips than the taxon. Otherwise, its monophyly is rejected unless all
+    of its tips fall within children of its LCA which are pure in this taxon,
+    i.e., no child clade consists of part of the taxon and other tips.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> newick = '(((a,b),(c,d),(e,f)),(g,(h,i)));'
+    >>> tree = ArrayTree.from_treenode(TreeNode.read([newick]))
+    >>> res = audit_taxa(tree, list('XXXXYYZZZ'))
+    >>> res['taxa'], res['monophyly']
+    (['X', 'Y', 'Z'], ['relaxed', 'strict', 'strict'])
+    >>> res['cladistic']
+    ['poly', 'mono', 'mono']
+    """
+    if index is None:
+        index = LCAIndex(tree)
+    taxa = sorted(set(x for x in labels if x))
+    tax2code = {x: i for i, x in enumerate(taxa)}
+    codes = np.array([tax2code[x] if x else -1 for x in labels],
+                     dtype=np.int64)
+    ntaxa = len(taxa)
+
+    # tips of each taxon, and LCA of the first and the last of them
+    ranks = np.arange(codes.shape[0])
+    labeled = codes >= 0
+    n = np.bincount(codes[labeled], minlength=ntaxa)
+    first = np.full(ntaxa, codes.shape[0])
+    np.minimum.at(first, codes[labeled], ranks[labeled])
+    last = np.full(ntaxa, -1)
+    np.maximum.at(last, codes[labeled], ranks[labeled])
+    lca = index.lca_pairs(tree.tips[first], tree.tips[last]) if ntaxa else (
+        np.zeros(0, dtype=np.int64))
+    clade = tree.ntips[lca]
+
+    # pure label of each node (-2 if mixed)
+    lo = np.full(len(tree), ntaxa)
+    lo[tree.tips] = codes
+    tree.reduce_up(lo, np.minimum)
+    hi = np.full(len(tree), -1)
+    hi[tree.tips] = codes
+    tree.reduce_up(hi, np.maximum)
+    pure = np.where(lo == hi, lo, -2)
+
+    # tips of each taxon covered by pure children of its LCA
+    parent, kids = tree.parent[1:], pure[1:]
+    mask = kids >= 0
+    mask[mask] = lca[kids[mask]] == parent[mask]
+    covered = np.bincount(kids[mask], weights=tree.ntips[1:][mask],
+                          minlength=ntaxa)
+
+    strict = clade == n
+    return {'taxa': taxa, 'n': n, 'lca': lca, 'clade': clade,
+            'cladistic': ['uni' if x == 1 else 'mono' if y else 'poly'
+                          for x, y in zip(n.tolist(), strict.tolist())],
+            'monophyly': ['strict' if x else 'relaxed' if y else 'rejected'
+                          for x, y in zip(strict.tolist(),
+                                          (covered == n).tolist())]}
+
+
+def split_metrics(tree):
+    """Calculate split-related metrics of an array-backed tree.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        tree to calculate metrics
+
+    Returns
+    -------
+    dict of np.ndarray
+        - n : number of descendants (tips)
+        - splits : total number of splits from tips
+        - prelevel : number of nodes from root
+        - lmin, lmax, lmean, lstdev : statistics of postlevels (numbers of
+          nodes from tips)
+
+    Notes
+    -----
+    Equivalent to `calc_split_metrics` in `tree.py`, except that postlevels
+    are summarized rather than stored as lists. The postlevel of tip t from
+    node i is depth(t) - depth(i) + 1, therefore the sums of postlevels and
+    of their squares of all nodes are obtained from prefix sums of depths of
+    tips, which are contiguous for each node. The minimum and maximum are
+    reduced from children to parents. `lstdev` is the sample standard
+    deviation, which is NaN for tips.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> newick = '((((A,B)n9,C)n8,(D,E)n7)n4,((F,G)n6,(H,I)n5)n3,(J,K)n2)n1;'
+    >>> tree = ArrayTree.from_treenode(TreeNode.read([newick]))
+    >>> res = split_metrics(tree)
+    >>> i = tree.find('n8')
+    >>> int(res['n'][i]), int(res['lmin'][i]), int(res['lmax'][i])
+    (3, 2, 3)
+    """
+    is_tip = tree.size == 1
+    res = {'n': tree.ntips.copy(),
+           'splits': tree.size - tree.ntips,
+           'prelevel': tree.depth + 1}
+
+    # minimum and maximum postlevels
+    lmin = np.where(is_tip, 1, len(tree) + 1)
+    tree.reduce_up(lmin, np.minimum, 1)
+    lmax = is_tip.astype(np.int64)
+    tree.reduce_up(lmax, np.maximum, 1)
+    res['lmin'], res['lmax'] = lmin, lmax
+
+    # mean and standard deviation of postlevels
+    tdepth = tree.depth[tree.tips].astype(np.float64)
+    s1, s2 = (np.concatenate(([0.0], np.cumsum(x))) for x in (
+        tdepth, tdepth ** 2))
+    start, end = tree.tip_start, tree.tip_start + tree.ntips
+    n, c = tree.ntips, tree.depth - 1
+    sum1 = s1[end] - s1[start] - n * c
+    sum2 = s2[end] - s2[start] - 2 * c * (s1[end] - s1[start]) + n * c ** 2
+    res['lmean'] = sum1 / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (sum2 - sum1 * res['lmean']) / (n - 1)
+    res['lstdev'] = np.sqrt(np.maximum(var, 0))
+    return res
+
+
+def length_metrics(tree, median=False):
+    """Calculate branch length-related metrics of an array-backed tree.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        tree to calculate metrics
+    median : bool, optional
+        also calculate median depths (default: False)
+
+    Returns
+    -------
+    dict of np.ndarray
+        - height : sum of branch lengths from the root to the node
+        - dmin, dmax, dmean, dstdev : statistics of depths (sums of branch
+          lengths from all descendants to the node)
+        - dmedian : median depth (only if `median` is True)
+        - red : relative evolutionary divergence (RED)
+
+    Notes
+    -----
+    Equivalent to `calc_length_metrics` in `tree.py`, except that depths are
+    summarized rather than stored as lists. Missing branch lengths are
+    considered as zero. Minimum and maximum depths are reduced from children
+    to parents, and sums of depths (and of their squares) are accumulated
+    from those of each child shifted by its branch length. Heights and REDs
+    are propagated from parents to children. Results are identical to those
+    of `calc_length_metrics` except for floating-point rounding. `dstdev` is
+    the sample standard deviation, which is NaN for tips.
+
+    The depth of tip t from node i is height(t) - height(i), therefore the
+    median depth of a node is obtained from the median height of its tips,
+    which is maintained by a pair of heaps per clade (see `merge_medians`).
+    This takes O(n log^2 n) time, and memory linear to the number of tips.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> newick = '(((A:1,B:1)n3:1,(C:1,D:2)n4:2)n2:2,E:3)n1;'
+    >>> tree = ArrayTree.from_treenode(TreeNode.read([newick]))
+    >>> res = length_metrics(tree)
+    >>> i = tree.find('n4')
+    >>> float(res['height'][i]), float(res['dmean'][i])
+    (4.0, 1.5)
+    >>> round(float(res['red'][i]), 3)
+    0.752
+    >>> res = length_metrics(tree, median=True)
+    >>> float(res['dmedian'][tree.find('n2')])
+    2.5
+    """
+    length = np.nan_to_num(tree.length)
+    is_tip = tree.size == 1
+    res = {'height': tree.heights()}
+
+    # statistics of depths
+    dmin = np.where(is_tip, 0.0, np.inf)
+    tree.reduce_up(dmin, np.minimum, length)
+    dmax = np.where(is_tip, 0.0, -np.inf)
+    tree.reduce_up(dmax, np.maximum, length)
+    n = tree.ntips
+    dsum = np.zeros(len(tree))
+    tree.reduce_up(dsum, np.add, length * n)
+    dsum2 = np.zeros(len(tree))
+    tree.reduce_up(dsum2, np.add, length * (2 * dsum + length * n))
+    res['dmin'], res['dmax'] = dmin, dmax
+    res['dmean'] = dmean = dsum / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (dsum2 - dsum * dmean) / (n - 1)
+    res['dstdev'] = np.sqrt(np.maximum(var, 0))
+
+    # median depths
+    if median:
+        height = res['height'].tolist()
+        parent = tree.parent.tolist()
+        heaps = [None] * len(tree)
+        dmedian = [0.0] * len(tree)
+        for i in reversed(range(len(tree))):
+            heap = heaps[i]
+            if heap is None:
+                heap = ([-height[i]], [])
+            else:
+                heaps[i] = None
+                dmedian[i] = heap_median(heap) - height[i]
+            j = parent[i]
+            if j >= 0:
+                heaps[j] = heap if heaps[j] is None else merge_medians(
+                    heaps[j], heap)
+        res['dmedian'] = np.array(dmedian)
+
+    # RED
+    red = np.zeros(len(tree))
+    for level in tree.levels[1:]:
+        pred = red[tree.parent[level]]
+        x = length[level]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            red[level] = pred + x / (x + dmean[level]) * (1 - pred)
+    red[is_tip] = 1.0
+    red[0] = 0.0
+    res['red'] = red
+    return res
+
+
+def merge_medians(heap1, heap2):
+    """Merge two pairs of heaps for running medians.
+
+    Parameters
+    ----------
+    heap1 : tuple of (list of float, list of float)
+        lower half of values (negated, as a max-heap), and upper half of
+        values (as a min-heap), of which the former has the same number of
+        values as the latter, or one more
+    heap2 : tuple of (list of float, list of float)
+        the same, of another set of values
+
+    Returns
+    -------
+    tuple of (list of float, list of float)
+        the larger pair of heaps, updated in place with values of the smaller
+
+    Notes
+    -----
+    Values of the smaller pair are pushed into the larger one, which takes
+    O(log n) time per value. Therefore, merging the heaps of clades from the
+    tips to the root (into the largest child at each node) takes O(n log^2 n)
+    time in total, as each value is moved O(log n) times.
+
+    See Also
+    --------
+    heap_median
+    """
+    if len(heap1[0]) + len(heap1[1]) < len(heap2[0]) + len(heap2[1]):
+        heap1, heap2 = heap2, heap1
+    lower, upper = heap1
+    for x in [-y for y in heap2[0]] + heap2[1]:
+        if lower and x <= -lower[0]:
+            heappush(lower, -x)
+        else:
+            heappush(upper, x)
+        if len(lower) > len(upper) + 1:
+            heappush(upper, -heappop(lower))
+        elif len(upper) > len(lower):
+            heappush(lower, -heappop(upper))
+    return heap1
+
+
+def heap_median(heap):
+    """Get the median of values in a pair of heaps.
+
+    Parameters
+    ----------
+    heap : tuple of (list of float, list of float)
+        pair of heaps (see `merge_medians`)
+
+    Returns
+    -------
+    float
+        median, or mean of the two middle values if the count is even
+    """
+    lower, upper = heap
+    if len(lower) > len(upper):
+        return -lower[0]
+    return (-lower[0] + upper[0]) / 2
+
+
+def tip_distance_sums(tree, weights=None, heights=None):
+    """Calculate the sum of distances from each tip to all tips.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        tree to calculate sums
+    weights : array_like of float or bool, optional
+        weight of each tip (by rank among all tips), e.g., whether to include
+        it in sums (default: all ones)
+    heights : np.ndarray of float, optional
+        pre-calculated heights of nodes (see `ArrayTree.heights`)
+
+    Returns
+    -------
+    np.ndarray of float
+        weighted sum of distances from each tip to all tips
+
+    Notes
+    -----
+    The sums are calculated in linear time by rerooting dynamic programming,
+    rather than from an n-by-n distance matrix. The sum of distances from the
+    root to all tips is the sum of heights of tips. Moving from a node to its
+    child along a branch of length L brings the w tips (in weight) under the
+    child closer by L and the remaining W - w tips farther by L, therefore
+    the sum changes by L (W - 2w). As tips descending from any node are
+    contiguous, w of all nodes are differences of prefix sums of weights.
+
+    Missing branch lengths are considered as zero.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> newick = '((a:1,b:2)c:1,(d:3,e:1)f:2)g;'
+    >>> tree = ArrayTree.from_treenode(TreeNode.read([newick]))
+    >>> tip_distance_sums(tree).tolist()
+    [15.0, 17.0, 19.0, 15.0]
+    >>> tip_distance_sums(tree, [1, 1, 0, 0]).tolist()
+    [3.0, 3.0, 15.0, 11.0]
+    """
+    ntips = tree.tips.shape[0]
+    weights = np.ones(ntips) if weights is None else np.asarray(
+        weights, dtype=np.float64)
+    if heights is None:
+        heights = tree.heights()
+    cum = np.concatenate(([0.0], np.cumsum(weights)))
+    below = cum[tree.tip_start + tree.ntips] - cum[tree.tip_start]
+    step = np.nan_to_num(tree.length) * (cum[-1] - 2 * below)
+    res = np.empty(len(tree))
+    res[0] = (weights * heights[tree.tips]).sum()
+    for level in tree.levels[1:]:
+        res[level] = res[tree.parent[level]] + step[level]
+    return res[tree.tips]
+
+
+def tip_distances(tree, tip, heights=None):
+    """Calculate distances from one tip to all tips.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        tree to calculate distances
+    tip : int
+        rank of tip among all tips
+    heights : np.ndarray of float, optional
+        pre-calculated heights of nodes (see `ArrayTree.heights`)
+
+    Returns
+    -------
+    np.ndarray of float
+        distance from the tip to each tip
+
+    Notes
+    -----
+    The LCA of the tip and each other tip is the lowest ancestor of the tip
+    whose range of descending tips contains the latter. As the ranges of
+    ancestors are nested, sorting their starts and ends splits all tips into
+    segments, each of which is contained by a fixed number of ancestors
+    from the root, which indexes their LCA. This takes O(n + d log d) time,
+    where d is the depth of the tip, without an LCA index.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> newick = '((a:1,b:2)c:1,(d:3,e:1)f:2)g;'
+    >>> tree = ArrayTree.from_treenode(TreeNode.read([newick]))
+    >>> tip_distances(tree, 2).tolist()
+    [7.0, 8.0, 0.0, 4.0]
+    """
+    if heights is None:
+        heights = tree.heights()
+    node = int(tree.tips[tip])
+    path = [node]
+    parent = tree.parent
+    while node:
+        node = int(parent[node])
+        path.append(node)
+    path = np.array(path[::-1])
+
+    # segments of tips between sorted starts and ends of ranges of ancestors
+    start = tree.tip_start[path]
+    bounds = np.concatenate((start, start + tree.ntips[path]))
+    order = np.argsort(bounds, kind='stable')
+    count = np.cumsum(np.where(order < path.shape[0], 1, -1))
+    lca = np.repeat(heights[path][count[:-1] - 1], np.diff(bounds[order]))
+    theight = heights[tree.tips]
+    return theight + theight[tip] - 2 * lca
+
+
+def order_nodes(tree, increase=True):
+    """Rotate internal nodes of an array-backed tree so that child nodes are
+    ordered by the number of descendants.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        tree to order
+    increase : bool, optional
+        order nodes in increasing (True) or decreasing (False) order
+
+    Returns
+    -------
+    ArrayTree
+        resulting ordered tree
+
+    Notes
+    -----
+    Equivalent to `order_nodes` in `tree.py`. Children of each node are
+    sorted in a stable manner, then each node is given a new preorder index,
+    which is its parent's index plus one plus the sizes of the siblings
+    placed before it.
+
+    Examples
+    --------
+    >>> from skbio import TreeNode
+    >>> tree = TreeNode.read(['(((a,b),(c,d,e)),((f,g),h));'])
+    >>> ordered = order_nodes(ArrayTree.from_treenode(tree), False)
+    >>> print(ordered.to_treenode())
+    ((h,(f,g)),((a,b),(c,d,e)));
+    <BLANKLINE>
+    """
+    kids = tree.children
+    if kids.shape[0] == 0:
+        return ArrayTree([-1], tree.length, tree.names)
+
+    # sort children by parent, then by number of descendants
+    key = tree.ntips[kids]
+    # a reverse stable sort is done by sorting in reverse, like `sorted`
+    order = np.lexsort((-key if increase else key, tree.parent[kids]))
+    kids = kids[order]
+
+    # offsets of children within the subtrees of their parents
+    size = tree.size[kids]
+    cum = np.cumsum(size) - size
+    starts = tree.child_ptr[:-1][tree.parent[kids]]
+    offset = np.empty(len(tree), dtype=np.int64)
+    offset[0] = 0
+    offset[kids] = cum - cum[starts] + 1
+
+    # new indices
+    pos = np.zeros(len(tree), dtype=np.int64)
+    for level in tree.levels[1:]:
+        pos[level] = pos[tree.parent[level]] + offset[level]
+    parent = np.empty(len(tree), dtype=np.int64)
+    parent[pos[1:]] = pos[tree.parent[1:]]
+    parent[0] = -1
+    length = np.empty(len(tree))
+    length[pos] = tree.length
+    names = [None] * len(tree)
+    for i, name in zip(pos.tolist(), tree.names):
+        names[i] = name
+    return ArrayTree(parent, length, names)
+
+
+def bidi_minlevels(tree, lmin=None):
+    """Calculate minimum levels of nodes to tree's surface from both
+    post- and pre-directions in an array-backed tree.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        tree to calculate metrics
+    lmin : np.ndarray of int, optional
+        minimum postlevels of nodes, if already calculated
+
+    Returns
+    -------
+    np.ndarray of int
+        minimum level of each node to tree's surface
+
+    Notes
+    -----
+    Equivalent to `calc_bidi_minlevels` in `tree.py`.
+    """
+    if lmin is None:
+        lmin = split_metrics(tree)['lmin']
+    unrooted = int(tree.get_children(0).shape[0] != 2)
+    return _bidi_min(tree, lmin, np.ones(len(tree), dtype=np.int64),
+                     lmin, unrooted, 1)
+
+
+def bidi_mindepths(tree, dmin=None):
+    """Calculate minimum depths of nodes to tree's surface from both
+    post- and pre-directions in an array-backed tree.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        tree to calculate metrics
+    dmin : np.ndarray of float, optional
+        minimum depths of nodes, if already calculated
+
+    Returns
+    -------
+    np.ndarray of float
+        minimum depth of each node to tree's surface
+
+    Notes
+    -----
+    Equivalent to `calc_bidi_mindepths` in `tree.py`.
+    """
+    if dmin is None:
+        dmin = length_metrics(tree)['dmin']
+    length = np.nan_to_num(tree.length)
+    return _bidi_min(tree, dmin, length, dmin + length, 0.0, 0.0)
+
+
+def _bidi_min(tree, post, step, basal, base, tip):
+    """Calculate minimum distances to tree's surface in both directions.
+
+    Parameters
+    ----------
+    tree : ArrayTree
+        tree to calculate metrics
+    post : np.ndarray
+        minimum distance of each node to its descendant tips
+    step : np.ndarray
+        distance of each node from its parent
+    basal : np.ndarray
+        distance of each basal node to its nearest descendant tip via the
+        root, as seen from a sibling
+    base : int or float
+        extra distance of each basal node from its siblings
+    tip : int or float
+        distance of tips to surface
+
+    Returns
+    -------
+    np.ndarray
+        minimum distance of each node to tree's surface
+    """
+    above = np.zeros(len(tree))
+
+    # basal nodes: minimum among siblings (via prefix and suffix minima)
+    kids = tree.get_children(0)
+    if kids.shape[0] > 0:
+        vals = basal[kids]
+        fill = np.array([np.inf])
+        left = np.minimum.accumulate(np.concatenate((fill, vals[:-1])))
+        right = np.minimum.accumulate(np.concatenate((
+            fill, vals[:0:-1])))[::-1]
+        above[kids] = np.minimum(left, right) + step[kids] + base
+
+    # derived nodes: increment from parent
+    for level in tree.levels[2:]:
+        above[level] = above[tree.parent[level]] + step[level]
+    res = post.copy()
+    res[1:] = np.minimum(above[1:], post[1:])
+    res[tree.tips] = tip
+    return res
@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+
+import zlib
+from struct import Struct
+
+import numpy as np
+
+
+# file signature and header: magic, number of IDs, flags, size of values in
+# bytes, size of ID blob, size of data section
+_magic = b'WOLDMAT1'
+_header = Struct('<8s5Q')
+_align = 8
+
+# flags
+_condensed = 1
+_compressed = 2
+
+
+def _pad(n):
+    """Round a size up to the alignment of sections."""
+    return -(-n // _align) * _align
+
+
+def _condensed_index(n, i, j):
+    """Get positions of cells (i, j) in a condensed matrix, in which i < j.
+    """
+    return i * n - i * (i + 1) // 2 + (j - i - 1)
+
+
+def is_distmat(fp):
+    """Check whether a file is a binary distance matrix.
+
+    Parameters
+    ----------
+    fp : str
+        file path
+
+    Returns
+    -------
+    bool
+        whether the file starts with the signature of a binary distance matrix
+    """
+    with open(fp, 'rb') as f:
+        return f.read(len(_magic)) == _magic
+
+
+class DistMatWriter(object):
+    """Write a binary distance matrix one block of rows at a time.
+
+    Parameters
+    ----------
+    fp : str
+        output file path
+    ids : list of str
+        IDs of elements
+    condensed : bool, optional
+        store the upper triangle only (default: False)
+    dtype : str or np.dtype, optional
+        float32 or float64 (default)
+    compress : bool, optional
+        compress data with zlib (default: False)
+
+    Raises
+    ------
+    ValueError
+        if IDs are duplicated or data type is not float32 or float64
+
+    Notes
+    -----
+    The file consists of a header and the following sections, each aligned
+    to 8 bytes:
+
+    - offsets of IDs in the ID blob (uint64),
+    - UTF-8-encoded IDs, concatenated,
+    - values of the square matrix in row-major order, or of the upper
+      triangle (excluding the diagonal) in row-major order (i.e., the
+      condensed form of `scipy.spatial.distance.squareform`), optionally
+      compressed as one zlib stream.
+
+    All numbers are little-endian. Rows must be written in order, as square
+    blocks of shape (k, n); only cells above the diagonal are stored if
+    condensed. The header is completed upon `close`.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from tempfile import mkdtemp
+    >>> from os.path import join
+    >>> fp = join(mkdtemp(), 'output.dm')
+    >>> data = np.array([[0, 1, 2], [1, 0, 3], [2, 3, 0]])
+    >>> with DistMatWriter(fp, list('abc'), condensed=True) as w:
+    ...     w.write(data[:2])
+    ...     w.write(data[2:])
+    >>> DistMat(fp).data.tolist()
+    [1.0, 2.0, 3.0]
+    """
+    def __init__(self, fp, ids, condensed=False, dtype='float64',
+                 compress=False):
+        self.ids = list(ids)
+        self.n = n = len(self.ids)
+        if len(set(self.ids)) < n:
+            raise ValueError('Duplicated IDs found.')
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        if self.dtype.kind != 'f' or self.dtype.itemsize not in (4, 8):
+            raise ValueError('Invalid data type: %s.' % dtype)
+        self.condensed = condensed
+        self.flags = (_condensed if condensed else 0) | (
+            _compressed if compress else 0)
+        self._zip = zlib.compressobj() if compress else None
+        self._row = 0
+        self._size = 0
+
+        ids = [x.encode() for x in self.ids]
+        idoff = np.zeros(n + 1, dtype='<u8')
+        np.cumsum([len(x) for x in ids], out=idoff[1:])
+        blob = b''.join(ids)
+        self._idlen = len(blob)
+        self._fh = open(fp, 'wb')
+        self._fh.write(b'\0' * _pad(_header.size))
+        for buf in (idoff.tobytes(), blob):
+            self._fh.write(buf.ljust(_pad(len(buf)), b'\0'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, rows):
+        """Write a block of rows.
+
+        Parameters
+        ----------
+        rows : array_like of shape (k, n)
+            next k rows of the square matrix
+        """
+        rows = np.asarray(rows, dtype=self.dtype)
+        if rows.ndim != 2 or rows.shape[1] != self.n:
+            raise ValueError('Rows must have %d columns.' % self.n)
+        if self._row + rows.shape[0] > self.n:
+            raise ValueError('Too many rows.')
+        if self.condensed:
+            bufs = [rows[i, self._row + i + 1:].tobytes()
+                    for i in range(rows.shape[0])]
+        else:
+            bufs = [rows.tobytes()]
+        self._row += rows.shape[0]
+        for buf in bufs:
+            if self._zip is not None:
+                buf = self._zip.compress(buf)
+            self._fh.write(buf)
+            self._size += len(buf)
+
+    def close(self):
+        """Complete the file."""
+        if self._fh is None:
+            return
+        if self._row != self.n:
+            self._fh.close()
+            self._fh = None
+            raise ValueError('Expected %d rows, got %d.' % (
+                self.n, self._row))
+        if self._zip is not None:
+            buf = self._zip.flush()
+            self._fh.write(buf)
+            self._size += len(buf)
+        self._fh.seek(0)
+        self._fh.write(_header.pack(_magic, self.n, self.flags,
+                                    self.dtype.itemsize, self._idlen,
+                                    self._size))
+        self._fh.close()
+        self._fh = None
+
+
+def write_distmat(fp, ids, data, condensed=False, dtype='float64',
+                  compress=False, block=None):
+    """Write a square matrix into a binary distance matrix file.
+
+    Parameters
+    ----------
+    fp : str
+        output file path
+    ids : list of str
+        IDs of elements
+    data : array_like of shape (n, n)
+        square distance matrix, can be memory-mapped
+    condensed : bool, optional
+        store the upper triangle only
+    dtype : str or np.dtype, optional
+        float32 or float64 (default)
+    compress : bool, optional
+        compress data with zlib
+    block : int, optional
+        number of rows per block (default: ~1 million cells)
+
+    See Also
+    --------
+    DistMatWriter
+    """
+    n = len(ids)
+    if block is None:
+        block = max(1, 2 ** 20 // max(n, 1))
+    with DistMatWriter(fp, ids, condensed, dtype, compress) as w:
+        for start in range(0, n, block):
+            w.write(data[start:start + block])
+
+
+class DistMat(object):
+    """Read-only distance matrix backed by a binary file.
+
+    Parameters
+    ----------
+    fp : str
+        path to a file generated by `DistMatWriter` or `write_distmat`
+
+    Attributes
+    ----------
+    fp : str
+        file path
+    ids : list of str
+        IDs of elements
+    condensed : bool
+        whether the upper triangle only is stored
+    compressed : bool
+        whether data are compressed
+    dtype : np.dtype
+        data type of values
+
+    Notes
+    -----
+    Uncompressed data are memory-mapped rather than read, therefore opening
+    a matrix is nearly instant regardless of its size, and reading rows or a
+    subset of elements only reads the pages that contain them. Compressed
+    data are decompressed in memory upon first access.
+
+    An instance is pickled as its file path, such that a worker process
+    receiving it re-opens the file instead of copying the content.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        if not is_distmat(fp):
+            raise ValueError('Not a binary distance matrix: %s.' % fp)
+        with open(fp, 'rb') as f:
+            _, n, flags, itemsize, idlen, self._size = _header.unpack(
+                f.read(_header.size))
+            f.seek(_pad(_header.size))
+            idoff = np.frombuffer(f.read(_pad((n + 1) * 8)), dtype='<u8',
+                                  count=n + 1).tolist()
+            blob = f.read(idlen)
+        self.ids = [blob[idoff[i]:idoff[i + 1]].decode() for i in range(n)]
+        self.condensed = bool(flags & _condensed)
+        self.compressed = bool(flags & _compressed)
+        self.dtype = np.dtype('<f%d' % itemsize)
+        self._offset = _pad(_header.size) + _pad((n + 1) * 8) + _pad(idlen)
+        self._index = None
+        self._data = None
+
+    def __reduce__(self):
+        return self.__class__, (self.fp,)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def shape(self):
+        return len(self), len(self)
+
+    @property
+    def data(self):
+        """Stored values: square matrix of shape (n, n), or condensed array
+        of shape (n * (n - 1) / 2,)."""
+        if self._data is None:
+            n = len(self)
+            shape = (n * (n - 1) // 2,) if self.condensed else (n, n)
+            if self.compressed:
+                with open(self.fp, 'rb') as f:
+                    f.seek(self._offset)
+                    buf = zlib.decompress(f.read(self._size))
+                self._data = np.frombuffer(buf, dtype=self.dtype).reshape(
+                    shape)
+            elif n == 0 or shape[0] == 0:
+                self._data = np.zeros(shape, dtype=self.dtype)
+            else:
+                self._data = np.memmap(self.fp, dtype=self.dtype, mode='r',
+                                       offset=self._offset, shape=shape)
+        return self._data
+
+    def index(self, id_):
+        """Get the index of an element by its ID.
+
+        Parameters
+        ----------
+        id_ : str
+            element ID
+
+        Returns
+        -------
+        int
+            index of element
+
+        Raises
+        ------
+        KeyError
+            if ID is not found
+        """
+        if self._index is None:
+            self._index = {x: i for i, x in enumerate(self.ids)}
+        return self._index[id_]
+
+    def submatrix(self, rows, cols=None):
+        """Read values of given rows and columns.
+
+        Parameters
+        ----------
+        rows : array_like of int
+            row indices
+        cols : array_like of int, optional
+            column indices (default: all columns)
+
+        Returns
+        -------
+        np.ndarray of shape (len(rows), len(cols))
+            values
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.arange(len(self)) if cols is None else np.asarray(
+            cols, dtype=np.int64)
+        if not self.condensed:
+            return np.asarray(self.data[np.ix_(rows, cols)])
+        i, j = rows[:, None], cols[None, :]
+        lo, hi = np.minimum(i, j), np.maximum(i, j)
+        pos = _condensed_index(len(self), lo, hi)
+        diag = lo == hi
+        res = np.asarray(self.data[np.where(diag, 0, pos)])
+        res[diag] = 0
+        return res
+
+    def filter(self, ids):
+        """Read a square submatrix of given elements.
+
+        Parameters
+        ----------
+        ids : iterable of str
+            element IDs
+
+        Returns
+        -------
+        np.ndarray of shape (k, k)
+            distances among elements
+        """
+        idx = [self.index(x) for x in ids]
+        return self.submatrix(idx, idx)
+
+    def row_blocks(self, size=None):
+        """Read the square matrix by blocks of rows.
+
+        Parameters
+        ----------
+        size : int, optional
+            number of rows per block (default: ~1 million cells)
+
+        Yields
+        ------
+        int
+            index of first row of block
+        np.ndarray of shape (size, n)
+            block of rows
+        """
+        n = len(self)
+        if size is None:
+            size = max(1, 2 ** 20 // max(n, 1))
+        for start in range(0, n, size):
+            rows = np.arange(start, min(start + size, n))
+            if self.condensed:
+                yield start, self.submatrix(rows)
+            else:
+                yield start, np.asarray(self.data[start:start + size])
+
+    def to_skbio(self, ids=None):
+        """Convert into a scikit-bio distance matrix.
+
+        Parameters
+        ----------
+        ids : iterable of str, optional
+            IDs of elements to include (default: all elements)
+
+        Returns
+        -------
+        skbio.DistanceMatrix
+            distance matrix
+        """
+        from skbio import DistanceMatrix
+        if ids is None:
+            ids = self.ids
+            data = self.submatrix(np.arange(len(self)))
+        else:
+            ids = list(ids)
+            data = self.filter(ids)
+        return DistanceMatrix(data.astype(np.float64), ids)
+
+
+def read_lsmat_ids(f, delimiter='\t'):
+    """Read element IDs from the header line of a text distance matrix.
+
+    Parameters
+    ----------
+    f : iterable of str
+        lines of a distance matrix in the format of scikit-bio (lsmat)
+    delimiter : str, optional
+        field delimiter
+
+    Returns
+    -------
+    list of str
+        element IDs
+    """
+    for line in f:
+        return line.rstrip('\r\n').split(delimiter)[1:]
+    return []
+
+
+def read_lsmat(f, ids=None, delimiter='\t'):
+    """Read a text distance matrix, optionally a subset of elements, one row
+    at a time.
+
+    Parameters
+    ----------
+    f : iterable of str
+        lines of a distance matrix in the format of scikit-bio (lsmat)
+    ids : iterable of str, optional
+        IDs of elements to include (default: all elements)
+    delimiter : str, optional
+        field delimiter
+
+    Returns
+    -------
+    list of str
+        element IDs
+    np.ndarray of float64 of shape (k, k)
+        distances among elements
+
+    Raises
+    ------
+    ValueError
+        if IDs are not found or rows do not match the header
+
+    Notes
+    -----
+    Only rows of elements to include are parsed and kept, therefore memory
+    usage is proportional to the size of the subset.
+    """
+    it = iter(f)
+    allids = read_lsmat_ids(it, delimiter)
+    n = len(allids)
+    index = {x: i for i, x in enumerate(allids)}
+    if ids is None:
+        ids = allids
+    else:
+        ids = list(ids)
+        missing = [x for x in ids if x not in index]
+        if missing:
+            raise ValueError('IDs not found: %s.' % ', '.join(missing))
+    cols = np.array([index[x] for x in ids], dtype=np.int64)
+    wanted = {x: i for i, x in enumerate(ids)}
+    res = np.zeros((len(ids), len(ids)))
+    i = 0
+    for line in it:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        id_, _, vals = line.partition(delimiter)
+        if i >= n or id_ != allids[i]:
+            raise ValueError('Row %d does not match the header.' % (i + 1))
+        j = wanted.get(id_)
+        if j is not None:
+            row = np.array(vals.split(delimiter), dtype=np.float64)
+            if row.shape[0] != n:
+                raise ValueError('Expected %d values in row %d, got %d.' % (
+                    n, i + 1, row.shape[0]))
+            res[j] = row[cols]
+        i += 1
+    if i != n:
+        raise ValueError('Expected %d rows, got %d.' % (n, i))
+    return ids, res
+
+
+def lsmat_to_distmat(f, fp, delimiter='\t', **kwargs):
+    """Convert a text distance matrix into a binary one, one row at a time.
+
+    Parameters
+    ----------
+    f : iterable of str
+        lines of a distance matrix in the format of scikit-bio (lsmat)
+    fp : str
+        output file path
+    delimiter : str, optional
+        field delimiter
+    kwargs : dict
+        arguments for `DistMatWriter`
+    """
+    it = iter(f)
+    ids = read_lsmat_ids(it, delimiter)
+    with DistMatWriter(fp, ids, **kwargs) as w:
+        for line in it:
+            line = line.rstrip('\r\n')
+            if line:
+                w.write([line.split(delimiter)[1:]])
+
+
+def distmat_to_lsmat(dm, fh, delimiter='\t'):
+    """Write a binary distance matrix in the format of scikit-bio (lsmat).
+
+    Parameters
+    ----------
+    dm : DistMat
+        distance matrix
+    fh : file handle
+        output file
+
+    Notes
+    -----
+    Rows are formatted one block at a time, and the output is identical to
+    that of `skbio.DistanceMatrix.write` for float64 values.
+    """
+    ids = dm.ids
+    fh.write(delimiter.join([''] + ids) + '\n')
+    for start, rows in dm.row_blocks():
+        for id_, row in zip(ids[start:], rows):
+            fh.write(delimiter.join([id_] + np.asarray(
+                row, dtype=str).tolist()) + '\n')
+
+
+def distmat_to_phylip(dm, fh, delimiter='\t'):
+    """Write a binary distance matrix in the Phylip format (lower triangle).
+
+    Parameters
+    ----------
+    dm : DistMat
+        distance matrix
+    fh : file handle
+        output file
+
+    Notes
+    -----
+    The output is identical to that of `dm_to_phylip.py` for float64 values.
+    """
+    ids = dm.ids
+    fh.write('%d\n' % len(ids))
+    for start, rows in dm.row_blocks():
+        for i, (id_, row) in enumerate(zip(ids[start:], rows), start):
+            fh.write(delimiter.join([id_] + np.asarray(
+                row[:i], dtype=str).tolist()) + '\n')
+
+
+def load_distmat(fp, ids=None):
+    """Load a distance matrix from a binary or text file.
+
+    Parameters
+    ----------
+    fp : str
+        path to a binary distance matrix, or a text one in the format of
+        scikit-bio (lsmat)
+    ids : iterable of str, optional
+        IDs of elements to include (default: all elements)
+
+    Returns
+    -------
+    list of str
+        element IDs
+    np.ndarray of shape (k, k)
+        distances among elements
+    """
+    if is_distmat(fp):
+        dm = DistMat(fp)
+        if ids is None:
+            return dm.ids, dm.submatrix(np.arange(len(dm)))
+        ids = list(ids)
+        return ids, dm.filter(ids)
+    with open(fp, 'r') as f:
+        return read_lsmat(f, ids)
+
+
+def distmat_ids(fp):
+    """Read element IDs of a binary or text distance matrix.
+
+    Parameters
+    ----------
+    fp : str
+        path to a binary distance matrix, or a text one
+
+    Returns
+    -------
+    list of str
+        element IDs
+    """
+    if is_distmat(fp):
+        return DistMat(fp).ids
+    with open(fp, 'r') as f:
+        return read_lsmat_ids(f)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+def read_fasta(f):
+    """Read sequences from a Fasta file, one record at a time.
+
+    Parameters
+    ----------
+    f : iterable of str
+        lines of a Fasta file (e.g., a file handle)
+
+    Yields
+    ------
+    tuple of (str, str)
+        title (header line without ">") and sequence of each record
+
+    Notes
+    -----
+    Lines of a multi-line (interleaved) sequence are collected in a list and
+    joined once the record ends, therefore reading a long sequence takes
+    linear rather than quadratic time. Lines before the first header line are
+    ignored.
+    """
+    title, chunks = None, []
+    for line in f:
+        line = line.rstrip('\r\n')
+        if line.startswith('>'):
+            if title is not None:
+                yield title, ''.join(chunks)
+            title, chunks = line[1:], []
+        elif title is not None:
+            chunks.append(line)
+    if title is not None:
+        yield title, ''.join(chunks)
+
+
+def encode_alignment(seqs, pad='-'):
+    """Encode aligned sequences as a matrix of bytes.
+
+    Parameters
+    ----------
+    seqs : list of str or bytes-like
+        aligned sequences
+    pad : str (optional)
+        character to pad sequences shorter than the longest one with
+        (default: "-", i.e., gap)
+
+    Returns
+    -------
+    np.ndarray of uint8 of shape (n_sequences, n_sites)
+        ASCII codes of characters
+    """
+    width = max((len(x) for x in seqs), default=0)
+    aln = np.full((len(seqs), width), ord(pad), dtype=np.uint8)
+    for i, seq in enumerate(seqs):
+        if isinstance(seq, str):
+            seq = seq.encode('ascii')
+        aln[i, :len(seq)] = np.frombuffer(seq, dtype=np.uint8)
+    return aln
+
+
+def read_fasta_matrix(f, pad='-'):
+    """Read aligned sequences from a Fasta file into a matrix of bytes.
+
+    Parameters
+    ----------
+    f : iterable of str
+        lines of a Fasta file (e.g., a file handle)
+    pad : str (optional)
+        character to pad sequences shorter than the longest one with
+        (default: "-", i.e., gap)
+
+    Returns
+    -------
+    list of str
+        titles of sequences
+    np.ndarray of uint8 of shape (n_sequences, n_sites)
+        encoded alignment, see `encode_alignment`
+
+    Notes
+    -----
+    Sequences are appended to one buffer as they are read. If they are of
+    equal length, as in a typical alignment, the buffer is reshaped into the
+    matrix without copying, therefore only one copy of the alignment is held
+    in memory. Otherwise, the matrix is padded from the buffer by
+    `encode_alignment`, which takes a second copy.
+    """
+    titles, lens, buf = [], [], bytearray()
+    for title, seq in read_fasta(f):
+        titles.append(title)
+        lens.append(len(seq))
+        buf += seq.encode('ascii')
+    n = len(lens)
+    width = max(lens, default=0)
+    if all(x == width for x in lens):
+        return titles, np.frombuffer(buf, dtype=np.uint8).reshape(n, width)
+    view, seqs, start = memoryview(buf), [], 0
+    for x in lens:
+        seqs.append(view[start:start + x])
+        start += x
+    return titles, encode_alignment(seqs, pad)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from zlib import crc32
+from collections.abc import Mapping
+
+import numpy as np
+
+
+# file signature and header: magic, number of keys, number of values, number
+# of slots, modulus of hash values, sizes of key and value blobs
+_magic = b'WOLIDMP1'
+_header = Struct('<8s6Q')
+_align = 8
+_empty = 0xffffffff
+
+
+def _pad(n):
+    """Round a size up to the alignment of sections."""
+    return -(-n // _align) * _align
+
+
+def is_idmap(fp):
+    """Check whether a file is a compiled ID map.
+
+    Parameters
+    ----------
+    fp : str
+        file path
+
+    Returns
+    -------
+    bool
+        whether the file starts with the signature of a compiled ID map
+    """
+    with open(fp, 'rb') as f:
+        return f.read(len(_magic)) == _magic
+
+
+def compile_idmap(data, fp):
+    """Compile a key-to-value map of strings into an on-disk index.
+
+    Parameters
+    ----------
+    data : dict of str to str, or iterable of tuple of (str, str)
+        keys and values, in which values are usually much fewer than keys
+        (e.g., subject IDs and genome IDs); for duplicate keys, the last
+        value is kept
+    fp : str
+        output file path
+
+    Notes
+    -----
+    The file consists of a header and the following sections, each aligned
+    to 8 bytes:
+
+    - an open-addressing hash table of key indices (uint32, 2 ** 32 - 1 for
+      empty slots), with slots determined by the CRC32 checksum of keys and
+      collisions resolved by linear probing,
+    - offsets of keys in the key blob (uint64),
+    - indices of values of keys (uint32),
+    - offsets of values in the value blob (uint64),
+    - UTF-8-encoded keys and values, concatenated.
+
+    Slots are assigned in one vectorized pass: keys are sorted by home slot,
+    and each key takes the first slot at or after its home slot that is not
+    taken by a preceding key. Keys that overflow the end of the table take
+    extra slots appended to it, followed by an empty slot, so that probing
+    never wraps around.
+
+    All numbers are little-endian.
+    """
+    if not isinstance(data, dict):
+        data = dict(data)
+    nkeys = len(data)
+    if nkeys >= _empty:
+        raise ValueError('Too many keys: %d.' % nkeys)
+
+    # index values
+    v2i, vals = {}, []
+    valix = np.empty(nkeys, dtype='<u4')
+    for i, v in enumerate(data.values()):
+        j = v2i.get(v)
+        if j is None:
+            j = v2i[v] = len(vals)
+            vals.append(v)
+        valix[i] = j
+
+    # encode keys and values
+    keys = [x.encode() for x in data]
+    del data
+    kblob, vblob = b''.join(keys), b''.join(x.encode() for x in vals)
+    keyoff = np.zeros(nkeys + 1, dtype='<u8')
+    np.cumsum([len(x) for x in keys], out=keyoff[1:])
+    valoff = np.zeros(len(vals) + 1, dtype='<u8')
+    np.cumsum([len(x.encode()) for x in vals], out=valoff[1:])
+
+    # assign slots by linear probing
+    hmod = max(nkeys * 2, 1)
+    homes = np.fromiter((crc32(x) % hmod for x in keys), dtype=np.int64,
+                        count=nkeys)
+    del keys
+    order = np.argsort(homes, kind='stable')
+    homes = homes[order]
+    pos = np.arange(nkeys, dtype=np.int64)
+    pos += np.maximum.accumulate(homes - pos) if nkeys else 0
+    nslots = max(hmod, int(pos[-1]) + 1 if nkeys else 0) + 1
+    slots = np.full(nslots, _empty, dtype='<u4')
+    slots[pos] = order
+
+    with open(fp, 'wb') as f:
+        head = _header.pack(_magic, nkeys, len(vals), nslots, hmod,
+                            len(kblob), len(vblob))
+        f.write(head.ljust(_pad(len(head)), b'\0'))
+        for arr in (slots, keyoff, valix, valoff):
+            buf = arr.tobytes()
+            f.write(buf.ljust(_pad(len(buf)), b'\0'))
+        f.write(kblob.ljust(_pad(len(kblob)), b'\0'))
+        f.write(vblob)
+
+
+class IdMap(Mapping):
+    """Read-only key-to-value map of strings backed by a compiled index.
+
+    Parameters
+    ----------
+    fp : str
+        path to a file generated by `compile_idmap`
+
+    Notes
+    -----
+    The file is memory-mapped rather than read, therefore opening it is
+    nearly instant regardless of its size, and multiple processes opening
+    the same file share one copy in the page cache. Values (which are few)
+    are decoded upfront, and each lookup computes the checksum of the key
+    and probes a few slots of the hash table.
+
+    An instance is pickled as its file path, such that a worker process
+    receiving it re-opens the file instead of copying the content.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        if not is_idmap(fp):
+            raise ValueError('Not a compiled ID map: %s.' % fp)
+        with open(fp, 'rb') as f:
+            self._mm = mmap(f.fileno(), 0, access=ACCESS_READ)
+        _, nkeys, nvals, nslots, self._hmod, klen, vlen = \
+            _header.unpack_from(self._mm)
+        self._len = nkeys
+        mv = memoryview(self._mm)
+        pos = _pad(_header.size)
+
+        def section(size, fmt=None):
+            nonlocal pos
+            view = mv[pos:pos + size]
+            pos += _pad(size)
+            return view.cast(fmt) if fmt else view
+
+        self._slots = section(nslots * 4, 'I')
+        self._keyoff = section((nkeys + 1) * 8, 'Q')
+        self._valix = section(nkeys * 4, 'I')
+        valoff = section((nvals + 1) * 8, 'Q')
+        self._kblob = section(klen)
+        vblob = bytes(section(vlen))
+        self._vals = [vblob[valoff[i]:valoff[i + 1]].decode()
+                      for i in range(nvals)]
+
+    def __reduce__(self):
+        return self.__class__, (self.fp,)
+
+    def _find(self, key):
+        """Find the index of a key, or -1 if not found."""
+        try:
+            key = key.encode()
+        except AttributeError:
+            return -1
+        slots, keyoff, kblob = self._slots, self._keyoff, self._kblob
+        i = crc32(key) % self._hmod
+        while True:
+            j = slots[i]
+            if j == _empty:
+                return -1
+            if kblob[keyoff[j]:keyoff[j + 1]] == key:
+                return j
+            i += 1
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i == -1:
+            raise KeyError(key)
+        return self._vals[self._valix[i]]
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        return default if i == -1 else self._vals[self._valix[i]]
+
+    def __contains__(self, key):
+        return self._find(key) != -1
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        keyoff, kblob = self._keyoff, self._kblob
+        for i in range(self._len):
+            yield bytes(kblob[keyoff[i]:keyoff[i + 1]]).decode()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+
+from unittest import TestCase, main
+from random import Random
+from statistics import mean, median, stdev
+
+import numpy as np
+from skbio import TreeNode
+from skbio.tree import MissingNodeError
+
+from utils.tree import (
+    calc_split_metrics, calc_length_metrics, order_nodes, assign_taxa,
+    calc_bidi_minlevels, calc_bidi_mindepths, cladistic, check_monophyly)
+from utils.arraytree import (
+    ArrayTree, split_metrics, length_metrics, order_nodes as order_nodes_,
+    bidi_minlevels, bidi_mindepths, LCAIndex, DistanceIndex, SplitIndex,
+    audit_taxa, tip_distance_sums, tip_distances, merge_medians, heap_median)
+
+
+def _random_tree(ntips, seed=0, maxchild=3):
+    """Generate a random tree with branch lengths."""
+    rng = Random(seed)
+    nodes = [TreeNode(name='t%d' % i, length=round(rng.random(), 3))
+             for i in range(ntips)]
+    i = 0
+    while len(nodes) > 1:
+        k = min(rng.randint(2, maxchild), len(nodes))
+        rng.shuffle(nodes)
+        kids, nodes = nodes[:k], nodes[k:]
+        node = TreeNode(name='n%d' % i, length=round(rng.random(), 3),
+                        children=kids)
+        nodes.append(node)
+        i += 1
+    nodes[0].length = None
+    return nodes[0]
+
+
+class ArrayTreeTests(TestCase):
+
+    def setUp(self):
+        self.trees = [
+            TreeNode.read(['((((A,B)n9,C)n8,(D,E)n7)n4,((F,G)n6,(H,I)n5)n3,'
+                           '(J,K)n2)n1;']),
+            TreeNode.read(['(((A:1,B:1)n3:1,(C:1,D:2)n4:2)n2:2,E:3)n1;']),
+            TreeNode.read(['(((a:0.5,b:0.7)n5:1.1,c:1.7)n2:0.3,((d:0.8,'
+                           'e:0.6)n6:0.9,(f:1.2,g:0.5)n7:0.8)n3:1.3,'
+                           '(h:0.4,i:0.3)n4:0.9)n1;']),
+            TreeNode.read(['((a,b)c,(d,(e,f)g)h)i;']),
+            TreeNode.read(['(a:1.0,((b:1.0,c:1.0)d:1.0,e)f:2.0)g;'])]
+        self.trees.extend(_random_tree(x, x) for x in (5, 30, 200))
+
+        # trees with branch lengths
+        self.ltrees = self.trees[1:3] + self.trees[4:]
+
+    def test_init(self):
+        obs = ArrayTree([-1, 0, 1, 1, 0], names=list('ecabd'))
+        self.assertListEqual(obs.child_ptr.tolist(), [0, 2, 4, 4, 4, 4])
+        self.assertListEqual(obs.children.tolist(), [1, 4, 2, 3])
+        self.assertListEqual(obs.depth.tolist(), [0, 1, 2, 2, 1])
+        self.assertListEqual(obs.size.tolist(), [5, 3, 1, 1, 1])
+        self.assertListEqual(obs.ntips.tolist(), [3, 2, 1, 1, 1])
+        self.assertListEqual(obs.tip_start.tolist(), [0, 0, 0, 1, 2])
+        self.assertListEqual(obs.tips.tolist(), [2, 3, 4])
+        self.assertListEqual(obs.postorder.tolist(), [2, 3, 1, 4, 0])
+        self.assertListEqual([x.tolist() for x in obs.levels],
+                             [[0], [1, 4], [2, 3]])
+        self.assertTrue(np.isnan(obs.length).all())
+        self.assertEqual(len(obs), 5)
+        self.assertTrue(obs.is_tip(2))
+        self.assertFalse(obs.is_tip(1))
+        self.assertListEqual(obs.get_children(0).tolist(), [1, 4])
+        self.assertListEqual(obs.taxa(1), ['a', 'b'])
+
+        # single node
+        obs = ArrayTree([-1])
+        self.assertListEqual(obs.tips.tolist(), [0])
+        self.assertListEqual(obs.ntips.tolist(), [1])
+
+        # invalid trees
+        msg = 'Root must be the first node.'
+        for parent in ([], [0, -1], [1, -1]):
+            with self.assertRaisesRegex(ValueError, msg):
+                ArrayTree(parent)
+        msg = 'Nodes are not in preorder.'
+        for parent in ([-1, 0, 3, 0], [-1, -1], [-1, 0, 1, 0, 1]):
+            with self.assertRaisesRegex(ValueError, msg):
+                ArrayTree(parent)
+        with self.assertRaisesRegex(ValueError, 'do not match'):
+            ArrayTree([-1, 0], names=['a'])
+
+    def test_treenode(self):
+        for tree in self.trees:
+            obs = ArrayTree.from_treenode(tree)
+            nodes = list(tree.preorder())
+            self.assertEqual(len(obs), len(nodes))
+            self.assertListEqual(obs.names, [x.name for x in nodes])
+            self.assertListEqual(obs.postorder.tolist(), [
+                nodes.index(x) for x in tree.postorder()])
+            self.assertListEqual(obs.tips.tolist(), [
+                nodes.index(x) for x in tree.tips()])
+            self.assertEqual(str(obs.to_treenode()), str(tree))
+
+        # subtree
+        tree = self.trees[0]
+        obs = ArrayTree.from_treenode(tree.find('n4'))
+        self.assertEqual(str(obs.to_treenode()),
+                         '(((A,B)n9,C)n8,(D,E)n7)n4;\n')
+
+    def test_taxa(self):
+        for tree in self.trees:
+            obs = ArrayTree.from_treenode(tree)
+            assign_taxa(tree)
+            for i, node in enumerate(tree.preorder()):
+                self.assertSetEqual(set(obs.taxa(i)), node.taxa)
+
+    def test_find(self):
+        tree = ArrayTree.from_treenode(TreeNode.read(['((a,b)c,(a,d)e)c;']))
+        self.assertEqual(tree.find('a'), 2)
+        self.assertEqual(tree.find('c'), 1)
+        self.assertEqual(tree.find('e'), 4)
+        with self.assertRaises(MissingNodeError):
+            tree.find('x')
+
+    def test_lca_index(self):
+        for tree in self.trees:
+            index = LCAIndex(tree)
+            nodes = index.nodes
+            self.assertListEqual(nodes, list(tree.preorder()))
+            n = len(nodes)
+            tips = list(tree.tips())
+            pos = {id(x): i for i, x in enumerate(nodes)}
+
+            def lca(group):
+                """Find LCA by intersecting ancestors."""
+                common = None
+                for node in group:
+                    path = [node] + node.ancestors()
+                    if common is None:
+                        common = path
+                    else:
+                        ids = set(map(id, path))
+                        common = [x for x in common if id(x) in ids]
+                return pos[id(common[0])]
+
+            # all pairs of nodes, one at a time and in a batch
+            us, vs, exp = [], [], []
+            for u in range(n):
+                for v in range(n):
+                    us.append(u)
+                    vs.append(v)
+                    exp.append(lca([nodes[u], nodes[v]]))
+            self.assertEqual(index.lca_pairs(us[-2], vs[-2]), exp[-2])
+            self.assertListEqual(index.lca_pairs(us, vs).tolist(), exp)
+
+            # groups of tips
+            rng = Random(n)
+            groups = [rng.sample(range(len(tips)), rng.randint(
+                1, min(len(tips), 5))) for _ in range(50)]
+            exp = [lca([tips[y] for y in x]) for x in groups]
+            self.assertListEqual([index.lca(x) for x in groups], exp)
+            self.assertListEqual(index.lca_groups(groups).tolist(), exp)
+            flat = [y for x in groups for y in x]
+            offsets = np.cumsum([0] + [len(x) for x in groups[:-1]])
+            self.assertListEqual(index.lca_groups(flat, offsets).tolist(),
+                                 exp)
+
+            # tip names
+            self.assertListEqual(index.ranks([x.name for x in tips]).tolist(),
+                                 list(range(len(tips))))
+
+        # built from an array-backed tree
+        tree = ArrayTree([-1, 0, 1, 1, 0], names=list('ecabd'))
+        index = LCAIndex(tree)
+        self.assertIsNone(index.nodes)
+        self.assertEqual(index.lca([0, 1]), 1)
+        self.assertEqual(index.lca(index.ranks('ad')), 0)
+        self.assertListEqual(index.lca_groups([]).tolist(), [])
+        self.assertListEqual(index.lca_groups([], []).tolist(), [])
+        with self.assertRaisesRegex(MissingNodeError, 'Node x is not'):
+            index.ranks('ax')
+
+        # single node
+        index = LCAIndex(ArrayTree([-1], names=['a']))
+        self.assertEqual(index.lca([0]), 0)
+
+    def test_distance_index(self):
+        for tree in self.ltrees:
+            index = DistanceIndex(tree)
+            nodes = index.nodes
+            n = len(nodes)
+
+            def dist(u, v):
+                """Sum lengths of path, considering missing ones as zero."""
+                paths, acc = {}, 0.0
+                for x in [u] + u.ancestors():
+                    paths[id(x)] = acc
+                    acc += x.length or 0.0
+                res, x = 0.0, v
+                while id(x) not in paths:
+                    res += x.length or 0.0
+                    x = x.parent
+                return res + paths[id(x)]
+
+            # all pairs of nodes
+            us, vs = np.divmod(np.arange(n * n), n)
+            obs = index.distance(us, vs)
+            exp = [dist(nodes[u], nodes[v])
+                   for u, v in zip(us.tolist(), vs.tolist())]
+            np.testing.assert_allclose(obs, exp)
+            self.assertAlmostEqual(index.distance(1, n - 1), exp[n * 2 - 1])
+
+            # tip-to-tip distance matrix
+            exp = tree.tip_tip_distances()
+            names = [nodes[x].name for x in index.tree.tips]
+            self.assertListEqual(names, list(exp.ids))
+            for size in (1, 3, None):
+                obs = np.vstack([x for _, x in index.tip_blocks(size=size)])
+                np.testing.assert_allclose(obs, exp.data, atol=1e-12)
+            self.assertAlmostEqual(index.tip_distance(0, 1), exp.data[0, 1])
+
+            # subset of tips
+            sub = [2, 0, 1]
+            obs = [x for _, x in index.tip_blocks(sub, size=2)]
+            self.assertListEqual([x.shape for x in obs], [(2, 3), (1, 3)])
+            np.testing.assert_allclose(
+                np.vstack(obs), exp.data[np.ix_(sub, sub)], atol=1e-12)
+
+    def test_merge_medians(self):
+        rng = Random(42)
+        values = [round(rng.random(), 2) for _ in range(50)]
+        heaps = [([-x], []) for x in values]
+        obs = heaps[0]
+        for i, heap in enumerate(heaps[1:], 2):
+            obs = merge_medians(obs, heap)
+            self.assertEqual(heap_median(obs), median(values[:i]))
+
+        # merge two multi-value heaps of unequal sizes
+        obs = merge_medians(([-1.0], [3.0]), ([-2.0, -0.5], [4.0, 5.0]))
+        self.assertEqual(len(obs[0]) + len(obs[1]), 6)
+        self.assertEqual(heap_median(obs), 2.5)
+        self.assertEqual(heap_median(([-1.0], [])), 1.0)
+
+    def test_tip_distance_sums(self):
+        for tree in self.ltrees:
+            dm = tree.tip_tip_distances().data
+            atree = ArrayTree.from_treenode(tree)
+            np.testing.assert_allclose(tip_distance_sums(atree),
+                                       dm.sum(axis=1))
+            rng = np.random.default_rng(len(dm))
+            weights = rng.integers(0, 2, len(dm))
+            np.testing.assert_allclose(
+                tip_distance_sums(atree, weights, atree.heights()),
+                dm @ weights)
+            for i in range(len(dm)):
+                np.testing.assert_allclose(tip_distances(atree, i), dm[i],
+                                           atol=1e-12)
+
+        # single tip
+        atree = ArrayTree.from_treenode(TreeNode.read(['a;']))
+        self.assertListEqual(tip_distance_sums(atree).tolist(), [0.0])
+        self.assertListEqual(tip_distances(atree, 0).tolist(), [0.0])
+
+    def test_split_index(self):
+        def clades(tree):
+            """Map taxon sets to the lowest nodes in preorder."""
+            res = {}
+            for i, node in enumerate(tree.preorder()):
+                res[frozenset(x.name for x in node.tips(
+                    include_self=True))] = i
+            return res
+
+        for tree in self.trees:
+            ntips = len(list(tree.tips()))
+            others = [tree.copy(), _random_tree(ntips, ntips),
+                      _random_tree(ntips + 3, ntips)]
+            for node in others[0].non_tips(include_self=True):
+                node.children = node.children[::-1]
+            index = SplitIndex(tree, seed=42)
+            self.assertEqual(len(index.keys), len(index.nodes))
+            exp1 = clades(tree)
+            self.assertSetEqual(set(index.clades.values()),
+                                set(exp1.values()))
+            for other in others:
+                oindex = SplitIndex(other, index.hashes)
+                exp2 = clades(other)
+                exp = sorted((v, exp2[k]) for k, v in exp1.items()
+                             if k in exp2)
+                self.assertListEqual(index.match(oindex), exp)
+
+        # single-child nodes
+        index1 = SplitIndex(TreeNode.read(['(((a,b)x)y,c)z;']))
+        index2 = SplitIndex(TreeNode.read(['((a,b)u,(c)v)w;']), index1.hashes)
+        obs = [(index1.nodes[i].name, index2.nodes[j].name)
+               for i, j in index1.match(index2)]
+        self.assertListEqual(obs, [('z', 'w'), ('x', 'u'), ('a', 'a'),
+                                   ('b', 'b'), ('c', 'c')])
+
+        # colliding hashes are verified
+        hashes = {k: v.to_bytes(16, 'little') for k, v in dict(
+            a=1, b=2, c=4, d=3, e=8).items()}
+        index1 = SplitIndex(TreeNode.read(['((a,b)x,(c,e)y)z;']), hashes)
+        index2 = SplitIndex(TreeNode.read(['(d,(c,e)v)w;']), hashes)
+        self.assertEqual(index1.keys[0], index2.keys[0])
+        obs = [(index1.nodes[i].name, index2.nodes[j].name)
+               for i, j in index1.match(index2)]
+        self.assertListEqual(obs, [('y', 'v'), ('c', 'c'), ('e', 'e')])
+        msg = 'Different clades have the same hash.'
+        with self.assertRaisesRegex(ValueError, msg):
+            SplitIndex(TreeNode.read(['((a,b),d);']), hashes)
+
+        # unnamed and duplicated tips are not indexed
+        index = SplitIndex(TreeNode.read(['((a,b)x,a)y;']))
+        self.assertDictEqual(index.tip_index, {'b': 1})
+        self.assertListEqual(index.ntaxa.tolist(), [1, 1, 0, 1, 0])
+        self.assertDictEqual(index.clades, {index.keys[0]: 3})
+        index1 = SplitIndex(TreeNode.read(['((a,b)x,(c,)y)z;']))
+        self.assertDictEqual(index1.tip_index, {'a': 0, 'b': 1, 'c': 2})
+        self.assertListEqual(sorted(index1.clades.values()), [0, 1, 2, 3, 5])
+        index2 = SplitIndex(TreeNode.read(['((,c)v,((b,),a)u)w;']),
+                            index1.hashes)
+        obs = [(index1.nodes[i].name, index2.nodes[j].name)
+               for i, j in index1.match(index2)]
+        self.assertListEqual(obs, [('z', 'w'), ('x', 'u'), ('a', 'a'),
+                                   ('b', 'b'), ('c', 'c')])
+
+        # built from an array-backed tree
+        index = SplitIndex(ArrayTree([-1, 0, 1, 1, 0], names=list('ecabd')))
+        self.assertIsNone(index.nodes)
+        self.assertListEqual(sorted(index.clades.values()), [0, 1, 2, 3, 4])
+
+    def test_audit_taxa(self):
+        for tree in self.trees:
+            atree = ArrayTree.from_treenode(tree)
+            index = LCAIndex(atree)
+            tips = [x.name for x in tree.tips()]
+            rng = Random(len(tips))
+            for k in (1, 2, 3, 5):
+                labels = [rng.choice('XYZ'[:k] + ' ').strip() or None
+                          for _ in tips]
+                for idx in (None, index):
+                    obs = audit_taxa(atree, labels, idx)
+                    self.assertListEqual(obs['taxa'], sorted(set(
+                        x for x in labels if x)))
+                    for i, taxon in enumerate(obs['taxa']):
+                        taxa = [x for x, y in zip(tips, labels) if y == taxon]
+                        self.assertEqual(obs['n'][i], len(taxa))
+                        self.assertEqual(obs['cladistic'][i],
+                                         cladistic(tree, taxa))
+                        res, lca = check_monophyly(tree, taxa)
+                        self.assertEqual(obs['monophyly'][i], res)
+                        self.assertEqual(obs['clade'][i], len(lca.taxa))
+                        self.assertEqual(atree.names[obs['lca'][i]],
+                                         lca.name)
+
+        # no classified tip
+        obs = audit_taxa(ArrayTree.from_treenode(self.trees[0]),
+                         [None] * 11)
+        self.assertListEqual(obs['taxa'], [])
+        self.assertListEqual(obs['lca'].tolist(), [])
+
+    def test_heights(self):
+        for tree in self.ltrees:
+            obs = ArrayTree.from_treenode(tree).heights()
+            calc_length_metrics(tree)
+            exp = [x.height for x in tree.preorder()]
+            self.assertListEqual(obs.tolist(), exp)
+
+    def test_split_metrics(self):
+        for tree in self.trees:
+            obs = split_metrics(ArrayTree.from_treenode(tree))
+            calc_split_metrics(tree)
+            for i, node in enumerate(tree.preorder()):
+                self.assertEqual(obs['n'][i], node.n)
+                self.assertEqual(obs['splits'][i], node.splits)
+                self.assertEqual(obs['prelevel'][i], node.prelevel)
+                self.assertEqual(obs['lmin'][i], min(node.postlevels))
+                self.assertEqual(obs['lmax'][i], max(node.postlevels))
+                self.assertEqual(obs['lmean'][i], mean(node.postlevels))
+                if node.n > 1:
+                    self.assertAlmostEqual(obs['lstdev'][i],
+                                           stdev(node.postlevels))
+                else:
+                    self.assertTrue(np.isnan(obs['lstdev'][i]))
+
+    def test_length_metrics(self):
+        for tree in self.ltrees:
+            obs = length_metrics(ArrayTree.from_treenode(tree), median=True)
+            calc_length_metrics(tree)
+            for i, node in enumerate(tree.preorder()):
+                self.assertEqual(obs['height'][i], node.height)
+                self.assertEqual(obs['dmin'][i], min(node.depths))
+                self.assertEqual(obs['dmax'][i], max(node.depths))
+                self.assertAlmostEqual(obs['dmean'][i], mean(node.depths))
+                self.assertAlmostEqual(obs['dmedian'][i],
+                                       median(node.depths))
+                self.assertAlmostEqual(obs['red'][i], node.red)
+                if len(node.depths) > 1:
+                    self.assertAlmostEqual(obs['dstdev'][i],
+                                           stdev(node.depths))
+                else:
+                    self.assertTrue(np.isnan(obs['dstdev'][i]))
+
+        # caterpillar tree, in which clades are deeply nested
+        nwk = '(t0:0.1,t1:0.3):0.2;'
+        for i in range(2, 40):
+            nwk = '(%s,t%d:0.%d):0.1;' % (nwk[:-1], i, i % 10)
+        tree = TreeNode.read([nwk])
+        obs = length_metrics(ArrayTree.from_treenode(tree), median=True)
+        calc_length_metrics(tree)
+        for i, node in enumerate(tree.preorder()):
+            self.assertAlmostEqual(obs['dmedian'][i], median(node.depths))
+
+        # median is optional
+        obs = length_metrics(ArrayTree.from_treenode(self.ltrees[0]))
+        self.assertNotIn('dmedian', obs)
+
+    def test_order_nodes(self):
+        for tree in self.trees:
+            atree = ArrayTree.from_treenode(tree)
+            for increase in (True, False):
+                obs = order_nodes_(atree, increase).to_treenode()
+                exp = order_nodes(tree, increase)
+                self.assertEqual(str(obs), str(exp))
+        obs = order_nodes_(ArrayTree([-1], names=['a']))
+        self.assertListEqual(obs.names, ['a'])
+
+    def test_bidi_minlevels(self):
+        for tree in self.trees:
+            obs = bidi_minlevels(ArrayTree.from_treenode(tree))
+            calc_bidi_minlevels(tree)
+            exp = [x.minlevel for x in tree.preorder()]
+            self.assertListEqual(obs.tolist(), exp)
+
+    def test_bidi_mindepths(self):
+        for tree in self.ltrees:
+            obs = bidi_mindepths(ArrayTree.from_treenode(tree))
+            calc_bidi_mindepths(tree)
+            exp = [x.mindepth for x in tree.preorder()]
+            self.assertListEqual(obs.tolist(), exp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+from unittest import TestCase, main
+from io import StringIO
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+import pickle
+
+import numpy as np
+from skbio import DistanceMatrix
+
+from utils.distmat import (
+    is_distmat, DistMatWriter, write_distmat, DistMat, read_lsmat_ids,
+    read_lsmat, lsmat_to_distmat, distmat_to_lsmat, distmat_to_phylip,
+    load_distmat, distmat_ids)
+
+
+class DistMatTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        rng = np.random.default_rng(42)
+        x = rng.random((7, 3))
+        self.data = np.sqrt(((x[:, None] - x[None, :]) ** 2).sum(axis=2))
+        self.ids = ['s%d' % i for i in range(7)]
+        self.ids[3] = 'α3'
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_write_distmat(self):
+        fp = join(self.tmpdir, 'dm')
+        for condensed in (False, True):
+            for compress in (False, True):
+                for block in (None, 1, 3):
+                    write_distmat(fp, self.ids, self.data, condensed,
+                                  compress=compress, block=block)
+                    self.assertTrue(is_distmat(fp))
+                    dm = DistMat(fp)
+                    self.assertListEqual(dm.ids, self.ids)
+                    self.assertEqual(dm.condensed, condensed)
+                    self.assertEqual(dm.compressed, compress)
+                    self.assertTupleEqual(dm.shape, (7, 7))
+                    exp = (self.data[np.triu_indices(7, 1)] if condensed
+                           else self.data)
+                    np.testing.assert_array_equal(dm.data, exp)
+                    del dm
+
+        # float32
+        write_distmat(fp, self.ids, self.data, dtype='float32')
+        dm = DistMat(fp)
+        self.assertEqual(dm.dtype, np.float32)
+        np.testing.assert_allclose(dm.data, self.data, rtol=1e-6)
+        self.assertIsInstance(dm.data, np.memmap)
+        del dm
+
+        # empty matrix
+        write_distmat(fp, [], np.zeros((0, 0)), condensed=True)
+        self.assertEqual(len(DistMat(fp)), 0)
+        self.assertEqual(DistMat(fp).data.shape, (0,))
+
+        # not a distance matrix
+        with open(fp, 'w') as f:
+            f.write('\ta\tb\n')
+        self.assertFalse(is_distmat(fp))
+        with self.assertRaisesRegex(ValueError, 'Not a binary'):
+            DistMat(fp)
+
+    def test_distmat_writer(self):
+        fp = join(self.tmpdir, 'dm')
+        with self.assertRaisesRegex(ValueError, 'Duplicated IDs'):
+            DistMatWriter(fp, ['a', 'a'])
+        with self.assertRaisesRegex(ValueError, 'Invalid data type'):
+            DistMatWriter(fp, ['a', 'b'], dtype='int32')
+        w = DistMatWriter(fp, ['a', 'b'])
+        with self.assertRaisesRegex(ValueError, '2 columns'):
+            w.write([[0, 1, 2]])
+        with self.assertRaisesRegex(ValueError, 'Too many rows'):
+            w.write([[0, 1], [1, 0], [2, 2]])
+        w.write([[0, 1]])
+        with self.assertRaisesRegex(ValueError, 'Expected 2 rows, got 1'):
+            w.close()
+        self.assertFalse(is_distmat(fp))
+
+    def test_distmat(self):
+        fp = join(self.tmpdir, 'dm')
+        rows, cols = [5, 0, 5, 2], [3, 3, 6, 0, 1]
+        for condensed in (False, True):
+            for compress in (False, True):
+                write_distmat(fp, self.ids, self.data, condensed,
+                              compress=compress)
+                dm = DistMat(fp)
+                np.testing.assert_array_equal(
+                    dm.submatrix(rows, cols), self.data[np.ix_(rows, cols)])
+                np.testing.assert_array_equal(
+                    dm.submatrix([6]), self.data[[6]])
+                ids = ['s6', 'α3', 's0']
+                np.testing.assert_array_equal(
+                    dm.filter(ids), self.data[np.ix_([6, 3, 0], [6, 3, 0])])
+                self.assertEqual(dm.index('s2'), 2)
+                with self.assertRaises(KeyError):
+                    dm.index('x')
+                for size in (None, 2):
+                    obs = list(dm.row_blocks(size))
+                    self.assertEqual(obs[-1][0], 6 if size else 0)
+                    np.testing.assert_array_equal(
+                        np.vstack([x for _, x in obs]), self.data)
+
+                obs = dm.to_skbio()
+                self.assertTupleEqual(obs.ids, tuple(self.ids))
+                np.testing.assert_array_equal(obs.data, self.data)
+                obs = dm.to_skbio(ids)
+                self.assertTupleEqual(obs.ids, tuple(ids))
+
+                obs = pickle.loads(pickle.dumps(dm))
+                self.assertEqual(obs.fp, fp)
+                np.testing.assert_array_equal(obs.data, dm.data)
+                del dm, obs
+
+    def test_lsmat(self):
+        text = StringIO()
+        DistanceMatrix(self.data, self.ids).write(text)
+        text = text.getvalue()
+        self.assertListEqual(read_lsmat_ids(StringIO(text)), self.ids)
+        self.assertListEqual(read_lsmat_ids(StringIO('')), [])
+
+        ids, obs = read_lsmat(StringIO(text))
+        self.assertListEqual(ids, self.ids)
+        np.testing.assert_array_equal(obs, self.data)
+        ids, obs = read_lsmat(StringIO(text), ['s5', 's1'])
+        self.assertListEqual(ids, ['s5', 's1'])
+        np.testing.assert_array_equal(
+            obs, self.data[np.ix_([5, 1], [5, 1])])
+        with self.assertRaisesRegex(ValueError, 'IDs not found: x.'):
+            read_lsmat(StringIO(text), ['s1', 'x'])
+        with self.assertRaisesRegex(ValueError, 'Expected 7 rows, got 6'):
+            read_lsmat(StringIO(text[:text.rindex('s6')]))
+        with self.assertRaisesRegex(ValueError,
+                                    'Expected 2 values in row 1, got 1'):
+            read_lsmat(StringIO('\ta\tb\na\t0\nb\t1\t0\n'))
+        with self.assertRaisesRegex(ValueError, 'Row 2 does not match'):
+            read_lsmat(StringIO('\ta\tb\na\t0\t1\nc\t1\t0\n'))
+
+        # round trip
+        fp = join(self.tmpdir, 'dm')
+        for condensed in (False, True):
+            lsmat_to_distmat(StringIO(text), fp, condensed=condensed)
+            dm = DistMat(fp)
+            np.testing.assert_array_equal(dm.to_skbio().data, self.data)
+            obs = StringIO()
+            distmat_to_lsmat(dm, obs)
+            self.assertEqual(obs.getvalue(), text)
+            obs = StringIO()
+            distmat_to_phylip(dm, obs)
+            obs = obs.getvalue().splitlines()
+            self.assertEqual(obs[0], '7')
+            self.assertEqual(obs[1], 's0')
+            self.assertListEqual(obs[1:], ['\t'.join(x.split('\t')[:i + 1])
+                                           for i, x in enumerate(
+                                               text.splitlines()[1:])])
+            del dm
+
+    def test_load_distmat(self):
+        fp = join(self.tmpdir, 'dm')
+        txt = join(self.tmpdir, 'dm.txt')
+        DistanceMatrix(self.data, self.ids).write(txt)
+        for condensed in (False, True):
+            write_distmat(fp, self.ids, self.data, condensed)
+            for x in (fp, txt):
+                self.assertListEqual(distmat_ids(x), self.ids)
+                ids, obs = load_distmat(x)
+                self.assertListEqual(ids, self.ids)
+                np.testing.assert_array_equal(obs, self.data)
+                ids, obs = load_distmat(x, ('s4', 's2'))
+                self.assertListEqual(ids, ['s4', 's2'])
+                np.testing.assert_array_equal(
+                    obs, self.data[np.ix_([4, 2], [4, 2])])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+from unittest import TestCase, main
+from io import StringIO
+
+import numpy as np
+
+from utils.fasta import read_fasta, encode_alignment, read_fasta_matrix
+
+
+class FastaTests(TestCase):
+
+    def test_read_fasta(self):
+        fasta = ('>seq1 first sequence\n'
+                 'GAG-GT\n'
+                 'C-ATAC\n'
+                 '>seq2\r\n'
+                 'GAGCCTC-CTAG\r\n'
+                 '>seq3\n'
+                 '>seq4\n'
+                 'GAC-\n'
+                 '\n'
+                 'CTCACTAC')
+        obs = read_fasta(StringIO(fasta))
+        self.assertEqual(next(obs), ('seq1 first sequence', 'GAG-GTC-ATAC'))
+        self.assertListEqual(list(obs), [('seq2', 'GAGCCTC-CTAG'),
+                                         ('seq3', ''),
+                                         ('seq4', 'GAC-CTCACTAC')])
+
+        # lines before the first header are ignored
+        obs = list(read_fasta(['ACGT\n', '>seq1\n', 'AC\n']))
+        self.assertListEqual(obs, [('seq1', 'AC')])
+
+        # empty file
+        self.assertListEqual(list(read_fasta(StringIO(''))), [])
+
+    def test_encode_alignment(self):
+        obs = encode_alignment(['AC-G', 'A-', ''])
+        exp = np.array([[65, 67, 45, 71],
+                        [65, 45, 45, 45],
+                        [45, 45, 45, 45]], dtype=np.uint8)
+        np.testing.assert_array_equal(obs, exp)
+        self.assertTupleEqual(encode_alignment([]).shape, (0, 0))
+
+        obs = encode_alignment([b'AC', b'A'], pad='N')
+        np.testing.assert_array_equal(obs, [[65, 67], [65, 78]])
+
+    def test_read_fasta_matrix(self):
+        fasta = '>seq1\nAC\nGT\n>seq2\nA-G\n'
+        titles, aln = read_fasta_matrix(StringIO(fasta))
+        self.assertListEqual(titles, ['seq1', 'seq2'])
+        self.assertEqual(aln.dtype, np.uint8)
+        np.testing.assert_array_equal(
+            aln, [list(b'ACGT'), list(b'A-G-')])
+        titles, aln = read_fasta_matrix(StringIO(fasta), pad='N')
+        np.testing.assert_array_equal(
+            aln, [list(b'ACGT'), list(b'A-GN')])
+
+        # sequences of equal length share one buffer with the matrix
+        titles, aln = read_fasta_matrix(StringIO('>s1\nAC\n>s2\nG-\n>s3\n'
+                                                 'TT\n'))
+        self.assertListEqual(titles, ['s1', 's2', 's3'])
+        np.testing.assert_array_equal(
+            aln, [list(b'AC'), list(b'G-'), list(b'TT')])
+        self.assertFalse(aln.flags.owndata)
+        titles, aln = read_fasta_matrix(StringIO('>s1\n>s2\n'))
+        self.assertTupleEqual(aln.shape, (2, 0))
+
+        titles, aln = read_fasta_matrix(StringIO(''))
+        self.assertListEqual(titles, [])
+        self.assertTupleEqual(aln.shape, (0, 0))
+
+
+if __name__ == '__main__':
+    main()
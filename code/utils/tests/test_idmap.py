@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+from unittest import TestCase, main
+from shutil import rmtree
+from tempfile import mkdtemp
+from os.path import join
+from pickle import dumps, loads
+
+from utils.idmap import is_idmap, compile_idmap, IdMap
+
+
+class IdMapTests(TestCase):
+
+    def setUp(self):
+        """ Set up working directory and test files
+        """
+        self.working_dir = mkdtemp()
+        self.data = {'s1': 'g1', 's2': 'g1', 's3': 'g2', 's4': 'g3',
+                     'NC_000913.3': 'G000005845', 'ÄÖ': 'g2'}
+
+    def tearDown(self):
+        rmtree(self.working_dir)
+
+    def test_compile_idmap(self):
+        fp = join(self.working_dir, 'map.idx')
+        compile_idmap(self.data, fp)
+        self.assertTrue(is_idmap(fp))
+        obs = IdMap(fp)
+        self.assertEqual(len(obs), len(self.data))
+        self.assertDictEqual(dict(obs), self.data)
+        self.assertListEqual(list(obs), list(self.data))
+        for key, value in self.data.items():
+            self.assertIn(key, obs)
+            self.assertEqual(obs[key], value)
+            self.assertEqual(obs.get(key), value)
+        for key in ('s5', 's', '', 'g1', 1, None):
+            self.assertNotIn(key, obs)
+            self.assertIsNone(obs.get(key))
+            self.assertEqual(obs.get(key, 'x'), 'x')
+        with self.assertRaises(KeyError):
+            obs['s5']
+
+        # duplicate keys
+        compile_idmap([('s1', 'g1'), ('s2', 'g2'), ('s1', 'g3')], fp)
+        self.assertDictEqual(dict(IdMap(fp)), {'s1': 'g3', 's2': 'g2'})
+
+        # empty map
+        compile_idmap({}, fp)
+        obs = IdMap(fp)
+        self.assertEqual(len(obs), 0)
+        self.assertFalse(obs)
+        self.assertIsNone(obs.get('s1'))
+
+        # not a compiled map
+        fp = join(self.working_dir, 'map.txt')
+        with open(fp, 'w') as f:
+            f.write('s1\tg1\n')
+        self.assertFalse(is_idmap(fp))
+        with self.assertRaises(ValueError):
+            IdMap(fp)
+
+    def test_idmap_collisions(self):
+        # many keys, such that hash collisions and overflow are certain
+        data = {'s%d' % i: 'g%d' % (i % 7) for i in range(5000)}
+        fp = join(self.working_dir, 'map.idx')
+        compile_idmap(data, fp)
+        obs = IdMap(fp)
+        self.assertDictEqual(dict(obs), data)
+        for i in range(5000, 6000):
+            self.assertNotIn('s%d' % i, obs)
+
+    def test_idmap_pickle(self):
+        fp = join(self.working_dir, 'map.idx')
+        compile_idmap(self.data, fp)
+        obs = loads(dumps(IdMap(fp)))
+        self.assertIsInstance(obs, IdMap)
+        self.assertDictEqual(dict(obs), self.data)
+
+
+if __name__ == '__main__':
+    main()
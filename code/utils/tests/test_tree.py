@@ -4,6 +4,8 @@ from unittest import TestCase, main
 from shutil import rmtree
 from tempfile import mkdtemp
 from os.path import join, dirname, realpath
+from statistics import mean, median, stdev
+from fractions import Fraction
 from skbio import TreeNode
 from skbio.tree import MissingNodeError
 
@@ -15,7 +17,8 @@ from utils.tree import (
     walk_copy, root_above, unroot_at, _exact_compare, calc_split_metrics,
     calc_length_metrics, format_newick, root_by_outgroup, restore_rooting,
     restore_node_labels, restore_node_order, get_base, calc_bidi_minlevels,
-    calc_bidi_mindepths)
+    calc_bidi_mindepths, TaxonRange, match_taxa)
+from utils.arraytree import ArrayTree, LCAIndex
 
 
 class TreeTests(TestCase):
@@ -371,6 +374,87 @@ class TreeTests(TestCase):
         self.assertEqual(lca2(tree, set('ac')).name, 'n4')
         self.assertEqual(lca2(tree, set('ace')).name, 'n2')
         self.assertEqual(lca2(tree, set('bgi')).name, 'n1')
+        self.assertEqual(lca2(tree, tree.find('n7').taxa).name, 'n7')
+        self.assertEqual(lca2(tree, set('abx')).name, 'n1')
+        self.assertEqual(lca2(tree.find('n2'), set('ab')).name, 'n6')
+        self.assertEqual(lca2(tree.find('n2'), set('af')).name, 'n2')
+
+    def test_assign_taxa(self):
+        tree = TreeNode.read(['((a,b)c,(d,(e,f)g)h)i;'])
+        assign_taxa(tree)
+        exp = {'a': 'a', 'b': 'b', 'c': 'ab', 'd': 'd', 'e': 'e', 'f': 'f',
+               'g': 'ef', 'h': 'def', 'i': 'abdef'}
+        for node in tree.traverse(include_self=True):
+            self.assertIsInstance(node.taxa, TaxonRange)
+            self.assertEqual(node.taxa, set(exp[node.name]))
+            self.assertSetEqual(set(node.taxa), set(exp[node.name]))
+            self.assertEqual(len(node.taxa), len(exp[node.name]))
+        self.assertListEqual(tree.taxa.tips, list('abdef'))
+
+        # membership and subset tests
+        c, h, g = (tree.find(x).taxa for x in 'chg')
+        self.assertIn('a', c)
+        self.assertNotIn('d', c)
+        self.assertNotIn('x', c)
+        self.assertNotIn(['a'], c)
+        self.assertTrue(g <= h)
+        self.assertTrue(g < h)
+        self.assertFalse(h <= g)
+        self.assertTrue(h >= g)
+        self.assertFalse(c <= h)
+        self.assertTrue(g.issubset(h))
+        self.assertTrue(g.issubset('def'))
+        self.assertTrue(h.issuperset('de'))
+        self.assertFalse(h.issuperset('ad'))
+        self.assertTrue(c.isdisjoint(h))
+        self.assertSetEqual(c | g, set('abef'))
+        self.assertSetEqual(h - g, {'d'})
+        self.assertSetEqual(h.intersection('aef'), set('ef'))
+        self.assertListEqual(h.ranks(g), [3, 4])
+        self.assertListEqual(tree.taxa.ranks('fa'), [4, 0])
+        with self.assertRaises(KeyError):
+            tree.taxa.ranks('x')
+
+        # copies share the list of tips
+        copy = tree.copy()
+        self.assertIs(copy.taxa.tips, tree.taxa.tips)
+        self.assertEqual(copy.find('g').taxa, set('ef'))
+
+        # duplicated tip names: each name is counted once
+        tree = TreeNode.read(['((a,b)x,(a,c)y)r;'])
+        assign_taxa(tree)
+        self.assertFalse(tree.taxa.unique)
+        x, y = (z.taxa for z in tree.children)
+        self.assertIn('a', x)
+        self.assertIn('a', y)
+        self.assertNotIn('b', y)
+        self.assertEqual(len(tree.taxa), 3)
+        self.assertListEqual(list(tree.taxa), list('abc'))
+        self.assertEqual(y, set('ac'))
+        self.assertTrue(tree.children[0].children[1].taxa <= x)
+        self.assertFalse(x <= y)
+        self.assertEqual(x & y, {'a'})
+        with self.assertRaisesRegex(ValueError, 'Duplicated'):
+            tree.taxa.ranks('ab')
+
+        # unnamed tips are excluded
+        tree = TreeNode.read(['((a,),(b,(c,)));'])
+        assign_taxa(tree)
+        self.assertFalse(tree.taxa.unique)
+        self.assertEqual(tree.taxa, set('abc'))
+        self.assertEqual(len(tree.taxa), 3)
+        self.assertNotIn(None, tree.taxa)
+        self.assertEqual(tree.children[1].taxa, set('bc'))
+        self.assertEqual(lca2(tree, set('bc')), tree.children[1])
+        self.assertEqual(lca2(tree, set('ab')), tree)
+        self.assertEqual(cladistic(tree, 'a'), 'uni')
+        self.assertEqual(cladistic(tree, 'bc'), 'poly')
+        self.assertTupleEqual(check_monophyly(tree, 'bc'),
+                              ('strict', tree.children[1]))
+        self.assertTupleEqual(check_monophyly(tree, 'ab'), ('rejected', tree))
+        tree = TreeNode.read(['(((a,b),c),(d,));'])
+        obs = root_by_outgroup(tree, 'ab')
+        self.assertEqual(str(obs), '((a,b),(c,(d,)));\n')
 
     def test_cladistic(self):
         tree1 = TreeNode.read(['((i,j)a,b)c;'])
@@ -394,6 +478,15 @@ class TreeTests(TestCase):
         self.assertEqual('mono', cladistic(tree2, ['a', 'b']))
         self.assertEqual('poly', cladistic(tree2, ['g', 'h']))
 
+        # use LCA index
+        index = LCAIndex(tree2)
+        self.assertEqual('uni', cladistic(tree2, ['a'], index))
+        self.assertEqual('mono', cladistic(tree2, 'abcdx', index))
+        self.assertEqual('mono', cladistic(tree2, 'egh', index))
+        self.assertEqual('poly', cladistic(tree2, ['g', 'h'], index))
+        with self.assertRaisesRegex(MissingNodeError, msg):
+            cladistic(tree2, ['y', 'b'], index)
+
     def test_check_monophyly(self):
         newick = '(((a,b)n4,(c,d)n5,(e,f)n6)n2,(g,(h,i)n7)n3)n1;'
         tree = TreeNode.read([newick])
@@ -410,6 +503,20 @@ class TreeTests(TestCase):
         self.assertListEqual([res[0], res[1].name], ['rejected', 'n2'])
         res = check_monophyly(tree, 'abcdef')
         self.assertListEqual([res[0], res[1].name], ['strict', 'n2'])
+        res = check_monophyly(tree, 'hi')
+        self.assertListEqual([res[0], res[1].name], ['strict', 'n7'])
+        res = check_monophyly(tree, 'ghi')
+        self.assertListEqual([res[0], res[1].name], ['strict', 'n3'])
+        res = check_monophyly(tree, 'abx')
+        self.assertListEqual([res[0], res[1].name], ['rejected', 'n1'])
+
+        # use LCA index
+        index = LCAIndex(tree)
+        for taxa in ('a', 'ab', 'abc', 'abcd', 'abcde', 'abcdef', 'hi',
+                     'ghi', 'abx', 'abcdefghi', 'abcdefg', ''):
+            obs = check_monophyly(tree, taxa, index)
+            exp = check_monophyly(tree, taxa)
+            self.assertTupleEqual(obs, exp)
 
     def test_compare_length(self):
         tree = TreeNode.read(['((a:1.000000001,(b:1.000000002,c:1):1):3,f)g;'])
@@ -470,6 +577,61 @@ class TreeTests(TestCase):
         tree6 = TreeNode.read(['(f:1, ((a:1, b:1)c:1 ,d:1)e:1)g:1;'])
         self.assertFalse(compare_branch_lengths(tree6, tree1))
 
+        # extra taxa
+        tree9 = TreeNode.read(['((a:1,(b:1,c:1)d:1)e:1,(f:1,h:1):1)g:1;'])
+        self.assertFalse(compare_branch_lengths(tree1, tree9))
+        self.assertFalse(compare_branch_lengths(tree9, tree1))
+
+        # unnamed tips cannot be matched
+        tree11 = TreeNode.read(['((a:1,b:1):1,(c:1,:1):1);'])
+        tree12 = TreeNode.read(['((a:1,b:1):1,(c:1,:1):1);'])
+        self.assertFalse(compare_branch_lengths(tree11, tree12))
+        obs = compare_branch_lengths(tree11, tree12, report=True)
+        self.assertListEqual([(x is None, y is None) for x, y in obs],
+                             [(False, True)] * 2 + [(True, False)] * 2)
+        self.assertEqual(len(obs[0][0].children), 2)
+        self.assertTrue(obs[1][0].is_tip())
+        self.assertFalse(compare_branch_lengths(
+            tree11, TreeNode.read(['((a:1,b:1):1,c:1);'])))
+
+        # neither can duplicated tips
+        tree11 = TreeNode.read(['((a:1,b:1):1,(a:1,c:1):1);'])
+        tree12 = TreeNode.read(['((a:1,b:1):1,(a:1,c:1):1);'])
+        self.assertFalse(compare_branch_lengths(tree11, tree12))
+        obs = compare_branch_lengths(tree11, tree12, report=True)
+        self.assertEqual(len(obs), 8)
+        self.assertListEqual([x.name for x, _ in obs[:4]],
+                             [None, 'a', None, 'a'])
+
+        # numeric tolerance
+        tree10 = TreeNode.read(['((a:1.001,(b:1,c:1)d:1)e:1,f:1)g:1;'])
+        self.assertFalse(compare_branch_lengths(tree1, tree10))
+        self.assertTrue(compare_branch_lengths(tree1, tree10, rel_tol=0.01))
+        self.assertTrue(compare_branch_lengths(tree1, tree10, abs_tol=0.01))
+
+        # single-child nodes
+        tree11 = TreeNode.read(['(((a:1):2,(b:1,c:1)d:1)e:1,f:1)g:1;'])
+        tree12 = TreeNode.read(['(((a:1):3,(b:1,c:1)d:1)e:1,f:1)g:1;'])
+        self.assertTrue(compare_branch_lengths(tree11, tree11.copy()))
+        self.assertFalse(compare_branch_lengths(tree11, tree12))
+        self.assertFalse(compare_branch_lengths(tree1, tree11))
+
+        # report all mismatches
+        self.assertListEqual(compare_branch_lengths(
+            tree1, tree3, report=True), [])
+        obs = compare_branch_lengths(tree4, tree1, report=True)
+        self.assertListEqual([(x.name, y.name) for x, y in obs],
+                             [('a', 'a')])
+        tree13 = TreeNode.read(['((a:2,(b:1,c:3)d:1)e:1,f:1)g:1;'])
+        tree14 = TreeNode.read(['(((a:1,b:1)h:1,c:1)e:1,f:1)g:1;'])
+        obs = compare_branch_lengths(tree13, tree14, report=True)
+        obs = [tuple(None if x is None else x.name for x in y) for y in obs]
+        self.assertListEqual(obs, [('a', 'a'), ('c', 'c'), ('d', None),
+                                   (None, 'h')])
+        obs = compare_branch_lengths(tree12, tree11, report=True)
+        self.assertListEqual([(x.length, y.length) for x, y in obs],
+                             [(3.0, 2.0)])
+
         tree9 = TreeNode.read(['(((a:1,b:1)c:1,(d:1,e:1)f:1)g:1,h:1)i:1;'])
         tree10 = TreeNode.read(['(((a:1,b:1)c:1,(d:1,e:1)g:1)f:1,h:1)i:1;'])
         self.assertTrue(compare_branch_lengths(tree9, tree10))
@@ -730,6 +892,38 @@ class TreeTests(TestCase):
         }
         self.assertDictEqual(obs, exp)
 
+        # summary mode
+        nwks = ['((((A,B)n9,C)n8,(D,E)n7)n4,((F,G)n6,(H,I)n5)n3,(J,K)n2)n1;',
+                '((((((a,b),c),d),e),(f,(g,h))),((i,j),k),(l)m)n;']
+
+        # caterpillar trees, in which the median moves towards the root
+        # (tips added to the left) or the tips (tips added to the right)
+        nwk = 't0'
+        for i in range(1, 40):
+            nwk = '(%s,t%d)' % (nwk, i) if i % 5 else '(t%d,%s)' % (i, nwk)
+        nwks.append(nwk + ';')
+        nwk = '(((((((a,b),((c,d),e)),f),g),h),i),(j,(k,(l,(m,n)))));'
+        nwks.append(nwk)
+        for nwk in nwks:
+            exp = TreeNode.read([nwk])
+            calc_split_metrics(exp)
+            obs = TreeNode.read([nwk])
+            calc_split_metrics(obs, summary=True)
+            for x, y in zip(obs.traverse(), exp.traverse()):
+                self.assertFalse(hasattr(x, 'postlevels'))
+                self.assertFalse(hasattr(x, '_levels'))
+                self.assertEqual(x.n, y.n)
+                self.assertEqual(x.splits, y.splits)
+                self.assertEqual(x.prelevel, y.prelevel)
+                self.assertEqual(x.lmin, min(y.postlevels))
+                self.assertEqual(x.lmax, max(y.postlevels))
+                self.assertAlmostEqual(x.lmean, mean(y.postlevels))
+                self.assertEqual(x.lmedian, median(y.postlevels))
+                if y.n > 1:
+                    self.assertAlmostEqual(x.lstdev, stdev(y.postlevels))
+                else:
+                    self.assertIsNone(x.lstdev)
+
     def test_calc_length_metrics(self):
         """Example from Fig. 1a of Parks et al. (2018):
                                    /--1--A
@@ -759,6 +953,48 @@ class TreeTests(TestCase):
                'E': {'height': 3.0, 'depths': [0.0], 'red': 1.0}}
         self.assertDictEqual(obs, exp)
 
+        # summary mode
+        calc_length_metrics(tree, summary=True)
+        for node in tree.traverse(include_self=True):
+            self.assertEqual(node.dmin, min(node.depths))
+            self.assertEqual(node.dmax, max(node.depths))
+            self.assertAlmostEqual(node.dmean, mean(node.depths))
+            self.assertEqual(node.dmedian, median(node.depths))
+            if node.children:
+                self.assertAlmostEqual(node.dstdev, stdev(node.depths))
+            else:
+                self.assertIsNone(node.dstdev)
+            self.assertFalse(hasattr(node, '_n'))
+            self.assertFalse(hasattr(node, '_heap'))
+
+        # a caterpillar tree with decimal branch lengths, of which the mean
+        # is that of exact depths
+        nwk = 't0:0.1'
+        for i in range(1, 60):
+            nwk = '(%s,t%d:0.%02d)n%d:0.%d' % (nwk, i, 60 - i, i, i % 7)
+        tree = TreeNode.read([nwk + ';'])
+        calc_length_metrics(tree)
+        depths = {x.name: x.depths for x in tree.non_tips(include_self=True)}
+        calc_length_metrics(tree, summary=True)
+        for node in tree.non_tips(include_self=True):
+            x = depths[node.name]
+            exact = []
+            for tip in node.tips():
+                exact.append(sum(Fraction(y.length) for y in tip.ancestors()
+                                 if y is not node and node in y.ancestors()
+                                 ) + Fraction(tip.length))
+            self.assertEqual(node.dmean, float(mean(exact)))
+            self.assertAlmostEqual(node.dmean, mean(x))
+            self.assertAlmostEqual(node.dstdev, stdev(x))
+            self.assertAlmostEqual(node.dmedian, median(x))
+        tree = TreeNode.read(['(((A:1,B:1)n3:1,(C:1,D:2)n4:2)n2:2,E:3)n1;'])
+        calc_length_metrics(tree, summary=True)
+        obs = {x.name: (x.height, round(x.red, 7)) for x in tree.traverse(
+            include_self=True)}
+        self.assertDictEqual(obs, {k: (v['height'], v['red']) for k, v in
+                                   exp.items()})
+        self.assertFalse(hasattr(tree, 'depths'))
+
     def test_format_newick(self):
         newick = '((A_1:1.05,B_2:1.68):2.24,(C:0.28,D:1.14):1.73e-10);'
         tree = TreeNode.read([newick])
@@ -830,6 +1066,34 @@ class TreeTests(TestCase):
         exp = TreeNode.read(['(((e,f),g),(a,b),(c,d));'])
         self.assertTrue(_exact_compare(obs, exp))
 
+        # use LCA index
+        index = LCAIndex(tree)
+        for og in ('ab', 'efg', 'a', 'abx', 'cd', 'c'):
+            for unroot in (False, True):
+                obs = root_by_outgroup(tree, og, unroot=unroot, index=index)
+                exp = root_by_outgroup(tree, og, unroot=unroot)
+                self.assertTrue(_exact_compare(obs, exp))
+        with self.assertRaisesRegex(ValueError, 'not monophyletic'):
+            root_by_outgroup(tree, outgroup=['a', 'c'], index=index)
+        with self.assertRaisesRegex(ValueError, 'not monophyletic'):
+            root_by_outgroup(tree, outgroup=['a', 'g'], index=index)
+        with self.assertRaisesRegex(ValueError, 'not a subset'):
+            root_by_outgroup(tree, outgroup='abx', strict=True, index=index)
+        with self.assertRaisesRegex(ValueError, 'None of outgroup'):
+            root_by_outgroup(tree, outgroup=['x', 'y'], index=index)
+        with self.assertRaisesRegex(ValueError, 'entire tree'):
+            root_by_outgroup(tree, outgroup='abcdefg', index=index)
+
+        # input tree is not modified, and index may be built from ArrayTree
+        nwk = str(tree)
+        index = LCAIndex(ArrayTree.from_treenode(tree))
+        self.assertIsNone(index.nodes)
+        for og in ('ab', 'efg', 'c'):
+            obs = root_by_outgroup(tree, og, index=index)
+            exp = root_by_outgroup(tree, og)
+            self.assertTrue(_exact_compare(obs, exp))
+        self.assertEqual(str(tree), nwk)
+
     def test_restore_rooting(self):
         # rooted source
         source = TreeNode.read(['(((e,f),g),((c,d),(b,a)));'])
@@ -856,6 +1120,30 @@ class TreeTests(TestCase):
         with self.assertRaisesRegex(ValueError, msg):
             restore_rooting(source, TreeNode.read(['((a,b),(c,d));']))
 
+    def test_match_taxa(self):
+        tree1 = TreeNode.read(['((a,b)x,(c,d)y)z;'])
+        tree2 = TreeNode.read(['(((b,a)u,d)v,c)w;'])
+        obs = [(x.name, y.name) for x, y in match_taxa(tree1, tree2)]
+        exp = [('z', 'w'), ('x', 'u'), ('a', 'a'), ('b', 'b'), ('c', 'c'),
+               ('d', 'd')]
+        self.assertListEqual(obs, exp)
+
+        # different taxa
+        tree2 = TreeNode.read(['((a,b)u,(c,e)v)w;'])
+        obs = [(x.name, y.name) for x, y in match_taxa(tree1, tree2)]
+        self.assertListEqual(obs, [('x', 'u'), ('a', 'a'), ('b', 'b'),
+                                   ('c', 'c')])
+
+        # unnamed and duplicated tips are not matched
+        tree1 = TreeNode.read(['((a,b)x,(c,)y)z;'])
+        tree2 = TreeNode.read(['((,c)v,(b,a)u)w;'])
+        obs = [(x.name, y.name) for x, y in match_taxa(tree1, tree2)]
+        self.assertListEqual(obs, [('z', 'w'), ('x', 'u'), ('a', 'a'),
+                                   ('b', 'b'), ('c', 'c')])
+        tree2 = TreeNode.read(['((a,b)u,(a,c)v)w;'])
+        obs = [(x.name, y.name) for x, y in match_taxa(tree1, tree2)]
+        self.assertListEqual(obs, [('b', 'b'), ('c', 'c')])
+
     def test_restore_node_labels(self):
         # simple case
         source = TreeNode.read(['((a,b)x,(c,d)y);'])
@@ -871,6 +1159,18 @@ class TreeTests(TestCase):
         exp = TreeNode.read(['((((g,f)93,(e,d)98)x,(c,(a,b)85)90),h);'])
         self.assertTrue(_exact_compare(obs, exp))
 
+        # single-child nodes
+        source = TreeNode.read(['(((a,b)x)y,(c)z);'])
+        target = TreeNode.read(['(((a,b)),(c));'])
+        obs = restore_node_labels(source, target)
+        self.assertEqual(str(obs), '(((a,b)y)y,(c)z);\n')
+
+        # unnamed tips
+        source = TreeNode.read(['((a,b)x,(c,)y,(,)w)z;'])
+        target = TreeNode.read(['((,c),(b,a),(,));'])
+        obs = restore_node_labels(source, target)
+        self.assertEqual(str(obs), '((,c)y,(b,a)x,(,))z;\n')
+
         # a duplicated node label
         msg = 'Duplicated node label "x" found.'
         with self.assertRaisesRegex(ValueError, msg):
@@ -892,6 +1192,19 @@ class TreeTests(TestCase):
             restore_node_order(
                 TreeNode.read(['((((a,b),c),d),(e,(f,g)));']), target)
 
+        # unnamed tips and single-child nodes are paired by their taxa
+        source = TreeNode.read(['((a,(,b))x,((c,),))z;'])
+        target = TreeNode.read(['((,(c,)),((b,),a));'])
+        obs = restore_node_order(source, target)
+        self.assertEqual(str(obs), '((a,(,b)),((c,),));\n')
+        source = TreeNode.read(['(((a,b)),c);'])
+        target = TreeNode.read(['(c,((b,a)x)y);'])
+        obs = restore_node_order(source, target)
+        self.assertEqual(str(obs), '(((a,b)x)y,c);\n')
+        with self.assertRaisesRegex(ValueError, msg):
+            restore_node_order(TreeNode.read(['((a,b),(c,));']),
+                               TreeNode.read(['((a,c),(b,));']))
+
     def test_get_base(self):
         tree = TreeNode.read(['(((a,b)n6,(c,d)n5)n3,((e,f)n4,g)n2)n1;'])
         self.assertEqual(get_base(tree.find('a')).name, 'n3')
@@ -924,6 +1237,15 @@ class TreeTests(TestCase):
         exp = {'n1': 2, 'n2': 2, 'n3': 2, 'n4': 2}
         self.assertDictEqual(obs, exp)
 
+        # split metrics already calculated, with or without summary
+        for summary in (False, True):
+            tree = TreeNode.read(['(((a,b)n3,(c,d)n4)n2,e)n1;'])
+            calc_split_metrics(tree, summary=summary)
+            calc_bidi_minlevels(tree)
+            obs = {x.name: x.minlevel for x in tree.non_tips(
+                include_self=True)}
+            self.assertDictEqual(obs, exp)
+
     def test_calc_bidi_mindepths(self):
         tree = TreeNode.read(['(((a:0.5,b:0.7)n5:1.1,c:1.7)n2:0.3,((d:0.8,'
                               'e:0.6)n6:0.9,(f:1.2,g:0.5)n7:0.8)n3:1.3,'
@@ -937,6 +1259,15 @@ class TreeTests(TestCase):
                'n6': 0.6, 'n7': 0.5}
         self.assertDictEqual(obs, exp)
 
+        # length metrics already calculated, with or without summary
+        for summary in (False, True):
+            tree = TreeNode.read([str(tree)])
+            calc_length_metrics(tree, summary=summary)
+            calc_bidi_mindepths(tree)
+            obs = {x.name: x.mindepth for x in tree.non_tips(
+                include_self=True)}
+            self.assertDictEqual(obs, exp)
+
 
 if __name__ == '__main__':
     main()
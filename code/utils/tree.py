@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 from skbio import TreeNode
-from math import isclose
+from math import isclose, sqrt
+from bisect import bisect_left
+from itertools import islice
+from collections.abc import Set
 from types import MethodType
-from skbio.tree import MissingNodeError
+from utils.arraytree import SplitIndex, merge_medians, heap_median
 
 
 def _extract_support(node, strict=False):
@@ -473,7 +476,7 @@ def _exact_compare(tree1, tree2):
     return True
 
 
-def _compare_length(node1, node2):
+def _compare_length(node1, node2, rel_tol=1e-09, abs_tol=0.0):
     """Private function for compare_branch_lengths. Determines if lengths of the
     two nodes are same.
 
@@ -483,6 +486,10 @@ def _compare_length(node1, node2):
         first node to compare
     node2: skbio.TreeNode
         second node to compare
+    rel_tol: float, optional
+        relative tolerance, as in `math.isclose`
+    abs_tol: float, optional
+        absolute tolerance, as in `math.isclose`
 
     Returns
     -------
@@ -508,12 +515,14 @@ def _compare_length(node1, node2):
         return True
     elif (node1.length is None) ^ (node2.length is None):
         return False
-    elif isclose(node1.length, node2.length) is False:
+    elif isclose(node1.length, node2.length, rel_tol=rel_tol,
+                 abs_tol=abs_tol) is False:
         return False
     return True
 
 
-def compare_branch_lengths(tree1, tree2):
+def compare_branch_lengths(tree1, tree2, rel_tol=1e-09, abs_tol=0.0,
+                           report=False):
     """Returns `True` if each corresponding node in 2 trees has same length.
 
     Parameters
@@ -522,20 +531,32 @@ def compare_branch_lengths(tree1, tree2):
         first tree to compare
     tree2: skbio.TreeNode
         second tree to compare
+    rel_tol: float, optional
+        relative tolerance of branch lengths, as in `math.isclose`
+    abs_tol: float, optional
+        absolute tolerance of branch lengths, as in `math.isclose`
+    report: bool, optional
+        return all mismatching branches instead of `True` or `False`
 
     Returns
     -------
     bool
         `True` if two input trees have same topologies and branch lengths
         `False` otherwise
+    list of tuple of (skbio.TreeNode or None, skbio.TreeNode or None)
+        if `report` is `True`, pairs of matching nodes of which the branch
+        lengths are different, followed by nodes without a matching node in
+        the other tree (paired with None), in preorder
 
     Notes
     -----
     This method compares two unordered trees to check if the two given trees
-    have same topology and same branch lengths. The topology check is done by
-    postorder traversals of the first tree while `find()` the respective nodes
-    in tree 2. Topology of tree2 is determined by storing anchoring nodes in
-    stack temporarily.
+    have same topology and same branch lengths. Nodes are matched by their
+    descending taxa using `SplitIndex` (see `arraytree.py`), therefore all
+    nodes are compared in one pass in linear time. Chains of single-child
+    nodes are matched from bottom up. Internal node names and branch lengths
+    of the roots are not considered. Unnamed tips and tips with duplicated
+    names cannot be matched, and are reported as such.
 
     See Also
     --------
@@ -551,30 +572,41 @@ def compare_branch_lengths(tree1, tree2):
     >>> tree3 = TreeNode.read(['((a:1, c:1):2, b);'])
     >>> print(compare_branch_lengths(tree3, tree1))
     False
+    >>> tree4 = TreeNode.read(['((a:1, c:1.5):2, b:1);'])
+    >>> [(x.name, x.length, y.length) for x, y in compare_branch_lengths(
+    ...     tree4, tree1, report=True)]
+    [('c', 1.5, 1.0)]
     """
-    stack = []  # stack to store nodes in tree2
+    index1 = SplitIndex(tree1)
+    index2 = SplitIndex(tree2, index1.hashes)
+    nodes1, nodes2 = index1.nodes, index2.nodes
+    parent1, parent2 = index1.tree.parent.tolist(), index2.tree.parent.tolist()
+    ntips1, ntips2 = index1.tree.ntips.tolist(), index2.tree.ntips.tolist()
 
-    for count, node in enumerate(tree1.postorder(include_self=False)):
-        if node.is_tip():
-            try:
-                cur = tree2.find(node.name)
-            except MissingNodeError:
-                return False
-        else:
-            if node.id == stack[-1].id:
-                cur = stack.pop()
-            else:
-                return False
+    res = []
+    unmatched1, unmatched2 = set(range(len(nodes1))), set(range(len(nodes2)))
+    for i, j in index1.match(index2):
+        while True:
+            unmatched1.discard(i)
+            unmatched2.discard(j)
+            if i and j and not _compare_length(
+                    nodes1[i], nodes2[j], rel_tol, abs_tol):
+                if not report:
+                    return False
+                res.append((i, j))
+
+            # move up chains of single-child nodes together
+            i_, j_ = parent1[i], parent2[j]
+            if i_ < 0 or j_ < 0 or ntips1[i_] != ntips1[i] or (
+                    ntips2[j_] != ntips2[j]):
+                break
+            i, j = i_, j_
 
-        if _compare_length(node, cur) is False:
-            return False
-        if node.parent.id is None and cur.parent.id is None:
-            cur.parent.id = node.parent.id = str(count)
-        elif (node.parent.id is not None) ^ (cur.parent.id is not None):
-            return False
-        if cur.parent not in stack:
-            stack.append(cur.parent)
-    return True
+    if not report:
+        return not unmatched1 and not unmatched2
+    return ([(nodes1[i], nodes2[j]) for i, j in sorted(res)] +
+            [(nodes1[i], None) for i in sorted(unmatched1)] +
+            [(None, nodes2[j]) for j in sorted(unmatched2)])
 
 
 def order_nodes(tree, increase=True):
@@ -697,6 +729,11 @@ def lca2(tree, taxa):
     a preorder recursion from root until it cannot go further. This algorithm
     is significantly more efficient if it is be executed for multiple times.
 
+    Because tips descending from each node are a contiguous range of tips in
+    preorder, the LCA is the lowest node whose range covers the first and the
+    last query taxa in preorder. Each step of the recursion therefore takes
+    constant time per child.
+
     For performance consideration, this function does not check whether the
     query taxon set has any invalid taxon. This check, and `assign_taxa`,
     should be done prior to triggering this function.
@@ -734,13 +771,31 @@ def lca2(tree, taxa):
     >>> lca2(tree, set('ag')).name
     'n1'
     """
-    for child in tree.children:
-        if taxa.issubset(child.taxa):
-            return lca2(child, taxa)
-    return tree
+    if not tree.taxa.unique:
+        for child in tree.children:
+            if all(x in child.taxa for x in taxa):
+                return lca2(child, taxa)
+        return tree
+    try:
+        ranks = tree.taxa.ranks(taxa)
+    except KeyError:
+        return tree
+    if not ranks:
+        return tree
+    lo, hi = min(ranks), max(ranks)
+
+    # descend into the child whose range covers all query taxa
+    node = tree
+    while True:
+        for child in node.children:
+            if child.taxa.start <= lo and hi < child.taxa.end:
+                node = child
+                break
+        else:
+            return node
 
 
-def cladistic(tree, taxa):
+def cladistic(tree, taxa, index=None):
     """Determines the cladistic property of the given taxon set.
 
     Parameters
@@ -749,6 +804,8 @@ def cladistic(tree, taxa):
         tree for taxa comparison
     taxa : iterable of str
         taxon names
+    index : LCAIndex, optional
+        LCA index of the tree (see `arraytree.py`), for repeated queries
 
     Returns
     -------
@@ -803,11 +860,17 @@ def cladistic(tree, taxa):
     if n == 1:
         return 'uni'
     else:
-        lca = lca2(tree, taxa) if hasattr(tree, 'taxa') else tree.lca(taxa)
+        if index is not None:
+            lca = index.lca(index.ranks(taxa))
+            return 'mono' if index.tree.ntips[lca] == n else 'poly'
+        if hasattr(tree, 'taxa'):
+            lca = lca2(tree, taxa)
+            return 'mono' if lca.taxa.end - lca.taxa.start == n else 'poly'
+        lca = tree.lca(taxa)
         return 'mono' if lca.count(tips=True) == n else 'poly'
 
 
-def check_monophyly(tree, taxa):
+def check_monophyly(tree, taxa, index=None):
     """Check whether a taxon set is monophyletic in a tree, considering
     that the LCA node may be polytomic.
 
@@ -817,6 +880,9 @@ def check_monophyly(tree, taxa):
         query tree
     taxa : iterable of str
         query taxon set to test monophyly
+    index : LCAIndex, optional
+        LCA index built from the tree (see `arraytree.py`), for repeated
+        queries
 
     Returns
     -------
@@ -878,25 +944,74 @@ def check_monophyly(tree, taxa):
     >>> check_monophyly(tree, 'abcdef')[0]
     'strict'
     """
+    if index is not None:
+        return _check_monophyly_index(index, set(taxa))
     if not hasattr(tree, 'taxa'):
         assign_taxa(tree)
     taxa = set(taxa)
     lca = lca2(tree, taxa)
-    if lca.taxa == taxa:
+    if not lca.taxa.unique:
+        if lca.taxa == taxa:
+            return 'strict', lca
+        left, n = taxa, len(taxa)
+        for child in lca.children:
+            left.difference_update(child.taxa)
+            if 0 < n - len(left) < len(child.taxa):
+                return 'rejected', lca
+            n = len(left)
+        return 'relaxed', lca
+    index = tree.taxa.index
+    ranks = sorted(index[x] for x in taxa if x in index)
+    if len(ranks) == len(taxa) == len(lca.taxa):
         return 'strict', lca
 
-    # iteratively test each child clade: monophyly is violated if part of clade
-    # (not all, not none) is covered by the query taxon set
-    left = taxa
-    n = len(left)
+    # test each child clade: monophyly is violated if part of clade (not all,
+    # not none) is covered by the query taxon set
     for child in lca.children:
-        left -= child.taxa
-        if 0 < n - len(left) < len(child.taxa):
+        n = bisect_left(ranks, child.taxa.end) - bisect_left(
+            ranks, child.taxa.start)
+        if 0 < n < len(child.taxa):
             return 'rejected', lca
-        n = len(left)
     return 'relaxed', lca
 
 
+def _check_monophyly_index(index, taxa):
+    """Check whether a taxon set is monophyletic in a tree using an LCA index.
+
+    Parameters
+    ----------
+    index : LCAIndex
+        LCA index built from the query tree
+    taxa : set of str
+        query taxon set to test monophyly
+
+    Returns
+    -------
+    str
+        'strict', 'relaxed' or 'rejected'
+    skbio.TreeNode
+        LCA of query taxon set
+
+    See Also
+    --------
+    check_monophyly
+    """
+    tree, tip_index = index.tree, index.tip_index
+    ranks = sorted(tip_index[x] for x in taxa if x in tip_index)
+
+    # like lca2, LCA is root if any taxon is absent from tree
+    lca = index.lca(ranks) if ranks and len(ranks) == len(taxa) else 0
+    if len(ranks) == len(taxa) == tree.ntips[lca]:
+        return 'strict', index.nodes[lca]
+    for child in tree.get_children(lca).tolist():
+        start = tree.tip_start[child]
+        end = start + tree.ntips[child]
+        n = bisect_left(ranks, end) - bisect_left(ranks, start)
+        if 0 < n < tree.ntips[child]:
+            return 'rejected', index.nodes[lca]
+    return 'relaxed', index.nodes[lca]
+
+
 def support(node):
     """Get support value of a node.
 
@@ -1195,6 +1310,156 @@ def build_taxdump_tree(taxdump):
 # the following functions are to be further unit-tested
 #
 
+class TaxonRange(Set):
+    """Names of tips descending from a node, as a range of tips in a tree.
+
+    Parameters
+    ----------
+    tips : list of str
+        names of all tips in the tree, in preorder
+    index : dict of str : int or list of int
+        name to index (or indices, if the name is duplicated) of each named
+        tip in `tips`
+    start : int
+        index of the first tip descending from the node
+    end : int
+        index after the last tip descending from the node
+
+    Notes
+    -----
+    Tips descending from any node are contiguous in preorder, therefore the
+    descendants of each node can be represented by a range of indices into a
+    list of tips shared by all nodes of a tree, rather than by a set of names.
+    This takes constant memory per node. Membership is tested by looking up
+    the index of a name, and subset tests between ranges of the same tree are
+    performed by comparing their boundaries.
+
+    The object is read-only and behaves like a frozen set of names. Copies
+    share the same list of tips, which is also shared by copies of the tree.
+
+    If tip names are duplicated or missing, the set contains each name once
+    and no `None`, as a set of names would, and the operations which rely on
+    one tip per name fall back to generic set operations.
+    """
+    __slots__ = ('tips', 'index', 'start', 'end')
+
+    def __init__(self, tips, index, start, end):
+        self.tips = tips
+        self.index = index
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+    @property
+    def unique(self):
+        """Whether all tips of the tree are named and their names unique."""
+        return len(self.index) == len(self.tips)
+
+    def __len__(self):
+        if self.unique:
+            return self.end - self.start
+        return sum(1 for _ in self)
+
+    def __iter__(self):
+        it = islice(self.tips, self.start, self.end)
+        if self.unique:
+            return it
+        return (x for x in dict.fromkeys(it) if x is not None)
+
+    def __contains__(self, name):
+        try:
+            i = self.index[name]
+        except (KeyError, TypeError):
+            return False
+        if isinstance(i, list):
+            j = bisect_left(i, self.start)
+            return j < len(i) and i[j] < self.end
+        return self.start <= i < self.end
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _same_tree(self, other):
+        return (isinstance(other, TaxonRange) and other.tips is self.tips
+                and self.unique)
+
+    def __le__(self, other):
+        if self._same_tree(other):
+            return self.start == self.end or (
+                other.start <= self.start and self.end <= other.end)
+        return super().__le__(other)
+
+    def __ge__(self, other):
+        if self._same_tree(other):
+            return other.__le__(self)
+        return super().__ge__(other)
+
+    def __eq__(self, other):
+        if self._same_tree(other):
+            return len(self) == len(other) and self.__le__(other)
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def issubset(self, other):
+        """Test whether every name is in other."""
+        return self.__le__(other if isinstance(other, Set) else set(other))
+
+    def issuperset(self, other):
+        """Test whether every name in other is in the range."""
+        if isinstance(other, Set):
+            return self.__ge__(other)
+        return all(x in self for x in other)
+
+    def union(self, *others):
+        """Return names in the range or in any of others as a set."""
+        return set(self).union(*others)
+
+    def intersection(self, *others):
+        """Return names in the range and in all of others as a set."""
+        return set(self).intersection(*others)
+
+    def difference(self, *others):
+        """Return names in the range but not in others as a set."""
+        return set(self).difference(*others)
+
+    def ranks(self, names):
+        """Get indices of names among all tips of the tree.
+
+        Parameters
+        ----------
+        names : iterable of str
+            names of tips
+
+        Returns
+        -------
+        list of int
+            indices of names in `tips`
+
+        Raises
+        ------
+        KeyError
+            if a name is not found in the tree
+        ValueError
+            if a name is duplicated in the tree
+        """
+        if self._same_tree(names):
+            return list(range(names.start, names.end))
+        res = [self.index[x] for x in names]
+        if any(isinstance(x, list) for x in res):
+            raise ValueError('Duplicated taxon found.')
+        return res
+
+
 def assign_taxa(tree):
     """Append names of descendants to each node as attribute `taxa`.
 
@@ -1209,6 +1474,10 @@ def assign_taxa(tree):
     used as a function. The current function generates an attribute which can
     be reused.
 
+    The attribute is a `TaxonRange`, which behaves like a set of names, but
+    stores only the range of descending tips in a list of tips of the tree.
+    Therefore, this function takes O(n) time and memory.
+
     Examples
     --------
     >>> from skbio import TreeNode
@@ -1219,12 +1488,29 @@ def assign_taxa(tree):
     >>> node = tree.lca([tree.find('a'), tree.find('b')])
     >>> print(sorted(node.taxa))
     ['a', 'b']
+    >>> 'c' in node.taxa
+    False
+    >>> node.taxa <= tree.taxa
+    True
     """
+    tips, index = [], {}
     for node in tree.postorder(include_self=True):
         if node.is_tip():
-            node.taxa = set([node.name])
+            start = len(tips)
+            tips.append(node.name)
+            node.taxa = TaxonRange(tips, index, start, start + 1)
         else:
-            node.taxa = set().union(*[x.taxa for x in node.children])
+            node.taxa = TaxonRange(tips, index, node.children[0].taxa.start,
+                                   node.children[-1].taxa.end)
+    for i, name in enumerate(tips):
+        if name is None:
+            continue
+        j = index.setdefault(name, i)
+        if j != i:
+            if isinstance(j, list):
+                j.append(i)
+            else:
+                index[name] = [j, i]
 
 
 def match_taxa(tree1, tree2):
@@ -1240,6 +1526,15 @@ def match_taxa(tree1, tree2):
     Returns
     -------
     list of tuple of (skbio.TreeNode, skbio.TreeNode)
+        pairs of nodes, in preorder of tree 1
+
+    Notes
+    -----
+    Clades are identified by hashes of their taxa using `SplitIndex` (see
+    `arraytree.py`), therefore matching takes linear time. If multiple nodes
+    have the same taxa (e.g., single-child nodes), the lowest one is used.
+    Unnamed tips and tips with duplicated names are not considered as taxa,
+    therefore they are not matched.
 
     Examples
     --------
@@ -1249,20 +1544,14 @@ def match_taxa(tree1, tree2):
     >>> matches = match_taxa(tree1, tree2)
     >>> len(matches)
     6
-    >>> print([sorted(x[0].taxa) for x in matches])
-    [['a'], ['a', 'b'], ['a', 'b', 'c', 'd'], ['b'], ['c'], ['d']]
+    >>> print([sorted(x.name for x in m[0].tips(include_self=True))
+    ...        for m in matches])
+    [['a', 'b', 'c', 'd'], ['a', 'b'], ['a'], ['b'], ['c'], ['d']]
     """
-    t2ns = []
-    for tree in (tree1, tree2):
-        if not hasattr(tree, 'taxa'):
-            assign_taxa(tree)
-        t2ns.append({','.join(sorted(x.taxa)): x
-                     for x in tree.traverse(include_self=True)})
-    res = []
-    for taxa in sorted(t2ns[0]):
-        if taxa in t2ns[1]:
-            res.append((t2ns[0][taxa], t2ns[1][taxa]))
-    return res
+    index1 = SplitIndex(tree1)
+    index2 = SplitIndex(tree2, index1.hashes)
+    return [(index1.nodes[i], index2.nodes[j])
+            for i, j in index1.match(index2)]
 
 
 def match_label(tree1, tree2):
@@ -1308,13 +1597,15 @@ def match_label(tree1, tree2):
     return res
 
 
-def calc_split_metrics(tree):
+def calc_split_metrics(tree, summary=False):
     """Calculate split-related metrics.
 
     Parameters
     ----------
     tree : skbio.TreeNode
         tree to calculate metrics
+    summary : bool, optional
+        summarize postlevels instead of storing them (default: False)
 
     Notes
     -----
@@ -1328,6 +1619,24 @@ def calc_split_metrics(tree):
     - postlevels : list of int
         numbers of nodes from tips
 
+    If `summary` is True, postlevels will not be stored. Instead, the
+    following summaries of them will be calculated for each node:
+    - lmin, lmax : int
+        minimum and maximum
+    - lmean : float
+        mean
+    - lmedian : int or float
+        median (mean of the two middle values if there is an even number)
+    - lstdev : float or None
+        sample standard deviation (None if the node is a tip)
+
+    In this mode, postlevels of the tips under each node are kept as a
+    histogram of the prelevels of these tips, which do not change as the
+    histogram is passed up the tree, and the histograms of children are
+    merged into the largest one. Therefore, memory usage is linear to the
+    number of nodes, whereas lists of postlevels take O(n * tips) memory on a
+    deep (e.g., caterpillar-like) tree.
+
     These metrics are related to topology but not branch lengths.
 
     See Also
@@ -1370,7 +1679,19 @@ def calc_split_metrics(tree):
     [3, 3, 2]
     >>> tree.find('A').prelevel
     5
+
+    >>> tree = TreeNode.read([newick])
+    >>> calc_split_metrics(tree, summary=True)
+    >>> node = tree.find('n8')
+    >>> node.lmin, node.lmax, node.lmedian
+    (2, 3, 3)
+    >>> round(node.lstdev, 3)
+    0.577
     """
+    if summary:
+        _calc_split_summary(tree)
+        return
+
     # calculate bottom-up metrics
     for node in tree.postorder(include_self=True):
         if node.is_tip():
@@ -1392,13 +1713,134 @@ def calc_split_metrics(tree):
             node.prelevel = node.parent.prelevel + 1
 
 
-def calc_length_metrics(tree):
+def _calc_split_summary(tree):
+    """Calculate split-related metrics with postlevels summarized.
+
+    Parameters
+    ----------
+    tree : skbio.TreeNode
+        tree to calculate metrics
+
+    See Also
+    --------
+    calc_split_metrics
+    """
+    # calculate top-down metrics
+    for node in tree.preorder(include_self=True):
+        if node.is_root():
+            node.prelevel = 1
+        else:
+            node.prelevel = node.parent.prelevel + 1
+
+    # calculate bottom-up metrics, in which each node carries a histogram
+    # and sums (and sums of squares) of prelevels of tips under it, as well
+    # as the lower median and the count of tips below it, which are released
+    # once merged into its parent
+    for node in tree.postorder(include_self=True):
+        if node.is_tip():
+            node.n = 1
+            node.splits = 0
+            node.lmin = node.lmax = node.lmean = node.lmedian = 1
+            node.lstdev = None
+            level = node.prelevel
+            node._levels = ({level: 1}, level, level * level, level, level,
+                            level, 0)
+            continue
+        children = node.children
+        node.n = sum(x.n for x in children)
+        node.splits = sum(x.splits for x in children) + 1
+
+        # merge histograms into the largest one
+        levels = [x._levels for x in children]
+        for child in children:
+            del child._levels
+        hist, sum1, sum2, lo, hi, mid, below = max(
+            levels, key=lambda x: len(x[0]))
+        for other in levels:
+            if other[0] is hist:
+                continue
+            for level, count in other[0].items():
+                hist[level] = hist.get(level, 0) + count
+                if level < mid:
+                    below += count
+            sum1 += other[1]
+            sum2 += other[2]
+            lo = min(lo, other[3])
+            hi = max(hi, other[4])
+
+        # convert prelevels of tips into postlevels from current node
+        n, shift = node.n, node.prelevel - 1
+        node.lmin, node.lmax = lo - shift, hi - shift
+        median, mid, below = _hist_median(hist, n, mid, below)
+        node.lmedian = median - shift
+        node._levels = (hist, sum1, sum2, lo, hi, mid, below)
+        sum2 -= (2 * sum1 - n * shift) * shift
+        sum1 -= n * shift
+        node.lmean = sum1 / n
+        node.lstdev = sqrt((n * sum2 - sum1 * sum1) / (n * (n - 1))) \
+            if n > 1 else None
+    del tree._levels
+
+
+def _hist_median(hist, n, mid, below):
+    """Calculate the median of integers given as a histogram.
+
+    Parameters
+    ----------
+    hist : dict of int : int
+        value to count
+    n : int
+        total count
+    mid : int
+        previous lower median
+    below : int
+        count of values less than `mid`
+
+    Returns
+    -------
+    int or float
+        median, or mean of the two middle values if n is even
+    int
+        current lower median
+    int
+        count of values less than current lower median
+
+    Notes
+    -----
+    The lower median is moved from its previous position one value at a
+    time, therefore the cost is proportional to the distance it moves
+    rather than to the range of values. When the histogram grows by merging
+    a smaller one into it, the median moves little (e.g., by at most one
+    value per node in a caterpillar tree).
+    """
+    k = (n - 1) // 2
+    while below > k:
+        mid -= 1
+        below -= hist.get(mid, 0)
+    while below + hist.get(mid, 0) <= k:
+        below += hist.get(mid, 0)
+        mid += 1
+    if n % 2:
+        return mid, mid, below
+
+    # upper median is the next value if the lower one is the last of its
+    # count below rank n / 2
+    upper, cum = mid, below + hist[mid]
+    while cum <= n // 2:
+        upper += 1
+        cum += hist.get(upper, 0)
+    return (mid + upper) / 2, mid, below
+
+
+def calc_length_metrics(tree, summary=False):
     """Calculate branch length-related metrics.
 
     Parameters
     ----------
     tree : skbio.TreeNode
         tree to calculate metrics
+    summary : bool, optional
+        summarize depths instead of storing them (default: False)
 
     Notes
     -----
@@ -1415,6 +1857,23 @@ def calc_length_metrics(tree):
 
         where p = RED of parent, d = length, u = depth_mean of parent
 
+    If `summary` is True, depths will not be stored. Instead, only their
+    count, sums (and sums of squares), minimum and maximum are carried from
+    children to parents, as well as heaps of heights of tips for medians
+    (see `merge_medians` in `arraytree.py`), and the following attributes
+    will be appended:
+    - dmin, dmax, dmean, dmedian, dstdev : float
+        minimum, maximum, mean, median and sample standard deviation (None
+        for tips) of depths
+
+    This takes memory linear to the number of nodes rather than O(n * tips),
+    and O(n log^2 n) time. Sums are calculated exactly, in integer multiples
+    of the finest unit of branch lengths, such that the mean is that of the
+    exact depths rounded once, as `statistics.mean` calculates from the
+    stored depths (which may themselves carry rounding errors). The median
+    is calculated from heights, which may differ from that of the stored
+    depths in the last digits.
+
     [1] Parks, D. H. et al. A standardized bacterial taxonomy based on genome
         phylogeny substantially revises the tree of life. Nat. Biotechnol. 36,
         996–1004 (2018).
@@ -1444,7 +1903,17 @@ def calc_length_metrics(tree):
     [2.0, 2.0, 3.0, 4.0]
     >>> round(tree.find('n4').red, 3)
     0.752
+
+    >>> tree = TreeNode.read(['(((A:1,B:1)n3:1,(C:1,D:2)n4:2)n2:2,E:3)n1;'])
+    >>> calc_length_metrics(tree, summary=True)
+    >>> node = tree.find('n2')
+    >>> node.dmin, node.dmax, node.dmean
+    (2.0, 4.0, 2.75)
     """
+    if summary:
+        _calc_length_summary(tree)
+        return
+
     # calculate depths
     for node in tree.postorder(include_self=True):
         if node.length is None:
@@ -1470,6 +1939,76 @@ def calc_length_metrics(tree):
                     * (1 - node.parent.red)
 
 
+def _calc_length_summary(tree):
+    """Calculate branch length-related metrics with depths summarized.
+
+    Parameters
+    ----------
+    tree : skbio.TreeNode
+        tree to calculate metrics
+
+    See Also
+    --------
+    calc_length_metrics
+    """
+    # calculate heights, and express branch lengths as integer multiples of
+    # 2^-scale
+    scale = 0
+    for node in tree.preorder(include_self=True):
+        if node.length is None:
+            node.length = 0.0
+        if node.is_root():
+            node.height = 0.0
+        else:
+            node.height = node.parent.height + node.length
+        num, den = node.length.as_integer_ratio()
+        node._len = (num, den.bit_length() - 1)
+        scale = max(scale, node._len[1])
+
+    # calculate count, sums, minimum, maximum and median of depths
+    for node in tree.postorder(include_self=True):
+        num, exp = node._len
+        node._len = num << (scale - exp)
+        if node.is_tip():
+            node._n, node._sum1, node._sum2 = 1, 0, 0
+            node._heap = ([-node.height], [])
+            node.dmin = node.dmax = node.dmean = node.dmedian = 0.0
+            node.dstdev = None
+            continue
+        children = node.children
+        n = sum1 = sum2 = 0
+        for child in children:
+            x, cn, c1 = child._len, child._n, child._sum1
+            n += cn
+            sum1 += c1 + x * cn
+            sum2 += child._sum2 + x * (2 * c1 + x * cn)
+        node._n, node._sum1, node._sum2 = n, sum1, sum2
+        node.dmin = min(x.dmin + x.length for x in children)
+        node.dmax = max(x.dmax + x.length for x in children)
+        node.dmean = sum1 / (n << scale)
+        node.dstdev = sqrt((n * sum2 - sum1 * sum1) / (
+            n * (n - 1) << 2 * scale)) if n > 1 else None
+        heap = children[0]._heap
+        for child in children:
+            if child._heap is not heap:
+                heap = merge_medians(heap, child._heap)
+            del child._heap
+        node._heap = heap
+        node.dmedian = heap_median(heap) - node.height
+
+    # calculate RED
+    del tree._heap
+    for node in tree.preorder(include_self=True):
+        del node._len, node._n, node._sum1, node._sum2
+        if node.is_root():
+            node.red = 0.0
+        elif node.is_tip():
+            node.red = 1.0
+        else:
+            node.red = node.parent.red + node.length \
+                / (node.length + node.dmean) * (1 - node.parent.red)
+
+
 #
 # the following functions are to be unit-tested
 #
@@ -1580,7 +2119,7 @@ def format_newick(tree, keep_space=False, max_f=None, max_e=None):
     return res
 
 
-def root_by_outgroup(tree, outgroup, strict=False, unroot=False):
+def root_by_outgroup(tree, outgroup, strict=False, unroot=False, index=None):
     """Root a tree with a given set of taxa as outgroup.
 
     Parameters
@@ -1594,6 +2133,11 @@ def root_by_outgroup(tree, outgroup, strict=False, unroot=False):
     unroot : bool (optional)
         result is an unrooted tree (thus "root" has three child clades)
         (default: false)
+    index : LCAIndex (optional)
+        LCA index built from the tree (see `arraytree.py`), with which the
+        outgroup is located without scanning the tree, provided that the
+        index was built from this TreeNode object (thus having its nodes in
+        preorder)
 
     Returns
     -------
@@ -1669,21 +2213,40 @@ def root_by_outgroup(tree, outgroup, strict=False, unroot=False):
                         \\-d
     """
     # select taxa that are present in tree
-    og = set(outgroup).intersection(tree.subset())
+    og = set(outgroup).intersection(
+        tree.subset() if index is None else index.tip_index)
 
     n = len(og)
     if strict and n < len(outgroup):
         raise ValueError('Outgroup is not a subset of tree taxa.')
     if n == 0:
         raise ValueError('None of outgroup taxa are present in tree.')
-    if n == tree.count(tips=True):
+    if n == (tree.count(tips=True) if index is None
+             else index.tree.ntips[0]):
         raise ValueError('Outgroup constitutes the entire tree.')
 
+    # locate lowest common ancestor (LCA) of outgroup in the target tree
+    if index is not None:
+        lca = index.lca(index.ranks(og))
+        if lca > 0:
+            if index.tree.ntips[lca] > n:
+                raise ValueError('Outgroup is not monophyletic in tree.')
+
+            # re-rooting copies nodes, therefore the original tree is used
+            if index.nodes is not None:
+                lca = index.nodes[lca]
+            else:
+                lca = next(islice(tree.preorder(include_self=True), lca,
+                                  None))
+            return unroot_at(lca.parent) if unroot else root_above(lca)
+
     # create new tree
     res = tree.copy()
 
-    # locate lowest common ancestor (LCA) of outgroup in the target tree
-    lca = res.lca(og) if n > 1 else res.find(max(og))
+    if index is not None:
+        lca = res
+    else:
+        lca = res.lca(og) if n > 1 else res.find(max(og))
 
     # if LCA is root rather than derived (i.e., outgroup is split across basal
     # clades), swap the tree and locate LCA again
@@ -1802,7 +2365,8 @@ def restore_node_labels(source, target):
     -----
     Labels are assigned based on exact match of all descending taxa. Taxa in
     the source and target trees do not have to be identical. Original labels
-    in the target tree, if any, will be overwritten.
+    in the target tree, if any, will be overwritten. Clades are matched using
+    `SplitIndex` (see `arraytree.py`).
 
     Examples
     --------
@@ -1814,27 +2378,29 @@ def restore_node_labels(source, target):
     ((((g,f)93,(e,d)98)x,(c,(a,b)85)90),h);
     <BLANKLINE>
     """
-    # assign taxa to internal nodes
-    for tree in (source, target):
-        if not hasattr(tree, 'taxa'):
-            assign_taxa(tree)
-
-    # read descendants under each node label in source tree
-    label2taxa = {}
-    for node in source.non_tips(include_self=True):
+    # read clade under each node label in source tree
+    src = SplitIndex(source)
+    labels, clade2label = set(), {}
+    for i in reversed(range(len(src.nodes))):
+        node = src.nodes[i]
         label = node.name
-        if label is not None and label != '':
-            if label in label2taxa:
+        if node.children and label is not None and label != '':
+            if label in labels:
                 raise ValueError('Duplicated node label "%s" found.' % label)
-            label2taxa[label] = ','.join(sorted(node.taxa))
-    taxa2label = {v: k for k, v in label2taxa.items()}
+            labels.add(label)
+            j = src.clades.get(src.keys[i])
+            if j is not None:
+                clade2label[j] = label
 
     # identify and mark matching nodes per node label in target tree
     res = target.copy()
-    for node in res.non_tips(include_self=True):
-        taxa = ','.join(sorted(node.taxa))
-        if taxa in taxa2label:
-            node.name = taxa2label[taxa]
+    tgt = SplitIndex(res, src.hashes)
+    tgt2src = {j: i for i, j in src.match(tgt)}
+    for j, node in enumerate(tgt.nodes):
+        if node.children:
+            i = tgt2src.get(tgt.clades.get(tgt.keys[j]))
+            if i in clade2label:
+                node.name = clade2label[i]
 
     return res
 
@@ -1869,26 +2435,38 @@ def restore_node_order(source, target):
         raise ValueError('Two trees have different sizes.')
 
     # find matching nodes
-    matches = match_taxa(source, target)
-    if n != len(matches):
-        raise ValueError('Two trees have different topologies.')
-
-    def taxastr(node):
-        return ','.join(sorted(node.taxa))
-
-    taxa2src = {taxastr(x[0]): x[0] for x in matches
-                if not x[0].is_tip()}
-
-    # re-order child nodes under each internal node
     res = target.copy()
-    for node in res.non_tips(include_self=True):
-        src_node = taxa2src[taxastr(node)]
-        taxa2child = {}
-        for child in node.children:
-            taxa2child[taxastr(child)] = child
+    src = SplitIndex(source)
+    tgt = SplitIndex(res, src.hashes)
+    src2tgt = dict(src.match(tgt))
+    matched = set(src2tgt.values())
+    src2tgt.setdefault(0, 0)
+
+    # re-order child nodes under each internal node, from top to bottom, in
+    # which children without a matching node (e.g., unnamed tips) are paired
+    # with those left in the target node with the same named taxa, in their
+    # original order
+    for i, src_node in enumerate(src.nodes):
+        if not src_node.children:
+            continue
+        j = src2tgt[i]
+        children, left = set(), {}
+        for k in reversed(tgt.tree.get_children(j).tolist()):
+            children.add(k)
+            if k not in matched:
+                left.setdefault(tgt.keys[k], []).append(k)
+        node = tgt.nodes[j]
         node.children = []
-        for child in src_node.children:
-            node.append(taxa2child[taxastr(child)])
+        for child in src.tree.get_children(i).tolist():
+            k = src2tgt.get(child)
+            if k is None:
+                same = left.get(src.keys[child])
+                k = src2tgt[child] = same.pop() if same else None
+            if k is None or k not in children:
+                raise ValueError('Two trees have different topologies.')
+            node.append(tgt.nodes[k])
+        if len(node.children) != len(children):
+            raise ValueError('Two trees have different topologies.')
 
     return res
 
@@ -1948,7 +2526,7 @@ def calc_bidi_minlevels(tree):
     - minlevel : int
         minimum level of current node to tree's surface
 
-    Will execute calc_split_metrics if not already.
+    Will execute calc_split_metrics (in summary mode) if not already.
 
     See Also
     --------
@@ -2000,11 +2578,18 @@ def calc_bidi_minlevels(tree):
     unrooted = int(len(tree.children) != 2)
 
     # execute calc_split_metrics if not yet
-    if not hasattr(tree, 'postlevels'):
-        calc_split_metrics(tree)
+    if not hasattr(tree, 'lmin') and not hasattr(tree, 'postlevels'):
+        calc_split_metrics(tree, summary=True)
+
+    # minimum postlevel, either summarized or from a list
+    def lmin(node):
+        try:
+            return node.lmin
+        except AttributeError:
+            return min(node.postlevels)
 
     # root's minlevel is the min of all descendants (single direction)
-    tree.minlevel = min(tree.postlevels)
+    tree.minlevel = lmin(tree)
 
     # internal node's minlevel is the min of post- and pre-direction
     for node in tree.preorder(include_self=False):
@@ -2017,14 +2602,14 @@ def calc_bidi_minlevels(tree):
         # basal nodes: compare siblings, consider (un)rooting
         if node.parent.is_root():
             node.minlevel_above = 1 + unrooted + \
-                min(min(x.postlevels) for x in tree.children if x is not node)
+                min(lmin(x) for x in tree.children if x is not node)
 
         # derived nodes: increment from parent
         else:
             node.minlevel_above = node.parent.minlevel_above + 1
 
         # minimum level of post- and pre-direction levels
-        node.minlevel = min(node.minlevel_above, min(node.postlevels))
+        node.minlevel = min(node.minlevel_above, lmin(node))
 
     # clean up
     for node in tree.non_tips(include_self=False):
@@ -2046,7 +2631,7 @@ def calc_bidi_mindepths(tree):
     - mindepth : float
         minimum depth of current node to tree's surface
 
-    Will execute calc_length_metrics if not already.
+    Will execute calc_length_metrics (in summary mode) if not already.
 
     See Also
     --------
@@ -2088,19 +2673,27 @@ def calc_bidi_mindepths(tree):
     >>> tree.find('n2').mindepth
     1.5
     """
-    if not hasattr(tree, 'depths'):
-        calc_length_metrics(tree)
-    tree.mindepth = min(tree.depths)
+    if not hasattr(tree, 'dmin') and not hasattr(tree, 'depths'):
+        calc_length_metrics(tree, summary=True)
+
+    # minimum depth, either summarized or from a list
+    def dmin(node):
+        try:
+            return node.dmin
+        except AttributeError:
+            return min(node.depths)
+
+    tree.mindepth = dmin(tree)
     for node in tree.preorder(include_self=False):
         if node.is_tip():
             node.mindepth = 0.0
             continue
         if node.parent.is_root():
             node.mindepth_above = node.length + \
-                min(min(x.depths) + x.length for x in tree.children
+                min(dmin(x) + x.length for x in tree.children
                     if x is not node)
         else:
             node.mindepth_above = node.parent.mindepth_above + node.length
-        node.mindepth = min(node.mindepth_above, min(node.depths))
+        node.mindepth = min(node.mindepth_above, dmin(node))
     for base in tree.non_tips(include_self=False):
         delattr(base, 'mindepth_above')